@@ -0,0 +1,72 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Cold start (since=0) header sync time as a single request and split into
+# concurrent time windows, against a store whose responses are limited by
+# per connection bandwidth.
+#
+#   python bench-bootstrap.py [nmessages] [bytes per second]
+
+from ciphrtxt.network import MsgStore, CTClient
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message
+import sys
+import time
+
+nmsgs = 1000
+bandwidth = 1000000
+if len(sys.argv) > 1:
+    nmsgs = int(sys.argv[1])
+if len(sys.argv) > 2:
+    bandwidth = int(sys.argv[2])
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+
+server = LocalMsgStore(latency=0.02, bandwidth=bandwidth).start()
+print('encoding ' + str(nmsgs) + ' messages')
+now = int(time.time())
+week = 7 * 24 * 3600
+for i in range(0, nmsgs):
+    msg = Message.encode('benchmark message %d' % i, Bpub, Apriv, nbits=4)
+    server.add_message(msg.serialize(), now=now - ((i * week) // nmsgs))
+
+print('%8s %10s %10s' % ('windows', 'seconds', 'headers'))
+with CTClient(pool_size=32) as c:
+    for windows in (1, 2, 4, 8, 16):
+        m = MsgStore(server.host, server.port)
+        m.refresh()
+        t0 = time.time()
+        hdrs = m.get_headers(windows=windows)
+        elapsed = time.time() - t0
+        assert len(hdrs) == nmsgs
+        print('%8d %10.3f %10d' % (windows, elapsed, len(hdrs)))
+
+server.stop()
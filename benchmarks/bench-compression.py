@@ -0,0 +1,78 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Size on the wire and sync time of the headers endpoint with and without
+# gzip response encoding, using the local stand-in server.
+#
+#   python bench-compression.py [nmessages]
+
+from ciphrtxt.network import MsgStore, CTClient
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message
+import http.client
+import sys
+import time
+
+nmsgs = 2000
+if len(sys.argv) > 1:
+    nmsgs = int(sys.argv[1])
+rounds = 5
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+
+plain = LocalMsgStore().start()
+gzipped = LocalMsgStore(compress=True).start()
+print('encoding ' + str(nmsgs) + ' messages')
+for i in range(0, nmsgs):
+    raw = Message.encode('benchmark message %d' % i, Bpub, Apriv, nbits=4).serialize()
+    plain.add_message(raw)
+    gzipped.add_message(raw)
+
+def wire_size(server):
+    conn = http.client.HTTPConnection(server.host, server.port)
+    conn.request('GET', '/api/v2/headers?since=0', headers={'Accept-Encoding': 'gzip'})
+    n = len(conn.getresponse().read())
+    conn.close()
+    return n
+
+with CTClient() as c:
+    for label, server in (('identity', plain), ('gzip', gzipped)):
+        size = wire_size(server)
+        for stream in (False, True):
+            t0 = time.time()
+            for r in range(0, rounds):
+                ms = MsgStore(server.host, server.port)
+                assert len(ms.get_headers(stream=stream)) == nmsgs
+            t = (time.time() - t0) / rounds
+            print('%-9s stream=%-5s %10d bytes %8.3f s' % (label, stream, size, t))
+
+plain.stop()
+gzipped.stop()
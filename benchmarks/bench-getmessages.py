@@ -0,0 +1,77 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Throughput of MsgStore.get_messages (bounded parallel download) against
+# sequential get_message calls, using the local stand-in server.
+#
+#   python bench-getmessages.py [nmessages]
+
+from ciphrtxt.network import MsgStore, CTClient
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message
+import sys
+import time
+
+nmsgs = 200
+if len(sys.argv) > 1:
+    nmsgs = int(sys.argv[1])
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+
+server = LocalMsgStore().start()
+print('encoding ' + str(nmsgs) + ' messages')
+for i in range(0, nmsgs):
+    msg = Message.encode('benchmark message %d ' % i + ('x' * 1000), Bpub, Apriv, nbits=4)
+    server.add_message(msg.serialize())
+
+def report(label, t, n):
+    print('%-28s %8.3f s %8.1f msg/s' % (label, t, n / t))
+
+with CTClient() as c:
+    ms = MsgStore(server.host, server.port)
+    hdrs = ms.get_headers()
+    assert len(hdrs) == nmsgs
+
+    t0 = time.time()
+    for h in hdrs:
+        assert ms.get_message(h) is not None
+    report('sequential get_message', time.time() - t0, nmsgs)
+
+    for concurrency in (1, 4, 16, 64):
+        t0 = time.time()
+        n = 0
+        for (h, m, err) in ms.get_messages(hdrs, concurrency=concurrency):
+            assert err is None
+            n += 1
+        assert n == nmsgs
+        report('get_messages concurrency=%d' % concurrency, time.time() - t0, nmsgs)
+
+server.stop()
@@ -0,0 +1,109 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Sync, download and onion request throughput against local stand-in
+# servers with injected latency and bandwidth, so that results are
+# reproducible on one machine.
+#
+#   python bench-network.py [latency_ms] [bandwidth_bytes_per_s] [nmessages]
+
+from ciphrtxt.network import MsgStore, CTClient, BinaryOnionRequest
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message
+from ciphrtxt.nak import NAK
+import sys
+import time
+
+latency = 0.020
+bandwidth = 10000000
+nmsgs = 100
+if len(sys.argv) > 1:
+    latency = float(sys.argv[1]) / 1000.0
+if len(sys.argv) > 2:
+    bandwidth = int(sys.argv[2])
+if len(sys.argv) > 3:
+    nmsgs = int(sys.argv[3])
+maxhops = 3
+rounds = 5
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+nak = NAK()
+nak.randomize()
+
+servers = [LocalMsgStore(latency=latency, bandwidth=bandwidth).start()
+           for i in range(0, maxhops)]
+target = servers[-1]
+print('encoding ' + str(nmsgs) + ' messages')
+for i in range(0, nmsgs):
+    msg = Message.encode('benchmark message %d ' % i + ('x' * 1000), Bpub, Apriv, nbits=4)
+    target.add_message(msg.serialize())
+print('latency %.1f ms, bandwidth %d bytes/s' % (latency * 1000.0, bandwidth))
+
+def report(label, t, n=None):
+    if n is None:
+        print('%-32s %8.3f s' % (label, t))
+    else:
+        print('%-32s %8.3f s %8.1f /s' % (label, t, n / t))
+
+with CTClient() as c:
+    for stream in (False, True):
+        t0 = time.time()
+        for r in range(0, rounds):
+            ms = MsgStore(target.host, target.port)
+            hdrs = ms.get_headers(stream=stream)
+            assert len(hdrs) == nmsgs
+        report('header sync stream=%s' % stream, (time.time() - t0) / rounds)
+
+    t0 = time.time()
+    for h in hdrs:
+        assert ms.get_message(h) is not None
+    report('sequential get_message', time.time() - t0, nmsgs)
+    for concurrency in (4, 16):
+        fresh = MsgStore(target.host, target.port)
+        hdrs = fresh.get_headers()
+        t0 = time.time()
+        n = len([m for (h, m, err) in fresh.get_messages(hdrs, concurrency=concurrency) if err is None])
+        assert n == nmsgs
+        report('get_messages concurrency=%d' % concurrency, time.time() - t0, nmsgs)
+
+    hosts = [MsgStore(s.host, s.port) for s in servers]
+    for h in hosts:
+        assert h.refresh()
+    for label, cls in (('json', None), ('v2', BinaryOnionRequest)):
+        hosts[-1].request_class = cls
+        for hops in range(1, maxhops + 1):
+            t0 = time.time()
+            for r in range(0, rounds):
+                assert hosts[-1].get('api/v2/time/', nak=nak, onions=hosts[:hops - 1]) is not None
+            report('onion %s %d hops' % (label, hops), (time.time() - t0) / rounds)
+
+for s in servers:
+    s.stop()
@@ -0,0 +1,83 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Onion request size and latency against hop count for the JSON and the
+# binary (v2) onion formats, using local stand-in relays.
+#
+#   python bench-onion.py [maxhops] [bodysize]
+
+from ciphrtxt.network import MsgStore, CTClient, OnionRequest, BinaryOnionRequest
+from ciphrtxt.network import _upload_message
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.nak import NAK
+import base64
+import sys
+import time
+
+maxhops = 4
+bodysize = 4096
+if len(sys.argv) > 1:
+    maxhops = int(sys.argv[1])
+if len(sys.argv) > 2:
+    bodysize = int(sys.argv[2])
+rounds = 20
+
+nak = NAK()
+nak.randomize()
+
+servers = [LocalMsgStore().start() for i in range(0, maxhops)]
+c = CTClient().open()
+hosts = [MsgStore(s.host, s.port, client=c) for s in servers]
+for h in hosts:
+    assert h.refresh()
+target = hosts[-1]
+target.request_class = BinaryOnionRequest
+body = 'x' * bodysize
+
+def json_size(onions):
+    req = OnionRequest(c)
+    outer = req._wrap(target, req._format_post(_upload_message, body, None))
+    for o in reversed(onions):
+        outer = req._wrap(o, outer)
+    naksig = req._nakit(nak, outer['body'])
+    return len(base64.b64encode(nak.pubkeybin() + naksig + outer['body']))
+
+print('body %d bytes' % bodysize)
+print('%5s %12s %12s %12s' % ('hops', 'json bytes', 'v2 bytes', 'v2 GET ms'))
+for n in range(1, maxhops + 1):
+    onions = hosts[:n - 1]
+    entry, packet = BinaryOnionRequest(c).encode(target, _upload_message, body, 'POST', nak, onions)
+    t0 = time.time()
+    for r in range(0, rounds):
+        assert target.get('api/v2/time/', nak=nak, onions=onions) is not None
+    t = (time.time() - t0) / rounds
+    print('%5d %12d %12d %12.2f' % (n, json_size(onions), len(packet), t * 1000.0))
+
+c.close()
+for s in servers:
+    s.stop()
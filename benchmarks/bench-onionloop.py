@@ -0,0 +1,99 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# IOLoop responsiveness while 100 onion routed fetches are in flight, with
+# replies decrypted inline on the loop or in the reply executor. A ticker
+# coroutine records how late each 1 ms sleep wakes up.
+#
+#   python bench-onionloop.py [nfetches] [hops]
+
+from ciphrtxt.network import MsgStore, CTClient, BinaryOnionRequest
+from ciphrtxt.network import set_reply_executor
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.nak import NAK
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+import asyncio
+import sys
+import time
+
+nfetch = 100
+hops = 2
+if len(sys.argv) > 1:
+    nfetch = int(sys.argv[1])
+if len(sys.argv) > 2:
+    hops = int(sys.argv[2])
+
+
+class InlineExecutor (Executor):
+    # runs the reply decryption on the calling (loop) thread
+    def submit(self, fn, *args, **kwargs):
+        f = Future()
+        f.set_result(fn(*args, **kwargs))
+        return f
+
+
+nak = NAK()
+nak.randomize()
+servers = [LocalMsgStore().start() for i in range(0, hops)]
+
+async def run(label):
+    c = CTClient(max_clients=nfetch).open()
+    hosts = [MsgStore(s.host, s.port, client=c) for s in servers]
+    for h in hosts:
+        assert h.refresh()
+    target = hosts[-1]
+    lag = []
+    done = False
+    async def ticker():
+        while not done:
+            t0 = time.time()
+            await asyncio.sleep(0.001)
+            lag.append(time.time() - t0 - 0.001)
+    tick = asyncio.ensure_future(ticker())
+    t0 = time.time()
+    futures = [BinaryOnionRequest(c).fetch_async(target, 'api/v2/headers?since=0', nak=nak, onions=hosts[:-1])
+               for i in range(0, nfetch)]
+    results = await asyncio.gather(*futures)
+    t = time.time() - t0
+    done = True
+    await tick
+    assert all(r is not None for r in results)
+    c.close()
+    lag.sort()
+    print('%-10s %8.3f s  loop lag mean %6.2f ms  p99 %6.2f ms  max %6.2f ms' %
+          (label, t, 1000.0 * sum(lag) / len(lag), 1000.0 * lag[int(len(lag) * 0.99)],
+           1000.0 * lag[-1]))
+
+print('%d concurrent fetches through %d hops' % (nfetch, hops))
+set_reply_executor(InlineExecutor())
+asyncio.run(run('inline'))
+set_reply_executor(ThreadPoolExecutor(max_workers=4))
+asyncio.run(run('executor'))
+
+for s in servers:
+    s.stop()
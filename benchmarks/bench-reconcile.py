@@ -0,0 +1,95 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Bytes on the wire and time for a full headers?since=0 resync against a
+# Bloom filter reconcile, for clients which already hold a fraction of the
+# server's headers (e.g. after switching stores or with a skewed clock).
+#
+#   python bench-reconcile.py [nmessages]
+
+from ciphrtxt.network import MsgStore, CTClient
+from ciphrtxt.bloom import BloomFilter
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.message import RawMessageHeader
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message
+import http.client
+import sys
+import time
+
+nmsgs = 2000
+if len(sys.argv) > 1:
+    nmsgs = int(sys.argv[1])
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+
+server = LocalMsgStore(compress=True).start()
+print('encoding ' + str(nmsgs) + ' messages')
+for i in range(0, nmsgs):
+    msg = Message.encode('benchmark message %d' % i, Bpub, Apriv, nbits=4)
+    server.add_message(msg.serialize())
+allhdrs = []
+for hstr in server.headers_since(0):
+    allhdrs.append(RawMessageHeader.deserialize(hstr.encode()))
+
+def wire(method, path, body=None, gzip=False):
+    headers = {}
+    if gzip:
+        headers['Accept-Encoding'] = 'gzip'
+    conn = http.client.HTTPConnection(server.host, server.port)
+    conn.request(method, path, body=body, headers=headers)
+    n = len(conn.getresponse().read())
+    conn.close()
+    return n
+
+print('%6s %5s %12s %12s %12s %10s %10s' % ('held', 'gzip', 'since bytes', 'filter', 'reconcile', 'since s', 'recon s'))
+with CTClient() as c:
+    for held in (0.0, 0.5, 0.9, 0.99):
+        have = allhdrs[:int(nmsgs * held)]
+        bloom = BloomFilter.for_capacity(len(have))
+        for h in have:
+            bloom.add(h.Iraw())
+        fbytes = len(bloom.serialize())
+        for gz in (False, True):
+            sbytes = wire('GET', '/api/v2/headers?since=0', gzip=gz)
+            rbytes = wire('POST', '/api/v2/headers/reconcile', bloom.serialize(), gzip=gz)
+            m = MsgStore(server.host, server.port)
+            m.headers = list(have)
+            t0 = time.time()
+            assert len(m.get_headers()) == nmsgs
+            ts = time.time() - t0
+            m = MsgStore(server.host, server.port)
+            m.headers = list(have)
+            t0 = time.time()
+            m.get_headers(reconcile=True)
+            tr = time.time() - t0
+            print('%5d%% %5s %12d %12d %12d %10.3f %10.3f' % (int(held * 100), gz, sbytes, fbytes, rbytes, ts, tr))
+
+server.stop()
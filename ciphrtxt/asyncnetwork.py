@@ -0,0 +1,287 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+import json
+import time
+
+from ciphrtxt.message import Message, RawMessageHeader
+from ciphrtxt.network import MsgStore, HeaderStreamParser, MultipartProducer
+from ciphrtxt.network import _async_client, _async_body, _transient_code
+from ciphrtxt.network import _statusPath, _server_time, _headers_since
+from ciphrtxt.network import _download_message, _upload_message, _peer_list
+from ciphrtxt.network import _cache_expire_time
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPError
+
+from ecpy.point import Point
+
+_default_concurrency = 16
+_default_timeout = 30.0 # seconds
+_default_retries = 2
+_retry_delay = 0.25 # seconds, doubled for each retry
+# tornado's own client only decodes gzip (curl decodes either)
+_accept_encoding = {'Accept-Encoding': 'gzip'}
+
+
+def _transient(e):
+    if isinstance(e, HTTPError):
+        # 599 = timeout or connection failure (no HTTP reply)
+        return _transient_code(e.code)
+    return isinstance(e, (OSError, asyncio.TimeoutError))
+
+
+class AsyncMsgStore (object):
+    """asyncio client for message store server. Wraps a MsgStore (store),
+    which holds the headers, host key and caches, and provides its network
+    calls as coroutines. Requests to the server are bounded by a per-store
+    semaphore (concurrency) and each is limited to timeout seconds. Returns
+    None where MsgStore would. Pass store (not the AsyncMsgStore) to the
+    synchronous MsgStorePool, SyncScheduler, PeerManager or as an onion"""
+    def __init__(self, host=None, port=7754, concurrency=_default_concurrency,
+                 timeout=_default_timeout, store=None, **kwargs):
+        # store=MsgStore gives an async view sharing that store's state
+        if store is None:
+            store = MsgStore(host, port, **kwargs)
+        self.store = store
+        self.concurrency = concurrency
+        self.timeout = timeout
+        # async http client bound to the loop this store runs on (optional)
+        self.aclient = None
+        self._loop = None
+        self._sem = None
+        self._sync_lock = None
+
+    @property
+    def host(self):
+        return self.store.host
+
+    @property
+    def port(self):
+        return self.store.port
+
+    @property
+    def Pkey(self):
+        return self.store.Pkey
+
+    @property
+    def headers(self):
+        return self.store.headers
+
+    @headers.setter
+    def headers(self, hdrs):
+        self.store.headers = hdrs
+
+    def __str__(self):
+        return 'Async' + str(self.store)
+
+    def _loop_state(self):
+        # asyncio primitives are bound to a single loop
+        loop = asyncio.get_event_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._sem = asyncio.Semaphore(self.concurrency)
+            self._sync_lock = asyncio.Lock()
+
+    def _aclient(self):
+        if self.aclient is not None:
+            return self.aclient
+        aclient = _async_client(self.store.client)
+        if aclient is None:
+            return AsyncHTTPClient()
+        return aclient
+
+    async def _request(self, path, method='GET', body=None, headers=None,
+                       streaming_callback=None):
+        """returns the response body, raises on error or non-200 reply"""
+        self._loop_state()
+        aclient = self._aclient()
+        body, body_producer = _async_body(aclient, body)
+        req = HTTPRequest(self.store._baseurl() + path, method=method, body=body,
+                          body_producer=body_producer, headers=headers, connect_timeout=self.timeout,
+                          request_timeout=self.timeout,
+                          streaming_callback=streaming_callback)
+        async with self._sem:
+            r = await asyncio.wait_for(aclient.fetch(req), self.timeout)
+        if r.code != 200:
+            raise HTTPError(r.code, response=r)
+        return r.body
+
+    async def _fetch(self, path, method='GET', body=None, headers=None):
+        try:
+            return await self._request(path, method, body, headers)
+        except (HTTPError, OSError, asyncio.TimeoutError):
+            return None
+
+    async def refresh(self):
+        r = await self._fetch(_statusPath)
+        if r is None:
+            return False
+        pub = json.loads(r.decode('UTF-8'))['pubkey']
+        self.store._set_pkey(Point.decompress(pub.encode('UTF-8')))
+        return True
+
+    async def sync_headers(self, stream=False):
+        store = self.store
+        self._loop_state()
+        async with self._sync_lock:
+            if store.Pkey is None:
+                await self.refresh()
+            if not store.cache_dirty:
+                if (time.time() - store.last_sync) < _cache_expire_time:
+                    return True
+            r = await self._fetch(_server_time)
+            if r is None:
+                return False
+            servertime = json.loads(r.decode())['time']
+            store._expire_headers(servertime)
+            store.last_sync = time.time()
+            if stream:
+                return await self._stream_headers(servertime)
+            r = await self._fetch(_headers_since + str(store.servertime),
+                                  headers=dict(_accept_encoding))
+            if r is None:
+                return False
+            store.servertime = servertime
+            store.cache_dirty = False
+            store._merge_headers(servertime, json.loads(r.decode())['header_list'])
+            return True
+
+    async def _stream_headers(self, servertime):
+        store = self.store
+        known = store._known_headers()
+        cached = store._cache_batch()
+        added = []
+        parser = HeaderStreamParser(lambda rstr: store._merge_header(rstr, known, cached, added))
+        try:
+            await self._request(_headers_since + str(store.servertime),
+                                headers=dict(_accept_encoding),
+                                streaming_callback=store._chunk_merger(parser, added))
+        except (HTTPError, OSError, asyncio.TimeoutError):
+            return False
+        if not parser.done:
+            return False
+        store.servertime = servertime
+        store.cache_dirty = False
+        store._finish_merge(servertime, cached, added)
+        return True
+
+    async def get_headers(self, stream=False):
+        await self.sync_headers(stream=stream)
+        return self.headers
+
+    async def get_peers(self):
+        r = await self._fetch(_peer_list, headers=dict(_accept_encoding))
+        if r is None:
+            return None
+        return json.loads(r.decode())
+
+    async def _download(self, msgid):
+        if isinstance(msgid, bytes):
+            msgid = msgid.decode()
+        m = self.store._cached_message(msgid)
+        if m is not None:
+            return m
+        r = await self._fetch(_download_message + msgid)
+        if r is None:
+            return None
+        m = Message.deserialize(r)
+        self.store._store_body(m, r)
+        return m
+
+    async def get_message(self, hdr):
+        await self.sync_headers()
+        if hdr not in self.headers:
+            return None
+        return await self._download(hdr.Iraw())
+
+    async def get_message_by_id(self, msgid):
+        return await self._download(msgid)
+
+    async def post_message(self, msg):
+        if msg in self.headers:
+            return None
+        raw = msg.serialize()
+        nhdr = RawMessageHeader.deserialize(raw)
+        body = MultipartProducer([], [('message', 'message', self.store._body_source(nhdr, raw))])
+        r = await self._fetch(_upload_message, method='POST', body=body, headers=body.headers())
+        if r is None:
+            return None
+        self.store._insert_posted(nhdr, msg, raw)
+        return r
+
+    async def _download_retry(self, hdr, sem, retries):
+        msgid = hdr.Iraw()
+        if isinstance(msgid, bytes):
+            msgid = msgid.decode()
+        m = self.store._cached_message(msgid)
+        if m is not None:
+            return (hdr, m, None)
+        err = None
+        for attempt in range(0, retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(_retry_delay * (1 << (attempt - 1)))
+            try:
+                async with sem:
+                    r = await self._request(_download_message + msgid)
+            except (HTTPError, OSError, asyncio.TimeoutError) as e:
+                err = e
+                if not _transient(e):
+                    break
+                continue
+            m = Message.deserialize(r)
+            if m is None:
+                return (hdr, None, ValueError('malformed message ' + msgid))
+            self.store._store_body(m, r)
+            return (hdr, m, None)
+        return (hdr, None, err)
+
+    async def get_messages(self, hdrs, concurrency=None,
+                           retries=_default_retries, sync=True):
+        """async iterator downloading the messages for hdrs, at most
+        concurrency at a time. Headers are synchronized once (unless sync is
+        False). Yields (hdr, message, error) tuples in arrival order, message
+        is None and error is set for headers which could not be fetched after
+        retries"""
+        if concurrency is None:
+            concurrency = self.concurrency
+        if sync:
+            await self.sync_headers()
+        known = self.headers.ids
+        sem = asyncio.Semaphore(concurrency)
+        pending = []
+        for hdr in hdrs:
+            if hdr.Iraw() not in known:
+                yield (hdr, None, KeyError(hdr.Iraw()))
+                continue
+            pending.append(asyncio.ensure_future(self._download_retry(hdr, sem, retries)))
+        try:
+            for f in asyncio.as_completed(pending):
+                yield await f
+        finally:
+            for f in pending:
+                f.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
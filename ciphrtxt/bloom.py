@@ -0,0 +1,108 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import math
+import struct
+
+from hashlib import sha256
+
+from Crypto.Random import random
+
+_bloom_version = 1
+_salt_size = 16
+# version, nhashes, nbits, salt
+_bloom_header = '>BBI'
+_bloom_header_size = struct.calcsize(_bloom_header) + _salt_size
+_default_fp_rate = 0.01
+_max_hashes = 16
+# 16 MiB of bits, about 14 million keys at the default rate
+_max_bits = 1 << 27
+
+
+class BloomFilter (object):
+    """Salted Bloom filter over message ids (Iraw), used as the sketch for
+    reconciling header lists. A fresh random salt is drawn for every
+    filter, so a header hidden by a false positive in one sync is very
+    likely to be found by the next"""
+    def __init__(self, nbits, nhashes, salt=None):
+        if salt is None:
+            salt = random.getrandbits(_salt_size * 8).to_bytes(_salt_size, 'big')
+        self.nbits = max(8, min(_max_bits, nbits))
+        self.nhashes = max(1, min(_max_hashes, nhashes))
+        self.salt = salt
+        self.bits = bytearray((self.nbits + 7) >> 3)
+        self.count = 0
+
+    @staticmethod
+    def for_capacity(n, fp_rate=_default_fp_rate, salt=None):
+        """filter sized for n keys at the given false positive rate"""
+        n = max(1, n)
+        nbits = int(math.ceil(-n * math.log(fp_rate) / (math.log(2) ** 2)))
+        nhashes = int(round((float(nbits) / n) * math.log(2)))
+        return BloomFilter(nbits, nhashes, salt)
+
+    def _indexes(self, key):
+        if isinstance(key, str):
+            key = key.encode()
+        d = sha256(self.salt + bytes(key)).digest()
+        h1 = int.from_bytes(d[0:8], 'big')
+        h2 = int.from_bytes(d[8:16], 'big') | 1
+        for i in range(0, self.nhashes):
+            yield (h1 + (i * h2)) % self.nbits
+
+    def add(self, key):
+        for i in self._indexes(key):
+            self.bits[i >> 3] |= (1 << (i & 7))
+        self.count += 1
+
+    def __contains__(self, key):
+        for i in self._indexes(key):
+            if not (self.bits[i >> 3] & (1 << (i & 7))):
+                return False
+        return True
+
+    def serialize(self):
+        return (struct.pack(_bloom_header, _bloom_version, self.nhashes, self.nbits) +
+                self.salt + bytes(self.bits))
+
+    @staticmethod
+    def deserialize(raw):
+        """raises ValueError for a malformed filter. The sizes are checked
+        against len(raw) before anything is allocated"""
+        if len(raw) < _bloom_header_size:
+            raise ValueError('bloom filter header truncated')
+        version, nhashes, nbits = struct.unpack(_bloom_header, raw[:6])
+        if version != _bloom_version:
+            raise ValueError('unknown bloom filter version %d' % version)
+        if (nbits < 8) or (nbits > _max_bits) or (nhashes < 1) or (nhashes > _max_hashes):
+            raise ValueError('bloom filter size out of range')
+        if len(raw) != (_bloom_header_size + ((nbits + 7) >> 3)):
+            raise ValueError('bloom filter length mismatch')
+        b = BloomFilter(8, nhashes, bytes(raw[6:_bloom_header_size]))
+        b.nbits = nbits
+        b.bits = bytearray(raw[_bloom_header_size:])
+        return b
@@ -0,0 +1,223 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import mmap
+import os
+import time
+
+from threading import Lock
+
+_segment_fmt = '%08d.seg'
+_index_name = 'index'
+
+_default_segment_size = (16 * 1024 * 1024)
+# sealed segments with less than this fraction of live data are rewritten
+_compact_ratio = 0.5
+
+
+class _Segment (object):
+    def __init__(self, path, segno):
+        self.segno = segno
+        self.path = os.path.join(path, _segment_fmt % segno)
+        self.size = 0
+        self.live = 0
+        self._map = None
+        if os.path.exists(self.path):
+            self.size = os.path.getsize(self.path)
+
+    def view(self, offset, length):
+        if (self._map is None) or (len(self._map) < (offset + length)):
+            f = open(self.path, 'rb')
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            finally:
+                f.close()
+        return memoryview(self._map)[offset:offset + length]
+
+    def remove(self):
+        # outstanding views keep the old mapping alive, so it is dropped
+        # rather than closed
+        self._map = None
+        os.remove(self.path)
+
+
+class MessageBodyStore (object):
+    """Local store of serialized messages. Messages are appended to segment
+    files and located through an offset index keyed by raw I. Reads return
+    memoryview slices of a read-only mmap of the segment (no copy)"""
+    def __init__(self, path, segment_size=_default_segment_size):
+        self.path = path
+        self.segment_size = segment_size
+        self.index = {}
+        self.segments = {}
+        self._lock = Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._load()
+
+    def _load(self):
+        for fname in os.listdir(self.path):
+            if fname.endswith('.seg'):
+                segno = int(fname[:-4])
+                self.segments[segno] = _Segment(self.path, segno)
+        if len(self.segments) == 0:
+            self.segments[0] = _Segment(self.path, 0)
+        self.active = max(self.segments.keys())
+        ipath = os.path.join(self.path, _index_name)
+        if os.path.exists(ipath):
+            f = open(ipath, 'r')
+            for line in f:
+                rec = line.split()
+                if len(rec) != 5:
+                    continue
+                segno, offset, length = int(rec[1]), int(rec[2]), int(rec[3])
+                if segno not in self.segments:
+                    continue
+                if (offset + length) > self.segments[segno].size:
+                    # torn write, body never fully reached the segment
+                    continue
+                self.index[rec[0]] = (segno, offset, length, int(rec[4]))
+            f.close()
+        for (segno, offset, length, expire) in self.index.values():
+            self.segments[segno].live += length
+        self._index = open(ipath, 'a')
+
+    def close(self):
+        self._lock.acquire()
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        self._lock.release()
+
+    @staticmethod
+    def _key(iraw):
+        if isinstance(iraw, bytes):
+            return iraw.decode()
+        return iraw
+
+    def __contains__(self, iraw):
+        return MessageBodyStore._key(iraw) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def append(self, iraw, expire, raw):
+        """appends serialized message raw under key iraw, returns False if
+        the message was already stored"""
+        key = MessageBodyStore._key(iraw)
+        if isinstance(raw, str):
+            raw = raw.encode()
+        self._lock.acquire()
+        try:
+            if key in self.index:
+                return False
+            seg = self.segments[self.active]
+            if (seg.size > 0) and ((seg.size + len(raw)) > self.segment_size):
+                seg = self._roll()
+            self._write(seg, key, expire, raw)
+        finally:
+            self._lock.release()
+        return True
+
+    def _write(self, seg, key, expire, raw):
+        f = open(seg.path, 'ab')
+        try:
+            offset = f.tell()
+            f.write(raw)
+        finally:
+            f.close()
+        seg.size = offset + len(raw)
+        seg.live += len(raw)
+        self.index[key] = (seg.segno, offset, len(raw), expire)
+        self._index.write('%s %d %d %d %d\n' % (key, seg.segno, offset, len(raw), expire))
+        self._index.flush()
+
+    def _roll(self):
+        self.active += 1
+        seg = _Segment(self.path, self.active)
+        self.segments[self.active] = seg
+        return seg
+
+    def get(self, iraw):
+        """returns a memoryview of the serialized message, or None"""
+        key = MessageBodyStore._key(iraw)
+        self._lock.acquire()
+        try:
+            loc = self.index.get(key)
+            if loc is None:
+                return None
+            segno, offset, length, expire = loc
+            return self.segments[segno].view(offset, length)
+        finally:
+            self._lock.release()
+
+    def compact(self, now=None):
+        """drops index entries for messages which have expired as of now
+        (default = local time) and rewrites sealed segments which are mostly
+        dead. Returns the number of bytes reclaimed"""
+        if now is None:
+            now = int(time.time())
+        self._lock.acquire()
+        try:
+            expired = [k for (k, loc) in self.index.items() if loc[3] < now]
+            if len(expired) == 0:
+                return 0
+            for k in expired:
+                segno, offset, length, expire = self.index.pop(k)
+                self.segments[segno].live -= length
+            reclaimed = 0
+            for segno in sorted(self.segments.keys()):
+                seg = self.segments[segno]
+                if segno == self.active:
+                    continue
+                if seg.live >= (seg.size * _compact_ratio):
+                    continue
+                moved = [(k, loc) for (k, loc) in self.index.items() if loc[0] == segno]
+                for (k, loc) in moved:
+                    raw = seg.view(loc[1], loc[2]).tobytes()
+                    dest = self.segments[self.active]
+                    if (dest.size > 0) and ((dest.size + len(raw)) > self.segment_size):
+                        dest = self._roll()
+                    self._write(dest, k, loc[3], raw)
+                reclaimed += seg.size - seg.live
+                del self.segments[segno]
+                seg.remove()
+            self._rewrite_index()
+            return reclaimed
+        finally:
+            self._lock.release()
+
+    def _rewrite_index(self):
+        ipath = os.path.join(self.path, _index_name)
+        tpath = ipath + '.tmp'
+        f = open(tpath, 'w')
+        for (k, loc) in self.index.items():
+            f.write('%s %d %d %d %d\n' % ((k,) + loc))
+        f.close()
+        self._index.close()
+        os.replace(tpath, ipath)
+        self._index = open(ipath, 'a')
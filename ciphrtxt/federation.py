@@ -0,0 +1,299 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock
+
+from ciphrtxt.network import _require_sync
+from ciphrtxt.peers import PeerStats
+
+_default_hedge_percentile = 0.95
+_default_hedge_min_delay = 0.05 # seconds
+_default_hedge_workers = 16
+_hedge_samples = 256
+_default_breaker_threshold = 5 # consecutive failures
+_default_breaker_reset = 30.0 # seconds
+
+
+class CircuitBreaker (object):
+    """Per host circuit breaker. After threshold consecutive failures the
+    breaker opens and requests are refused until reset seconds have passed,
+    then a single trial request is let through (half open). Success closes
+    the breaker, failure of the trial opens it again"""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=_default_breaker_threshold,
+                 reset=_default_breaker_reset):
+        self.threshold = threshold
+        self.reset = reset
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.trips = 0
+        self.rejected = 0
+        self._trial = False
+        self._lock = Lock()
+
+    def allow(self, now=None):
+        if now is None:
+            now = time.time()
+        self._lock.acquire()
+        try:
+            if self.state == CircuitBreaker.OPEN:
+                if (now - self.opened) < self.reset:
+                    self.rejected += 1
+                    return False
+                self.state = CircuitBreaker.HALF_OPEN
+                self._trial = False
+            if self.state == CircuitBreaker.HALF_OPEN:
+                if self._trial:
+                    self.rejected += 1
+                    return False
+                self._trial = True
+            return True
+        finally:
+            self._lock.release()
+
+    def success(self):
+        self._lock.acquire()
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self._trial = False
+        self._lock.release()
+
+    def failure(self, now=None):
+        if now is None:
+            now = time.time()
+        self._lock.acquire()
+        self.failures += 1
+        if (self.state == CircuitBreaker.HALF_OPEN) or (self.failures >= self.threshold):
+            if self.state != CircuitBreaker.OPEN:
+                self.trips += 1
+            self.state = CircuitBreaker.OPEN
+            self.opened = now
+            self._trial = False
+        self._lock.release()
+
+
+class MsgStorePool (object):
+    """Federated view of several message stores. Headers from all stores are
+    synchronized concurrently and merged into a single deduplicated, time
+    ordered (newest first) list. The pool records which stores hold each
+    message and routes get_message to the best scored of them (PeerStats,
+    fed by the pool's own syncs and fetches). If the first
+    holder has not answered after the hedge_percentile latency of recent
+    fetches, the message is also requested from the next holder and the
+    first answer wins (hedge=False disables this). Hosts which keep failing
+    are skipped by a per host CircuitBreaker"""
+    def __init__(self, stores=None, hedge=True,
+                 hedge_percentile=_default_hedge_percentile,
+                 hedge_min_delay=_default_hedge_min_delay,
+                 breaker_threshold=_default_breaker_threshold,
+                 breaker_reset=_default_breaker_reset):
+        self.stores = []
+        self.headers = []
+        self.holders = {}
+        self.peers = {}
+        self.breakers = {}
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._samples = deque(maxlen=_hedge_samples)
+        self._insert_lock = Lock()
+        self._executor = None
+        self._fetcher = ThreadPoolExecutor(max_workers=_default_hedge_workers)
+        if stores is not None:
+            for s in stores:
+                self.add_store(s)
+
+    def add_store(self, store):
+        _require_sync(store)
+        self._insert_lock.acquire()
+        if store not in self.stores:
+            self.stores.append(store)
+            self.peers[store._hostport()] = PeerStats(store)
+            self.breakers[store._hostport()] = CircuitBreaker(
+                self.breaker_threshold, self.breaker_reset)
+            # resized for the new store count on the next sync
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+        self._insert_lock.release()
+
+    def breaker(self, store):
+        return self.breakers[store._hostport()]
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.stores)))
+        return self._executor
+
+    def _outcome(self, store, elapsed, ok):
+        self._insert_lock.acquire()
+        self.peers[store._hostport()].record(elapsed, ok)
+        self._insert_lock.release()
+        if ok:
+            self.breaker(store).success()
+        else:
+            self.breaker(store).failure()
+
+    def _timed_sync(self, store):
+        if not store._sync_due():
+            # answered from the headers held, no request and no sample
+            return store._sync_headers()
+        if not self.breaker(store).allow():
+            return False
+        t0 = time.time()
+        try:
+            ok = store._sync_headers()
+        except Exception:
+            ok = False
+        self._outcome(store, time.time() - t0, ok)
+        return ok
+
+    def sync(self):
+        """synchronizes all stores concurrently and rebuilds the merged view,
+        returns the number of stores which synchronized successfully"""
+        pool = self._pool()
+        results = list(pool.map(self._timed_sync, self.stores))
+        merged = {}
+        holders = {}
+        for store in self.stores:
+            for h in store.headers:
+                key = h.Iraw()
+                if key not in merged:
+                    merged[key] = h
+                    holders[key] = []
+                holders[key].append(store)
+        headers = sorted(merged.values(), reverse=True)
+        self._insert_lock.acquire()
+        self.headers = headers
+        self.holders = holders
+        self._insert_lock.release()
+        return results.count(True)
+
+    def get_headers(self):
+        self.sync()
+        return self.headers
+
+    def holders_of(self, hdr):
+        """stores holding the message for hdr, best score first"""
+        self._insert_lock.acquire()
+        stores = list(self.holders.get(hdr.Iraw(), []))
+        scores = dict((key, p.score()) for key, p in self.peers.items())
+        self._insert_lock.release()
+        stores.sort(key=lambda s: scores[s._hostport()])
+        return stores
+
+    def hedge_delay(self):
+        """seconds to wait for a holder before hedging to the next one"""
+        self._insert_lock.acquire()
+        samples = sorted(self._samples)
+        self._insert_lock.release()
+        if len(samples) == 0:
+            return self.hedge_min_delay
+        i = min(len(samples) - 1, int(len(samples) * self.hedge_percentile))
+        return max(self.hedge_min_delay, samples[i])
+
+    def _fetch(self, store, hdr):
+        t0 = time.time()
+        try:
+            m = store.get_message_by_id(hdr.Iraw())
+        except Exception:
+            m = None
+        elapsed = time.time() - t0
+        self._outcome(store, elapsed, m is not None)
+        if m is not None:
+            self._insert_lock.acquire()
+            self._samples.append(elapsed)
+            self._insert_lock.release()
+        return m
+
+    def _next_holder(self, candidates):
+        # the breaker is only asked when the store is actually used
+        while len(candidates) > 0:
+            store = candidates.pop(0)
+            if self.breaker(store).allow():
+                return store
+        return None
+
+    def get_message(self, hdr):
+        candidates = self.holders_of(hdr)
+        # local (msgcache or body store) hits make no request, they are
+        # not timed and do not count for the breakers
+        for store in candidates:
+            m = store._cached_message(hdr.Iraw().decode())
+            if m is not None:
+                return m
+        pending = {}
+        while True:
+            if (len(pending) == 0) or self.hedge:
+                store = self._next_holder(candidates)
+                if store is not None:
+                    hedged = len(pending) > 0
+                    if hedged:
+                        self.hedges += 1
+                    pending[self._fetcher.submit(self._fetch, store, hdr)] = hedged
+            if len(pending) == 0:
+                return None
+            timeout = None
+            if self.hedge and (len(candidates) > 0):
+                timeout = self.hedge_delay()
+            done, not_done = wait(list(pending.keys()), timeout=timeout,
+                                  return_when=FIRST_COMPLETED)
+            for f in done:
+                hedged = pending.pop(f)
+                m = f.result()
+                if m is not None:
+                    if hedged:
+                        self.hedge_wins += 1
+                    return m
+
+    def metrics(self):
+        m = {'hedges': self.hedges, 'hedge_wins': self.hedge_wins,
+             'hedge_delay': self.hedge_delay(), 'hosts': {}}
+        for key, b in self.breakers.items():
+            p = self.peers[key]
+            m['hosts'][key] = {'latency': p.latency, 'failure': p.failure,
+                               'breaker': b.state, 'trips': b.trips,
+                               'rejected': b.rejected}
+        return m
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._fetcher.shutdown(wait=False)
@@ -0,0 +1,66 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+_default_window = 4 # bits
+_scalar_bits = 256
+
+
+class FixedBaseTable (object):
+    """Windowed precomputation for repeated multiplication of one point by
+    varying scalars. Row i holds j * 2^(window*i) * P for each window digit
+    j, so k * P is the sum of one entry per non-zero digit of k (about 64
+    point additions for window=4 instead of ~256 doublings and ~128
+    additions). Building costs (2^window - 1) additions per row"""
+    def __init__(self, P, window=_default_window, bits=_scalar_bits):
+        self.point = P
+        self.window = window
+        self.bits = bits
+        self._mask = (1 << window) - 1
+        self.rows = []
+        base = P
+        for i in range(0, (bits + window - 1) // window):
+            row = [None, base]
+            for j in range(2, 1 << window):
+                row.append(row[-1] + base)
+            self.rows.append(row)
+            base = row[-1] + base
+
+    def mul(self, k):
+        if (k <= 0) or (k.bit_length() > self.bits):
+            return self.point * k
+        R = None
+        for row in self.rows:
+            d = k & self._mask
+            if d != 0:
+                if R is None:
+                    R = row[d]
+                else:
+                    R = R + row[d]
+            k >>= self.window
+            if k == 0:
+                break
+        return R
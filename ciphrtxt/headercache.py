@@ -0,0 +1,120 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import sqlite3
+import time
+
+from threading import Lock
+
+_schema = (
+    'CREATE TABLE IF NOT EXISTS hosts ('
+    ' hostport TEXT PRIMARY KEY,'
+    ' servertime INTEGER NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS headers ('
+    ' hostport TEXT NOT NULL,'
+    ' iraw TEXT NOT NULL,'
+    ' expire INTEGER NOT NULL,'
+    ' header TEXT NOT NULL,'
+    ' PRIMARY KEY (hostport, iraw))',
+    'CREATE INDEX IF NOT EXISTS headers_expire ON headers (hostport, expire)',
+)
+
+
+class HeaderCache (object):
+    """Persistent (sqlite) cache of synchronized message headers. Headers
+    and the last server time are kept per host:port so that a MsgStore can
+    resume with headers?since=<last> instead of a full download"""
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock.acquire()
+        for stmt in _schema:
+            self._db.execute(stmt)
+        self._db.commit()
+        self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        self._lock.release()
+
+    def servertime(self, hostport):
+        self._lock.acquire()
+        row = self._db.execute('SELECT servertime FROM hosts WHERE hostport = ?',
+                               (hostport,)).fetchone()
+        self._lock.release()
+        if row is None:
+            return 0
+        return row[0]
+
+    def load(self, hostport, now=None):
+        """returns the serialized headers cached for hostport, dropping any
+        which have expired as of now (default = local time)"""
+        if now is None:
+            now = int(time.time())
+        self.expire(hostport, now)
+        self._lock.acquire()
+        rows = self._db.execute('SELECT header FROM headers WHERE hostport = ?',
+                                (hostport,)).fetchall()
+        self._lock.release()
+        return [r[0] for r in rows]
+
+    def update(self, hostport, servertime, headers):
+        """stores headers, a sequence of (iraw, expire, serialized header)
+        tuples, and records servertime as the resume point for hostport.
+        Both are committed in a single transaction"""
+        self._lock.acquire()
+        try:
+            self._db.executemany('INSERT OR REPLACE INTO headers '
+                                 '(hostport, iraw, expire, header) '
+                                 'VALUES (?, ?, ?, ?)',
+                                 [(hostport, i, e, h) for (i, e, h) in headers])
+            self._db.execute('INSERT OR REPLACE INTO hosts (hostport, servertime) '
+                             'VALUES (?, ?)', (hostport, int(servertime)))
+            self._db.commit()
+        except:
+            self._db.rollback()
+            raise
+        finally:
+            self._lock.release()
+
+    def expire(self, hostport, servertime):
+        self._lock.acquire()
+        self._db.execute('DELETE FROM headers WHERE hostport = ? AND expire < ?',
+                         (hostport, int(servertime)))
+        self._db.commit()
+        self._lock.release()
+
+    def forget(self, hostport):
+        self._lock.acquire()
+        self._db.execute('DELETE FROM headers WHERE hostport = ?', (hostport,))
+        self._db.execute('DELETE FROM hosts WHERE hostport = ?', (hostport,))
+        self._db.commit()
+        self._lock.release()
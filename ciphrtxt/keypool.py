@@ -0,0 +1,144 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from threading import Condition, Thread
+
+from ecpy.curves import curve_secp256k1
+from ecpy.point import Point, Generator
+from Crypto.Random import random
+
+_C = curve_secp256k1
+Point.set_curve(_C)
+
+Generator.set_curve(_C)
+_G = Generator.init(_C['G'][0], _C['G'][1])
+
+_default_depth = 64
+_default_threads = 1
+
+
+def generate_session_key():
+    k = random.randint(1, _C['n']-1)
+    return (k, _G * k)
+
+
+class SessionKeyPool (object):
+    """Pool of precomputed ephemeral key pairs (k, k*G). Refill threads keep
+    up to depth pairs ready, get() never blocks and generates a pair inline
+    when the pool is empty. Each pair is handed out exactly once"""
+    def __init__(self, depth=_default_depth, threads=_default_threads):
+        self.depth = depth
+        self.nthreads = threads
+        self.keys = []
+        self.hits = 0
+        self.misses = 0
+        self._threads = []
+        self._running = False
+        self._ready = Condition()
+
+    def start(self):
+        self._ready.acquire()
+        if not self._running:
+            self._running = True
+            for i in range(0, self.nthreads):
+                t = Thread(target=self._refill)
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+        self._ready.release()
+        return self
+
+    def stop(self):
+        self._ready.acquire()
+        self._running = False
+        self._ready.notify_all()
+        threads = self._threads
+        self._threads = []
+        self._ready.release()
+        for t in threads:
+            t.join()
+
+    def _refill(self):
+        while True:
+            self._ready.acquire()
+            # wait until the pool is half empty, then fill it to depth
+            while self._running and len(self.keys) > (self.depth // 2):
+                self._ready.wait()
+            self._ready.release()
+            while self._running and len(self.keys) < self.depth:
+                pair = generate_session_key()
+                self._ready.acquire()
+                if len(self.keys) < self.depth:
+                    self.keys.append(pair)
+                self._ready.release()
+            if not self._running:
+                return
+
+    def fill(self):
+        """fills the pool synchronously, e.g. before the first request"""
+        while len(self.keys) < self.depth:
+            pair = generate_session_key()
+            self._ready.acquire()
+            if len(self.keys) < self.depth:
+                self.keys.append(pair)
+            self._ready.release()
+
+    def get(self):
+        self._ready.acquire()
+        if not self._running:
+            self._ready.release()
+            self.start()
+            self._ready.acquire()
+        if len(self.keys) > 0:
+            pair = self.keys.pop()
+            self.hits += 1
+        else:
+            pair = None
+            self.misses += 1
+        self._ready.notify()
+        self._ready.release()
+        if pair is None:
+            pair = generate_session_key()
+        return pair
+
+    def __len__(self):
+        return len(self.keys)
+
+
+_default_pool = SessionKeyPool()
+
+
+def session_key_pool():
+    return _default_pool
+
+
+def set_session_key_pool(pool):
+    """replaces the pool used by OnionRequest, returns the previous pool"""
+    global _default_pool
+    prev = _default_pool
+    _default_pool = pool
+    return prev
@@ -0,0 +1,457 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+import base64
+import hashlib
+import json
+import time
+
+from threading import Event, Lock, Thread
+
+import tornado.web
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+
+from ciphrtxt.message import RawMessageHeader, OnionHeader
+from ciphrtxt.network import _onion_v2, _subscribe_timeout
+from ciphrtxt.bloom import BloomFilter
+from ciphrtxt.nak import NAK
+from ciphrtxt.message import _header_size_w_sig_v1, _header_size_w_sig_b64_v2
+
+from ecpy.curves import curve_secp256k1
+from ecpy.point import Point, Generator
+from ecpy.ecdsa import ECDSA
+from Crypto.Random import random
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+from binascii import hexlify, unhexlify
+
+_C = curve_secp256k1
+Point.set_curve(_C)
+
+Generator.set_curve(_C)
+_G = Generator.init(_C['G'][0], _C['G'][1])
+
+ECDSA.set_generator(_G)
+_ecdsa = ECDSA()
+
+_subscribe_max_timeout = 60 # seconds
+
+
+class _Handler (tornado.web.RequestHandler):
+    def initialize(self, store):
+        self.store = store
+
+    async def prepare(self):
+        if self.store.latency > 0:
+            await asyncio.sleep(self.store.latency)
+
+    def finish(self, chunk=None):
+        # with a bandwidth limit the response is held back for the time
+        # the request and response bodies would take on the wire
+        if (self.store.bandwidth is None) or getattr(self, '_throttled', False):
+            return super(_Handler, self).finish(chunk)
+        if chunk is not None:
+            self.write(chunk)
+        self._throttled = True
+        size = len(self.request.body) + sum(len(c) for c in self._write_buffer)
+        return asyncio.ensure_future(self._finish_after(size / float(self.store.bandwidth)))
+
+    async def _finish_after(self, delay):
+        await asyncio.sleep(delay)
+        await super(_Handler, self).finish()
+
+
+class _StatusHandler (_Handler):
+    def get(self):
+        status = {}
+        status['pubkey'] = self.store.Pkey.compress().decode()
+        status['storage'] = {'messages': len(self.store.messages)}
+        self.write(status)
+
+
+class _TimeHandler (_Handler):
+    def get(self):
+        self.write({'time': int(time.time())})
+
+
+class _HeadersHandler (_Handler):
+    def get(self):
+        since = int(self.get_argument('since', '0'))
+        until = self.get_argument('until', None)
+        if until is not None:
+            until = int(until)
+        self.write({'header_list': self.store.headers_since(since, until=until)})
+
+
+class _SubscribeHandler (_Handler):
+    async def get(self):
+        # long-poll: answers as soon as there are headers after cursor (or,
+        # without a cursor, at or after since) and otherwise holds the
+        # request until a message is added or the timeout expires
+        since = int(self.get_argument('since', '0'))
+        cursor = self.get_argument('cursor', None)
+        if cursor is not None:
+            cursor = int(cursor)
+        timeout = float(self.get_argument('timeout', str(_subscribe_timeout)))
+        timeout = min(timeout, _subscribe_max_timeout)
+        hlist, now, nextcursor = self.store.headers_after(since, cursor)
+        if len(hlist) == 0:
+            waiter = self.store._subscribe()
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.store._unsubscribe(waiter)
+            hlist, now, nextcursor = self.store.headers_after(since, cursor)
+        self.write({'header_list': hlist, 'time': now, 'cursor': nextcursor})
+
+
+class _ReconcileHandler (_Handler):
+    def post(self):
+        try:
+            bloom = BloomFilter.deserialize(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        self.write({'header_list': self.store.headers_missing(bloom)})
+
+
+class _MessageHandler (_Handler):
+    def get(self, msgid):
+        raw = self.store.messages.get(msgid)
+        if raw is None:
+            raise tornado.web.HTTPError(404)
+        self.set_header('Content-Type', 'application/octet-stream')
+        self.write(raw)
+
+    def post(self, msgid):
+        files = self.request.files.get('message')
+        if not files:
+            raise tornado.web.HTTPError(400)
+        r = self.store.add_message(files[0]['body'])
+        if r is None:
+            raise tornado.web.HTTPError(400)
+        self.write(r)
+
+
+class _PeersHandler (_Handler):
+    def get(self):
+        # tornado only serializes dicts, the list is encoded explicitly
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write(json.dumps(self.store.peers))
+
+
+class _OnionV2Handler (_Handler):
+    """binary onion relay, local requests are issued against this server
+    and the reply sealed for the reply key, remote requests are forwarded to
+    the next hop and the reply passed back unchanged"""
+    async def post(self):
+        r = OnionHeader.unwrap(self.store.privkey, self.request.body)
+        if r is None:
+            raise tornado.web.HTTPError(400)
+        hdr, payload = r
+        if hdr.local:
+            url = self.store.baseurl() + hdr.path.decode()
+            headers = {}
+            body = None
+            if hdr.method == 'post':
+                body = bytes(payload)
+                if len(hdr.ctype) > 0:
+                    headers['Content-Type'] = hdr.ctype.decode()
+            resp = await AsyncHTTPClient().fetch(url, method=hdr.method.upper(),
+                                                 body=body, headers=headers,
+                                                 raise_error=False)
+            if resp.code != 200:
+                raise tornado.web.HTTPError(502)
+            replykey = Point.decompress(hexlify(hdr.replykey))
+            self.set_header('Content-Type', 'application/octet-stream')
+            self.write(OnionHeader.seal_reply(self.store.privkey, replykey, resp.body))
+            return
+        url = 'http://' + hdr.host.decode() + ':' + str(hdr.port) + '/' + _onion_v2
+        resp = await AsyncHTTPClient().fetch(url, method='POST', body=bytes(payload),
+                                             headers={'Content-Type': 'application/octet-stream'},
+                                             raise_error=False)
+        if resp.code != 200:
+            raise tornado.web.HTTPError(502)
+        self.set_header('Content-Type', 'application/octet-stream')
+        self.write(resp.body)
+
+
+class _OnionHandler (_Handler):
+    """JSON onion relay. The body is the base64 encoded NAK pubkey, NAK
+    signature and AES-CTR encrypted JSON request for this server (keyed by
+    ECDH with the session pubkey in the URL). Local requests are issued
+    against this server and the reply encrypted for the reply key, remote
+    requests are forwarded under this server's own NAK"""
+    async def post(self, pubkey):
+        try:
+            raw = base64.b64decode(self.request.body)
+            nakpub = Point.decompress(hexlify(raw[0:33]))
+            sig = (int(hexlify(raw[33:65]), 16), int(hexlify(raw[65:97]), 16))
+            session_Pkey = Point.decompress(pubkey.encode())
+        except (ValueError, TypeError):
+            raise tornado.web.HTTPError(400)
+        body = raw[97:]
+        if (len(body) < 16) or (not _ecdsa.verify(nakpub, sig, body)):
+            raise tornado.web.HTTPError(400)
+        ECDH = session_Pkey * self.store.privkey
+        keybin = hashlib.sha256(ECDH.compress()).digest()
+        counter = Counter.new(128, initial_value=int(hexlify(body[0:16]), 16))
+        cryptor = AES.new(keybin, AES.MODE_CTR, counter=counter)
+        try:
+            inner = json.loads(cryptor.decrypt(body[16:]).decode())
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        if inner['local']:
+            url = self.store.baseurl() + inner['url']
+            rbody = None
+            if inner['action'] == 'POST':
+                rbody = inner.get('body', '').encode()
+            resp = await AsyncHTTPClient().fetch(url, method=inner['action'],
+                                                 body=rbody,
+                                                 headers=inner.get('headers'),
+                                                 raise_error=False)
+            if resp.code != 200:
+                raise tornado.web.HTTPError(502)
+            replykey = Point.decompress(inner['replykey'].encode())
+            self.write(self.store._seal_json_reply(replykey, resp.body))
+            return
+        nak = self.store.nak
+        fwd = base64.b64decode(inner['body'])
+        sig = nak.sign(fwd)
+        fbody = nak.pubkeybin() + unhexlify('%064x' % sig[0]) + unhexlify('%064x' % sig[1]) + fwd
+        url = 'http://' + inner['host'] + ':' + str(inner['port']) + '/onion/' + inner['pubkey']
+        resp = await AsyncHTTPClient().fetch(url, method='POST',
+                                             body=base64.b64encode(fbody),
+                                             raise_error=False)
+        if resp.code != 200:
+            raise tornado.web.HTTPError(502)
+        self.write(resp.body)
+
+
+class LocalMsgStore (object):
+    """In-process stand-in for a ciphrtxt message store server. Implements
+    the v2 status, time, headers, messages, peers and the JSON and binary
+    onion relay endpoints and the headers/subscribe long-poll on a private
+    IOLoop thread so that clients can be tested and benchmarked without network access.
+    With compress=True responses are gzip encoded for clients which send
+    Accept-Encoding: gzip. latency (seconds) delays every request and
+    bandwidth (bytes per second) additionally delays each response by the
+    time its request and response bodies would take to transfer"""
+    def __init__(self, host='127.0.0.1', port=0, peers=None, privkey=None,
+                 compress=False, latency=0.0, bandwidth=None):
+        self.host = host
+        self.port = port
+        self.compress = compress
+        self.latency = latency
+        self.bandwidth = bandwidth
+        if peers is None:
+            peers = []
+        self.peers = peers
+        if privkey is None:
+            privkey = random.randint(1, _C['n']-1)
+        self.privkey = privkey
+        self.Pkey = _G * privkey
+        self.nak = NAK()
+        self.nak.randomize()
+        self.messages = {}
+        self.headers = []
+        self._header_ids = {}
+        self._waiters = []
+        self.ioloop = None
+        self._lock = Lock()
+        self._thread = None
+        self._server = None
+        self._started = Event()
+
+    def _handlers(self):
+        args = {'store': self}
+        return [
+            (r'/api/v2/status/?', _StatusHandler, args),
+            (r'/api/v2/time/?', _TimeHandler, args),
+            (r'/api/v2/headers/?', _HeadersHandler, args),
+            (r'/api/v2/headers/reconcile/?', _ReconcileHandler, args),
+            (r'/api/v2/headers/subscribe/?', _SubscribeHandler, args),
+            (r'/api/v2/messages/(.*)', _MessageHandler, args),
+            (r'/api/v2/peers/?', _PeersHandler, args),
+            (r'/' + _onion_v2 + '?', _OnionV2Handler, args),
+            (r'/onion/([0-9a-fA-F]+)', _OnionHandler, args),
+        ]
+
+    def _application(self):
+        return tornado.web.Application(self._handlers(),
+                                       compress_response=self.compress)
+
+    def add_message(self, raw, now=None):
+        """stores serialized message raw as if it were uploaded, returns the
+        upload metadata or None if the message is malformed"""
+        if isinstance(raw, str):
+            raw = raw.encode()
+        hdr = RawMessageHeader.deserialize(raw)
+        if hdr is None:
+            return None
+        if raw[0:3] == b'M01':
+            hstr = raw[:_header_size_w_sig_v1].decode()
+        else:
+            hstr = raw[:_header_size_w_sig_b64_v2].decode()
+        msgid = hdr.Iraw().decode()
+        added = False
+        self._lock.acquire()
+        if now is None:
+            # under the lock so arrival times never go backwards in
+            # self.headers, headers_after relies on it
+            now = int(time.time())
+        if msgid not in self.messages:
+            self.messages[msgid] = raw
+            self._header_ids[hstr] = hdr.Iraw()
+            self.headers.append((now, hdr.expire, hstr))
+            added = True
+        self._lock.release()
+        if added and (self.ioloop is not None):
+            self.ioloop.add_callback(self._wake_subscribers)
+        return {'header': hstr, 'servertime': now}
+
+    def _subscribe(self):
+        # called on the IOLoop thread, as are _unsubscribe and
+        # _wake_subscribers
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        return waiter
+
+    def _unsubscribe(self, waiter):
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+
+    def _wake_subscribers(self):
+        waiters = self._waiters
+        self._waiters = []
+        for w in waiters:
+            if not w.done():
+                w.set_result(True)
+
+    def _seal_json_reply(self, replykey, body):
+        # signature + IV + AES-CTR ciphertext, base64 encoded
+        ECDH = replykey * self.privkey
+        keybin = hashlib.sha256(ECDH.compress()).digest()
+        iv = random.randint(0, (1 << 128)-1)
+        ivbin = unhexlify('%032x' % iv)
+        counter = Counter.new(128, initial_value=iv)
+        cryptor = AES.new(keybin, AES.MODE_CTR, counter=counter)
+        ctxt = ivbin + cryptor.encrypt(body)
+        sig = _ecdsa.sign(self.privkey, ctxt)
+        return base64.b64encode(unhexlify('%064x' % sig[0]) + unhexlify('%064x' % sig[1]) + ctxt)
+
+    def headers_since(self, since, now=None, until=None):
+        """unexpired headers which arrived at or after since and, if until
+        is given, before until"""
+        if now is None:
+            now = int(time.time())
+        if until is None:
+            until = float('inf')
+        self._lock.acquire()
+        hlist = [h for (t, e, h) in self.headers
+                 if (t >= since) and (t < until) and (e >= now)]
+        self._lock.release()
+        return hlist
+
+    def headers_after(self, since, cursor=None):
+        """returns (headers, servertime, cursor) for a subscriber. headers
+        are those added after cursor (a position in self.headers returned by
+        an earlier call) or, if cursor is None or unknown to this store, at
+        or after since"""
+        self._lock.acquire()
+        now = int(time.time())
+        if (cursor is None) or (cursor > len(self.headers)):
+            added = [x for x in self.headers if x[0] >= since]
+        else:
+            added = self.headers[cursor:]
+        hlist = [h for (t, e, h) in added if e >= now]
+        cursor = len(self.headers)
+        self._lock.release()
+        return hlist, now, cursor
+
+    def _header_id(self, hstr):
+        msgid = self._header_ids.get(hstr)
+        if msgid is None:
+            hdr = RawMessageHeader.deserialize(hstr.encode())
+            if hdr is None:
+                return None
+            msgid = hdr.Iraw()
+            self._header_ids[hstr] = msgid
+        return msgid
+
+    def headers_missing(self, bloom, now=None):
+        """unexpired headers whose ids are not in bloom"""
+        if now is None:
+            now = int(time.time())
+        hlist = []
+        self._lock.acquire()
+        for (t, e, h) in self.headers:
+            if e < now:
+                continue
+            msgid = self._header_id(h)
+            if (msgid is not None) and (msgid not in bloom):
+                hlist.append(h)
+        self._lock.release()
+        return hlist
+
+    def baseurl(self):
+        return 'http://' + self.host + ':' + str(self.port) + '/'
+
+    def start(self):
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def _run(self):
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        self.ioloop = IOLoop.current()
+        sockets = bind_sockets(self.port, self.host)
+        self.port = sockets[0].getsockname()[1]
+        self._server = HTTPServer(self._application())
+        self._server.add_sockets(sockets)
+        self._started.set()
+        self.ioloop.start()
+        self._server.stop()
+        self.ioloop.close(all_fds=True)
+
+    def stop(self):
+        if self.ioloop is not None:
+            self.ioloop.add_callback(self.ioloop.stop)
+            self._thread.join()
+            self.ioloop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
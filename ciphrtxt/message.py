@@ -26,8 +26,9 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import ciphrtxt.keys as keys
-from binascii import hexlify, unhexlify
+from binascii import hexlify, unhexlify, Error as _b64error
 from base64 import b64encode, b64decode
+import re
 import time
 from hashlib import sha256
 import struct
@@ -59,6 +60,7 @@ _ecdsa = ECDSA()
 
 # convert integer to hex string
 _pfmt = '%%0%dx' % (((_C['bits'] + 7) >> 3) << 1)
+_pbytes = ((_C['bits'] + 7) >> 3)
 _mfmt = '%%0%dx' % (((_masksize + 7) >> 3) << 1)
 
 # 256 bit message seed
@@ -95,6 +97,13 @@ _default_ttl = (7*24*60*60)
 #defines the target for hashcash-like message nonce
 _default_nbits = 16
 
+# ciphertext body of a v2 message, checked on receipt and decoded lazily
+_b64_body = re.compile(b'[A-Za-z0-9+/]*={0,2}')
+
+# assigning any of these invalidates a cached message serialization
+_serialized_fields = frozenset(('version', 'time', 'expire', 'I', 'J', 'K',
+                                'blocklen', 'reserved', 'sig', 'nonce', 'ctxt'))
+
 class MessageHeader (object):
     def __init__(self):
         self.time = None
@@ -133,9 +142,12 @@ class MessageHeader (object):
         if self.version == "0100":
             return self._short_header() + b':' + (_pfmt % self.sig[0]).encode() + b':' + (_pfmt % self.sig[1]).encode()
         else:
-            h2 = unhexlify(_pfmt % self.sig[0]) + unhexlify(_pfmt % self.sig[1])
-            h2 += unhexlify("%010X" % self.nonce)
-            return self._short_header_v2() + b64encode(h2)
+            return self._short_header_v2() + b64encode(self._sig_block_v2())
+
+    def _sig_block_v2(self):
+        return (self.sig[0].to_bytes(_pbytes, 'big') +
+                self.sig[1].to_bytes(_pbytes, 'big') +
+                self.nonce.to_bytes(5, 'big'))
 
     def serialize(self):
         return self._short_header()
@@ -214,6 +226,13 @@ class MessageHeader (object):
             return False
         return self.I * privkey.current_privkey_val(self.time) == self.J
 
+    def _addr_match(self, privkey):
+        # address mask test on the x coordinate of the compressed point,
+        # avoids decompressing I for messages addressed elsewhere
+        x = int(self.Iraw()[2:], 16)
+        return (((x >> (_C['bits'] - keys._masksize)) & privkey.addr['mask'])
+                == privkey.addr['mtgt'])
+
     def Iraw(self):
         return self.I.compress()
 
@@ -379,22 +398,128 @@ class RawMessageHeader(MessageHeader):
         self.K = Point.decompress(self._Kraw)
 
     def is_for(self, privkey):
+        if not self._addr_match(privkey):
+            return False
         if self.I is None:
             self._decompress()
-        return super(RawMessageHeader, self).is_for(privkey)
+        return self.I * privkey.current_privkey_val(self.time) == self.J
 
 
 class Message (MessageHeader):
+    """Deserialized messages are lazy (like RawMessageHeader), points I, J, K
+    are decompressed and the ciphertext decoded on first access"""
     def __init__(self, cmsg=None):
+        self._I = None
+        self._J = None
+        self._K = None
+        self._Iraw = None
+        self._Jraw = None
+        self._Kraw = None
+        self._ctxt = None
+        self._ctxt_b64 = None
         super(Message, self).__init__()
         self.s = None
         self.ptxt = None
         self.ctxt = None
         self.altK = None
         self.h = None
+        self._serialized = None
         if cmsg is not None:
             self._deserialize(cmsg)
 
+    def __setattr__(self, name, value):
+        if name in _serialized_fields:
+            object.__setattr__(self, '_serialized', None)
+        object.__setattr__(self, name, value)
+
+    @property
+    def I(self):
+        if (self._I is None) and (self._Iraw is not None):
+            self._I = Point.decompress(self._Iraw)
+        return self._I
+
+    @I.setter
+    def I(self, P):
+        self._I = P
+        if P is not None:
+            self._Iraw = None
+
+    @property
+    def J(self):
+        if (self._J is None) and (self._Jraw is not None):
+            self._J = Point.decompress(self._Jraw)
+        return self._J
+
+    @J.setter
+    def J(self, P):
+        self._J = P
+        if P is not None:
+            self._Jraw = None
+
+    @property
+    def K(self):
+        if (self._K is None) and (self._Kraw is not None):
+            self._K = Point.decompress(self._Kraw)
+        return self._K
+
+    @K.setter
+    def K(self, P):
+        self._K = P
+        if P is not None:
+            self._Kraw = None
+
+    @property
+    def ctxt(self):
+        if (self._ctxt is None) and (self._ctxt_b64 is not None):
+            b64 = self._ctxt_b64
+            self._ctxt_b64 = None
+            try:
+                self._ctxt = b64decode(b64, validate=True)
+            except (_b64error, ValueError):
+                # left as None, decode() fails
+                pass
+        return self._ctxt
+
+    @ctxt.setter
+    def ctxt(self, c):
+        self._ctxt = c
+        self._ctxt_b64 = None
+
+    def ciphertext_size(self):
+        if self._ctxt is not None:
+            return len(self._ctxt)
+        if self._ctxt_b64 is None:
+            return 0
+        n = len(self._ctxt_b64)
+        tail = bytes(self._ctxt_b64[-2:])
+        return ((n >> 2) * 3) - tail.count(b'=')
+
+    def Iraw(self):
+        if self._Iraw is not None:
+            return self._Iraw
+        return self._I.compress()
+
+    def Jraw(self):
+        if self._Jraw is not None:
+            return self._Jraw
+        return self._J.compress()
+
+    def Kraw(self):
+        if self._Kraw is not None:
+            return self._Kraw
+        return self._K.compress()
+
+    def _deserialize_header_v1(self, cmsg):
+        return RawMessageHeader._deserialize_header_v1(self, cmsg)
+
+    def _deserialize_header_v2(self, cmsg):
+        return RawMessageHeader._deserialize_header_v2(self, cmsg)
+
+    def is_for(self, privkey):
+        if not self._addr_match(privkey):
+            return False
+        return self.I * privkey.current_privkey_val(self.time) == self.J
+
     @staticmethod
     def deserialize(cmsg):
         if isinstance(cmsg, str):
@@ -412,6 +537,8 @@ class Message (MessageHeader):
             return self._deserialize_v2(cmsg)
 
     def _deserialize_v1(self,cmsg):
+        if isinstance(cmsg, memoryview):
+            cmsg = cmsg.tobytes()
         hdrdata = cmsg.split(b':')
         if len(hdrdata) != 9:
             return False
@@ -434,26 +561,67 @@ class Message (MessageHeader):
         if self.blocklen != blocks:
             print('block length mismatch ' + str(blocks) + ' != ' + str(self.blocklen))
             return False
-        try:
-            self.ctxt = b64decode(cmsg[_header_size_w_sig_b64_v2:])
-        except:
+        # ciphertext is decoded on first access, keep a view (not a copy)
+        # after checking the alphabet and padding
+        body = memoryview(cmsg)[_header_size_w_sig_b64_v2:]
+        if ((len(body) & 3) != 0) or (_b64_body.fullmatch(body) is None):
             return False
+        self._ctxt = None
+        self._ctxt_b64 = body
+        # messages are immutable once signed, keep the wire format
+        self._serialized = cmsg
         return True
 
     def serialize(self):
+        if self._serialized is None:
+            if self.version == "0100":
+                self._serialized = self._serialize_v1()
+            else:
+                self._serialized = self._serialize_v2()
+        elif isinstance(self._serialized, memoryview):
+            self._serialized = self._serialized.tobytes()
+        return self._serialized
+
+    def serialized_size(self):
+        if self._serialized is not None:
+            return len(self._serialized)
         if self.version == "0100":
-            return self._serialize_v1()
-        else:
-            return self._serialize_v2()
+            return len(self.serialize())
+        return _header_size_w_sig_b64_v2 + (((len(self.ctxt) + 2) // 3) << 2)
+
+    def serialize_into(self, buf, offset=0):
+        """writes the serialized message into buf (bytearray, memoryview or
+        other writable buffer) starting at offset, returns the number of
+        bytes written"""
+        mv = memoryview(buf)
+        if (self._serialized is not None) or (self.version == "0100"):
+            raw = self.serialize()
+            mv[offset:offset + len(raw)] = raw
+            return len(raw)
+        pos = offset
+        for part in (self._short_header_v2(), b64encode(self._sig_block_v2()),
+                     b64encode(self.ctxt)):
+            mv[pos:pos + len(part)] = part
+            pos += len(part)
+        return pos - offset
+
+    def serialize_header(self):
+        if (self._serialized is not None) and (self.version != "0100"):
+            return bytes(self._serialized[:_header_size_w_sig_b64_v2])
+        return self._long_header()
+
+    def _short_header_v2(self):
+        if self._serialized is not None:
+            return bytes(self._serialized[:_header_size_b64_v2])
+        return super(Message, self)._short_header_v2()
 
     def _serialize_v1(self):
         return (self._short_header() + b':' + (_pfmt % self.sig[0]).encode() + b':' +
                 (_pfmt % self.sig[1]).encode() + b':' + b64encode(self.ctxt))
 
     def _serialize_v2(self):
-        h2 = unhexlify(_pfmt % self.sig[0]) + unhexlify(_pfmt % self.sig[1])
-        h2 += unhexlify("%010X" % self.nonce)
-        return self._short_header_v2() + b64encode(h2) + b64encode(self.ctxt)
+        return b''.join((self._short_header_v2(), b64encode(self._sig_block_v2()),
+                         b64encode(self.ctxt)))
 
     def _decode_v1(self,DH):
         sp = int(sha256(DH.compress()).hexdigest(), 16) % _C['n']
@@ -513,6 +681,8 @@ class Message (MessageHeader):
     def decode(self, privkey):
         if not self.is_for(privkey):
             return False
+        if self.ctxt is None:
+            return False
         DH = self.K * privkey.current_privkey_val(self.time)
         if self.version == "0100":
             return self._decode_v1(DH)
@@ -524,6 +694,8 @@ class Message (MessageHeader):
             if self.altK is None:
                 return False
             altk = self.altK
+        if self.ctxt is None:
+            return False
         DH = altK * privkey.current_privkey_val(self.time)
         if self.version == "0100":
             if self._decode_v1(DH):
@@ -883,6 +1055,9 @@ class Message (MessageHeader):
         return Q == self.K
 
     def __eq__(self, r):
+        if isinstance(r, Message):
+            if (self._serialized is not None) and (r._serialized is not None):
+                return self._serialized == r._serialized
         if not super(Message, self).__eq__(r):
             return False
         if self.ctxt != r.ctxt:
@@ -896,7 +1071,7 @@ class Message (MessageHeader):
         return self.serialize().decode()
 
     def __repr__(self):
-        return 'Message.deserialize(' + self.serialize() + ')'
+        return 'Message.deserialize(' + self.serialize().decode() + ')'
 
 #v2 onion outer header = "O" + b"x02\x00" (version) 
 #                      + session pubkey (33 bytes ECC point)
@@ -926,60 +1101,254 @@ _onion_outer_header_size_v2 = (1 + 2 + 33 + 32 + 32)
 
 #v2 onion inner local  = 16-byte initialization vector + header_blocks (1 byte block count)
 #                      + "L" (1 byte remote or local) + "G"/"P" (1 byte method type get/post)
+#                      + len(nak = 33) + nak (33 byte ECC point)
+#                      + len(host = 0) + len(port = 0)
 #                      + len(path) (1 byte int) + path (len byte string)
+#                      + len(ctype) (1 byte int) + request content type (len byte string)
 #                      + len(replykey = 33) + replykey (33 byte ECC Point)
 #                      + blocks_in (32 bit int) + blocks_out (32 bit int)
+#                      + body length (32 bit int)
 #                      + pad so that outer_header + inner_header === 0 mod 192
 
 #v2 onion inner remote = 16-byte initialization vector + header_blocks (1 byte block count)
 #                      + "R" (1 byte remote or local) + "P" (1 byte method type get/post)
 #                      + len(nak) (1 byte = 33) + nak (33 byte ECC point)
 #                      + len(host) (1 byte) + host (len byte string)
-#                      + len(port) (1 byte int) + port (len byte int) 
-#                      + len(replykey - either 33 or 0) + replykey (either 0 or 33 bytes)
+#                      + len(port = 2) (1 byte int) + port (16 bit int)
+#                      + len(path = 0) + len(ctype = 0) + len(replykey = 0)
 #                      + blocks_in (32 bit int) + blocks_out (32 bit int)
+#                      + body length (32 bit int = 0)
 #                      + pad so that outer_header + inner_header === 0 mod 192
+#
+# the inner header (after the IV) and payload are encrypted as one AES-CTR
+# stream. The client NAK signs every layer, relays forward the enclosed
+# packet as is (it is already encrypted for the next hop) and pass replies
+# back unchanged
 
 # 255 minus decoration --> "http://localhost:7754/" (len = 21)
 _max_url_len = 234
 
+_onion_version_v2 = b'O\x02\x00'
+_onion_iv_size = 16
+# header_blocks is the first byte of the (encrypted) inner header
+_onion_header_offset_v2 = _onion_outer_header_size_v2 + _onion_iv_size
+
+
+def _random_bytes(n):
+    if n <= 0:
+        return b''
+    return random.getrandbits(n * 8).to_bytes(n, 'big')
+
+
+def _onion_cryptor(ECDH, iv):
+    keybin = sha256(ECDH.compress()).digest()
+    counter = Counter.new(128, initial_value=int(hexlify(iv), 16))
+    return AES.new(keybin, AES.MODE_CTR, counter=counter)
+
+
 class OnionHeader (object):
+    """Inner header of a binary (v2) onion packet. A packet is the outer
+    header, the IV and the AES-CTR encrypted inner header and payload. The
+    header is padded so that outer + inner header is a whole number of 192
+    byte blocks and the payload is sent as blocksin blocks, so packet sizes
+    are always a multiple of 192 bytes"""
     def __init__(self):
         self.version = "0200"
         self.method = "get"
+        self.local = True
         self.host = None
         self.port = 0
         self.path = None
+        self.ctype = b''
+        self.nak = None
+        self.replykey = None
         self.blocksin = 0
         self.blocksout = 0
+        self.bodylen = 0
         self.padlen = 0
         self.header_blocks = 0
         self.header = None
 
-    def _generate_local(self, path, msg_blocks, nak, reply_pubkey_point, method="POST", extra_blocks=0):
-        inner_header= b'\x00' * 16
-        outer_header= b''
-        inner_header += b'L'
-        if method.lower() == 'post':
-            inner_header += b'P'
-        else:
-            inner_header += b'G'
-        # nak len = 33 bytes
-        inner_header += b'\x00'
-        inner_header += nak.pubkeybin()
-        # host len = 0
-        inner_header += b'\x00'
-        # port len = 0
-        inner_header += b'\x00'
+    def _generate_local(self, path, msg_blocks, nak, reply_pubkey_point, method="POST", extra_blocks=0, bodylen=0, ctype=None):
         if isinstance(path, str):
             path = path.encode()
         if len(path) > _max_url_len:
             return None
-        inner_header += unhexlify('%02x' % len(path))
-        inner_header += path
-        inner_header += b'\x21'
-        inner_header += unhexlify(reply_pubkey_point.serialize())
+        if ctype is None:
+            ctype = b''
+        if isinstance(ctype, str):
+            ctype = ctype.encode()
+        if len(ctype) > 255:
+            return None
+        self.ctype = ctype
+        self.local = True
+        self.method = method.lower()
+        self.host = None
+        self.port = 0
+        self.path = path
+        self.nak = nak.pubkeybin()
+        self.replykey = unhexlify(reply_pubkey_point.compress())
+        self.blocksin = msg_blocks + extra_blocks
+        self.blocksout = msg_blocks
+        self.bodylen = bodylen
+        return self._pack()
+
+    def _generate_remote(self, host, port, msg_blocks, nak, extra_blocks=0):
+        if isinstance(host, str):
+            host = host.encode()
+        if len(host) > 255:
+            return None
+        self.local = False
+        self.method = "post"
+        self.host = host
+        self.port = port
+        self.path = b''
+        self.ctype = b''
+        self.nak = nak.pubkeybin()
+        self.replykey = b''
+        self.blocksin = msg_blocks + extra_blocks
+        self.blocksout = msg_blocks
+        self.bodylen = 0
+        return self._pack()
+
+    def _pack(self):
+        f = []
+        f.append(b'L' if self.local else b'R')
+        f.append(b'P' if self.method == 'post' else b'G')
+        f.append(struct.pack('>B', len(self.nak)) + self.nak)
+        if self.local:
+            f.append(b'\x00')
+            f.append(b'\x00')
+        else:
+            f.append(struct.pack('>B', len(self.host)) + self.host)
+            f.append(b'\x02' + struct.pack('>H', self.port))
+        f.append(struct.pack('>B', len(self.path)) + self.path)
+        f.append(struct.pack('>B', len(self.ctype)) + self.ctype)
+        f.append(struct.pack('>B', len(self.replykey)) + self.replykey)
+        f.append(struct.pack('>III', self.blocksin, self.blocksout, self.bodylen))
+        fields = b''.join(f)
+        hlen = _onion_header_offset_v2 + 1 + len(fields)
+        self.header_blocks = (hlen + _v2_blocksize - 1) // _v2_blocksize
+        self.padlen = (self.header_blocks * _v2_blocksize) - hlen
+        self.header = (struct.pack('>B', self.header_blocks) + fields +
+                       _random_bytes(self.padlen))
+        return self.header
+
+    @staticmethod
+    def deserialize(header):
+        """parses a decrypted inner header, returns None if malformed"""
+        def field(pos):
+            n = header[pos]
+            if pos + 1 + n > len(header):
+                raise ValueError('truncated onion header')
+            return bytes(header[pos + 1:pos + 1 + n]), pos + 1 + n
+        h = OnionHeader()
+        try:
+            h.header_blocks = header[0]
+            h.local = {b'L': True, b'R': False}[bytes(header[1:2])]
+            h.method = {b'G': 'get', b'P': 'post'}[bytes(header[2:3])]
+            h.nak, pos = field(3)
+            h.host, pos = field(pos)
+            port, pos = field(pos)
+            if len(port) == 2:
+                h.port = struct.unpack('>H', port)[0]
+            h.path, pos = field(pos)
+            h.ctype, pos = field(pos)
+            h.replykey, pos = field(pos)
+            h.blocksin, h.blocksout, h.bodylen = struct.unpack('>III', bytes(header[pos:pos + 12]))
+        except (IndexError, KeyError, ValueError, struct.error):
+            return None
+        if len(h.nak) != 33:
+            return None
+        if h.local and (len(h.replykey) != 33):
+            return None
+        if (not h.local) and (len(h.host) == 0):
+            return None
+        h.padlen = len(header) - (pos + 12)
+        h.header = bytes(header)
+        return h
+
+    def wrap(self, ECDH, session_Pkey, payload, nak):
+        """encrypts this header and payload for a relay. ECDH is the shared
+        point (relay pubkey * session privkey) and session_Pkey the session
+        public key. The inner header is signed with the NAK"""
+        if self.header is None:
+            return None
+        padded = self.blocksin * _v2_blocksize
+        if len(payload) > padded:
+            return None
+        iv = _random_bytes(_onion_iv_size)
+        cryptor = _onion_cryptor(ECDH, iv)
+        ctxt = cryptor.encrypt(self.header + bytes(payload) +
+                               _random_bytes(padded - len(payload)))
+        signed = iv + ctxt[:len(self.header)]
+        sig = nak.sign(signed)
+        return b''.join((_onion_version_v2, unhexlify(session_Pkey.compress()),
+                         unhexlify(_pfmt % sig[0]), unhexlify(_pfmt % sig[1]),
+                         iv, ctxt))
+
+    @staticmethod
+    def unwrap(privkey, packet):
+        """decrypts a packet with the relay private key and validates the NAK
+        signature, returns (header, payload) or None. The payload is the
+        request body for local requests or the packet to forward (truncated
+        or extended to blocksout blocks) for remote requests"""
+        if len(packet) < _v2_blocksize or (len(packet) % _v2_blocksize) != 0:
+            return None
+        if bytes(packet[:3]) != _onion_version_v2:
+            return None
+        try:
+            session_Pkey = Point.decompress(hexlify(packet[3:36]))
+        except (ValueError, TypeError):
+            return None
+        off = _onion_header_offset_v2
+        iv = bytes(packet[off - _onion_iv_size:off])
+        cryptor = _onion_cryptor(session_Pkey * privkey, iv)
+        plain = cryptor.decrypt(bytes(packet[off:]))
+        hlen = (plain[0] * _v2_blocksize) - off
+        if hlen <= 0 or hlen > len(plain):
+            return None
+        h = OnionHeader.deserialize(plain[:hlen])
+        if h is None:
+            return None
+        sig = (int(hexlify(packet[36:68]), 16), int(hexlify(packet[68:100]), 16))
+        try:
+            nakpub = Point.decompress(hexlify(h.nak))
+        except (ValueError, TypeError):
+            return None
+        if not _ecdsa.verify(nakpub, sig, bytes(packet[off - _onion_iv_size:off + hlen])):
+            return None
+        if (len(plain) - hlen) != (h.blocksin * _v2_blocksize):
+            return None
+        if h.local:
+            if h.bodylen > h.blocksin * _v2_blocksize:
+                return None
+            return (h, plain[hlen:hlen + h.bodylen])
+        out = h.blocksout * _v2_blocksize
+        payload = plain[hlen:hlen + out]
+        if len(payload) < out:
+            payload += _random_bytes(out - len(payload))
+        return (h, payload)
 
-    def _generate_remote():
-        pass
+    @staticmethod
+    def seal_reply(privkey, reply_Pkey, body):
+        """encrypts a response body for the reply key and signs it with the
+        relay private key"""
+        iv = _random_bytes(_onion_iv_size)
+        cryptor = _onion_cryptor(reply_Pkey * privkey, iv)
+        ctxt = iv + cryptor.encrypt(bytes(body))
+        sig = _ecdsa.sign(privkey, ctxt)
+        return unhexlify(_pfmt % sig[0]) + unhexlify(_pfmt % sig[1]) + ctxt
 
+    @staticmethod
+    def open_reply(Pkey, ECDH, reply):
+        """verifies and decrypts a reply from the relay with pubkey Pkey.
+        ECDH is the shared point (Pkey * reply privkey)"""
+        if len(reply) < (64 + _onion_iv_size):
+            return None
+        sig = (int(hexlify(reply[0:32]), 16), int(hexlify(reply[32:64]), 16))
+        if not _ecdsa.verify(Pkey, sig, bytes(reply[64:])):
+            return None
+        iv = bytes(reply[64:64 + _onion_iv_size])
+        cryptor = _onion_cryptor(ECDH, iv)
+        return cryptor.decrypt(bytes(reply[64 + _onion_iv_size:]))
@@ -0,0 +1,199 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import heapq
+import time
+
+from collections import OrderedDict
+from threading import Lock
+
+_default_cache_bytes = (32 * 1024 * 1024)
+
+
+def _message_size(m):
+    # avoids decoding the body of a lazily deserialized message
+    return m.ciphertext_size()
+
+
+class LRUEviction (object):
+    """evicts the least recently used message first"""
+    def __init__(self):
+        self._order = OrderedDict()
+
+    def insert(self, key, m):
+        self._order[key] = True
+
+    def touch(self, key, m):
+        self._order.move_to_end(key)
+
+    def remove(self, key):
+        del self._order[key]
+
+    def victim(self):
+        return next(iter(self._order))
+
+
+class ExpireEviction (object):
+    """evicts the message closest to (or past) its expiration first"""
+    def __init__(self):
+        self._heap = []
+        self._live = {}
+
+    def insert(self, key, m):
+        self._live[key] = m.expire
+        heapq.heappush(self._heap, (m.expire, key))
+        self._compact()
+
+    def touch(self, key, m):
+        pass
+
+    def remove(self, key):
+        del self._live[key]
+        self._compact()
+
+    def _compact(self):
+        # entries for removed or re-inserted keys are only popped when they
+        # reach the top, rebuild once they outnumber the live ones so the
+        # heap stays bounded under churn
+        stale = len(self._heap) - len(self._live)
+        if stale > max(len(self._live), 16):
+            self._heap = [(e, k) for (k, e) in self._live.items()]
+            heapq.heapify(self._heap)
+
+    def victim(self):
+        while True:
+            expire, key = self._heap[0]
+            if self._live.get(key) == expire:
+                return key
+            # stale entry from a removed message
+            heapq.heappop(self._heap)
+
+
+class MessageCache (object):
+    """In-memory cache of deserialized messages keyed by raw I. Bounded by
+    the total ciphertext size of the cached messages rather than count"""
+    def __init__(self, maxbytes=_default_cache_bytes, policy=None):
+        self.maxbytes = maxbytes
+        if policy is None:
+            policy = LRUEviction()
+        self.policy = policy
+        self._entries = {}
+        self._insert_lock = Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _key(iraw):
+        if isinstance(iraw, bytes):
+            return iraw.decode()
+        return iraw
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, iraw):
+        return MessageCache._key(iraw) in self._entries
+
+    def get(self, iraw, now=None):
+        key = MessageCache._key(iraw)
+        if now is None:
+            now = int(time.time())
+        self._insert_lock.acquire()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            self._insert_lock.release()
+            return None
+        m, size = entry
+        if m.expire < now:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            self._insert_lock.release()
+            return None
+        self.policy.touch(key, m)
+        self.hits += 1
+        self._insert_lock.release()
+        return m
+
+    def put(self, m):
+        """caches message m, returns False if it cannot fit in the cache"""
+        key = MessageCache._key(m.Iraw())
+        size = _message_size(m)
+        if size > self.maxbytes:
+            return False
+        self._insert_lock.acquire()
+        if key in self._entries:
+            self._remove(key)
+        while (self.bytes + size) > self.maxbytes:
+            self._remove(self.policy.victim())
+            self.evictions += 1
+        self._entries[key] = (m, size)
+        self.policy.insert(key, m)
+        self.bytes += size
+        self._insert_lock.release()
+        return True
+
+    def discard(self, iraw):
+        key = MessageCache._key(iraw)
+        self._insert_lock.acquire()
+        if key in self._entries:
+            self._remove(key)
+        self._insert_lock.release()
+
+    def expire(self, now=None):
+        """drops all messages which have expired as of now"""
+        if now is None:
+            now = int(time.time())
+        self._insert_lock.acquire()
+        expired = [k for (k, e) in self._entries.items() if e[0].expire < now]
+        for k in expired:
+            self._remove(k)
+        self.expirations += len(expired)
+        self._insert_lock.release()
+        return len(expired)
+
+    def _remove(self, key):
+        m, size = self._entries.pop(key)
+        self.policy.remove(key)
+        self.bytes -= size
+
+    def metrics(self):
+        self._insert_lock.acquire()
+        r = {}
+        r['entries'] = len(self._entries)
+        r['bytes'] = self.bytes
+        r['maxbytes'] = self.maxbytes
+        r['hits'] = self.hits
+        r['misses'] = self.misses
+        r['evictions'] = self.evictions
+        r['expirations'] = self.expirations
+        self._insert_lock.release()
+        return r
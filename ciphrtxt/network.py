@@ -28,11 +28,22 @@
 import time
 import json
 import hashlib
+import heapq
 import mimetypes
+import http.client
+import zlib
+import asyncio
+import queue
+import select
+from urllib.parse import urlsplit
 from binascii import hexlify, unhexlify
 import base64
-from ciphrtxt.message import Message, RawMessageHeader
-from tornado.httpclient import AsyncHTTPClient, HTTPClient, HTTPRequest
+from ciphrtxt.message import Message, RawMessageHeader, OnionHeader
+from ciphrtxt.message import _v2_blocksize, _default_ttl
+from ciphrtxt.keypool import session_key_pool
+from ciphrtxt.fixedbase import FixedBaseTable
+from ciphrtxt.bloom import BloomFilter
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
 import tornado.gen
 
 from ecpy.curves import curve_secp256k1
@@ -42,7 +53,13 @@ from Crypto.Random import random
 from Crypto.Cipher import AES
 from Crypto.Util import Counter
 
-from threading import Lock
+from threading import Condition, Event, Lock, Thread
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    from tornado.curl_httpclient import CurlAsyncHTTPClient
+except ImportError:
+    CurlAsyncHTTPClient = None
 
 _C = curve_secp256k1
 Point.set_curve(_C)
@@ -57,14 +74,36 @@ _statusPath = 'api/v2/status/'
 
 _server_time = 'api/v2/time/'
 _headers_since = 'api/v2/headers?since='
+_headers_until = '&until='
+_headers_reconcile = 'api/v2/headers/reconcile'
+_headers_subscribe = 'api/v2/headers/subscribe?since='
 _download_message = 'api/v2/messages/'
 _upload_message = 'api/v2/messages/'
 _peer_list = 'api/v2/peers/'
+_onion_v2 = 'api/v2/onion/'
 
 _cache_expire_time = 5 # seconds
 _high_water = 50
 _low_water = 20
 
+_default_max_clients = 100
+_default_pool_size = 4
+_default_idle_timeout = 30 # seconds
+_default_request_timeout = 20 # seconds
+_default_get_concurrency = 16
+_default_get_retries = 2
+_accept_encoding = {'Accept-Encoding': 'gzip, deflate'}
+_default_reply_workers = 4
+_post_retries = 3
+_post_retry_delay = 0.5 # seconds, doubled for each retry
+_stream_publish_min = 1024 # headers
+_stream_publish_interval = 0.5 # seconds
+_subscribe_timeout = 15 # seconds the server holds a poll open
+# allowed beyond the poll timeout for the reply, whatever the client timeout
+_subscribe_grace = 5 # seconds
+_subscribe_retry_delay = 0.5 # seconds, doubled for each failed poll
+_subscribe_max_delay = 30 # seconds
+
 # NOTE: encode_multipart_formdata and get_content_type copied from public
 # domain code posted at : http://code.activestate.com/recipes/146306/
 
@@ -108,39 +147,427 @@ def get_content_type(filename):
     return 'application/octet-stream'
 
 
+class MultipartProducer (object):
+    """Streaming equivalent of encode_multipart_formdata. File values may
+    be any buffer (bytes, memoryview of a serialized message or of a
+    MessageBodyStore segment) and are written in slices without being
+    copied into a single body. Pass the producer as the body to
+    OnionHost.post (direct requests only), as body_producer to a tornado
+    HTTPRequest or iterate over it"""
+    _chunk_size = 65536
+
+    def __init__(self, fields, files):
+        BOUNDARY = '----------ThIs_Is_tHe_bouNdaRY_$'
+        CRLF = '\r\n'
+        self.content_type = 'multipart/form-data; boundary=%s' % BOUNDARY
+        self._parts = []
+        for (key, value) in fields:
+            part = ['--' + BOUNDARY,
+                    'Content-Disposition: form-data; name="%s"' % key,
+                    '', value, '']
+            self._parts.append(CRLF.join(part).encode())
+        for (key, filename, value) in files:
+            part = ['--' + BOUNDARY,
+                    'Content-Disposition: form-data; name="%s"; filename="%s"' % (
+                        key, filename),
+                    'Content-Type: %s' % get_content_type(filename),
+                    '', '']
+            self._parts.append(CRLF.join(part).encode())
+            self._parts.append(memoryview(value).cast('B'))
+            self._parts.append(CRLF.encode())
+        self._parts.append(('--' + BOUNDARY + '--' + CRLF).encode())
+        self.length = sum(len(p) for p in self._parts)
+
+    def headers(self):
+        return {'Content-Type': self.content_type,
+                'content-length': str(self.length)}
+
+    def __iter__(self):
+        for p in self._parts:
+            for i in range(0, len(p), self._chunk_size):
+                yield p[i:i + self._chunk_size]
+
+    async def __call__(self, write):
+        # tornado body_producer interface
+        for chunk in self:
+            await write(chunk)
+
+
+class HeaderStreamParser (object):
+    """Incremental parser for the headers endpoint response
+    ({"header_list": ["...", ...]}). Chunks are passed to feed() as they
+    arrive and callback is called with each header string as soon as it is
+    complete. Only the header currently being received is buffered"""
+    _key = b'"header_list"'
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.count = 0
+        self.done = False
+        self._prefix = bytearray()
+        self._str = bytearray()
+        self._in_str = False
+
+    def feed(self, chunk):
+        if self.done:
+            return
+        pos = 0
+        if self._prefix is not None:
+            self._prefix += chunk
+            k = self._prefix.find(HeaderStreamParser._key)
+            if k < 0:
+                # keep enough to match a key split across chunks
+                del self._prefix[:-len(HeaderStreamParser._key)]
+                return
+            b = self._prefix.find(b'[', k)
+            if b < 0:
+                return
+            chunk = bytes(self._prefix[b + 1:])
+            self._prefix = None
+        while pos < len(chunk):
+            if not self._in_str:
+                q = chunk.find(b'"', pos)
+                e = chunk.find(b']', pos)
+                if (e >= 0) and ((q < 0) or (e < q)):
+                    self.done = True
+                    return
+                if q < 0:
+                    return
+                self._in_str = True
+                pos = q + 1
+                continue
+            q = chunk.find(b'"', pos)
+            if q < 0:
+                self._str += chunk[pos:]
+                return
+            self._str += chunk[pos:q]
+            pos = q + 1
+            nbs = len(self._str) - len(self._str.rstrip(b'\\'))
+            if (nbs & 1) != 0:
+                # escaped quote, part of the string
+                self._str += b'"'
+                continue
+            self._emit(bytes(self._str))
+            self._str = bytearray()
+            self._in_str = False
+
+    def _emit(self, raw):
+        if b'\\' in raw:
+            hstr = json.loads(b'"' + raw + b'"')
+        else:
+            hstr = raw.decode()
+        self.count += 1
+        self.callback(hstr)
+
+
+class _Response (object):
+    def __init__(self, code, body, headers=None):
+        self.code = code
+        self.body = body
+        self.headers = headers
+
+
+# the server closed the connection before sending any of the reply
+_stale_errors = (http.client.RemoteDisconnected, BrokenPipeError,
+                 ConnectionResetError)
+_idempotent_methods = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+
+def _dropped(conn):
+    # an idle keep-alive connection only becomes readable if the server
+    # closed it (or sent something unasked), either way it is not reusable
+    if conn.sock is None:
+        return False
+    try:
+        r, w, x = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return len(r) > 0
+
+
+class _HostPool (object):
+    """idle keep-alive connections to a single host:port"""
+    def __init__(self, host, port, size, idle_timeout, timeout):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = []
+        self._lock = Lock()
+
+    def acquire(self, timeout=None):
+        """returns (connection, reused), timeout (if given) replaces the
+        pool's socket timeout for the next request"""
+        now = time.time()
+        conn = None
+        self._lock.acquire()
+        while len(self._idle) > 0:
+            c, t = self._idle.pop()
+            if ((now - t) < self.idle_timeout) and not _dropped(c):
+                conn = c
+                break
+            c.close()
+        self._lock.release()
+        if timeout is None:
+            timeout = self.timeout
+        if conn is None:
+            return http.client.HTTPConnection(self.host, self.port, timeout=timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def release(self, conn):
+        self._lock.acquire()
+        if len(self._idle) < self.size:
+            self._idle.append((conn, time.time()))
+            conn = None
+        self._lock.release()
+        if conn is not None:
+            conn.close()
+
+    def close(self):
+        self._lock.acquire()
+        idle = self._idle
+        self._idle = []
+        self._lock.release()
+        for c, t in idle:
+            c.close()
+
+
+class PooledHTTPClient (object):
+    """Synchronous HTTP client which keeps a pool of keep-alive connections
+    per host:port. fetch() accepts a tornado HTTPRequest and returns a
+    response with code, body and headers (non-200 replies do not raise).
+    The request's request_timeout, if set, overrides timeout"""
+    def __init__(self, pool_size=_default_pool_size,
+                 idle_timeout=_default_idle_timeout,
+                 timeout=_default_request_timeout):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.pools = {}
+        self._lock = Lock()
+
+    def _pool(self, host, port):
+        key = host + ':' + str(port)
+        self._lock.acquire()
+        pool = self.pools.get(key)
+        if pool is None:
+            pool = _HostPool(host, port, self.pool_size, self.idle_timeout,
+                             self.timeout)
+            self.pools[key] = pool
+        self._lock.release()
+        return pool
+
+    def fetch(self, req):
+        u = urlsplit(req.url)
+        path = u.path or '/'
+        if u.query:
+            path += '?' + u.query
+        headers = {}
+        if req.headers is not None:
+            headers = dict(req.headers)
+        pool = self._pool(u.hostname, u.port or 80)
+        while True:
+            body = req.body
+            if req.body_producer is not None:
+                # http.client sends each chunk of an iterable body
+                body = iter(req.body_producer)
+            conn, reused = pool.acquire(req.request_timeout)
+            # a reused connection which the server closed while idle fails
+            # before any reply. The request is sent again on a fresh
+            # connection if it was not written yet, or (having been
+            # written) is idempotent. Timeouts and later errors are raised
+            sent = False
+            try:
+                conn.request(req.method, path, body=body, headers=headers)
+                sent = True
+                resp = conn.getresponse()
+            except _stale_errors:
+                conn.close()
+                if reused and ((not sent) or (req.method in _idempotent_methods)):
+                    continue
+                raise
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                raise
+            try:
+                body = self._read(resp, req)
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                pool.release(conn)
+            return _Response(resp.status, body, resp.headers)
+
+    def _read(self, resp, req):
+        d = None
+        if resp.getheader('Content-Encoding', '').lower() in ('gzip', 'x-gzip', 'deflate'):
+            # 47 = 32 + 15, accept either gzip or zlib framing
+            d = zlib.decompressobj(47)
+        if req.streaming_callback is None:
+            body = resp.read()
+            if d is not None:
+                body = d.decompress(body) + d.flush()
+            return body
+        while True:
+            chunk = resp.read(65536)
+            if len(chunk) == 0:
+                if d is not None:
+                    chunk = d.flush()
+                    if len(chunk) > 0:
+                        req.streaming_callback(chunk)
+                return b''
+            if d is not None:
+                chunk = d.decompress(chunk)
+                if len(chunk) == 0:
+                    continue
+            req.streaming_callback(chunk)
+
+    def close(self):
+        self._lock.acquire()
+        pools = list(self.pools.values())
+        self.pools = {}
+        self._lock.release()
+        for pool in pools:
+            pool.close()
+
+
+def _async_http_client(max_clients):
+    if CurlAsyncHTTPClient is not None:
+        # libcurl keeps connections alive between requests
+        return CurlAsyncHTTPClient(force_instance=True, max_clients=max_clients)
+    return AsyncHTTPClient(force_instance=True, max_clients=max_clients)
+
+
+def _async_body(aclient, body):
+    """(body, body_producer) for an HTTPRequest sent by aclient. libcurl
+    does not take a body_producer, a MultipartProducer is joined for it"""
+    if not isinstance(body, MultipartProducer):
+        return body, None
+    if (CurlAsyncHTTPClient is not None) and isinstance(aclient, CurlAsyncHTTPClient):
+        return b''.join(body), None
+    return None, body
+
+
 class CTClient (object):
+    """HTTP client context. Each instance owns an async client and a pool of
+    keep-alive connections per host:port for synchronous requests. Pass the
+    instance to OnionHost/MsgStore (client=) or use it as a context manager,
+    which also makes it the default for hosts created without a client"""
     _aclient = None
     _sclient = None
-    def __init__(self):
-        pass
+    def __init__(self, max_clients=_default_max_clients,
+                 pool_size=_default_pool_size,
+                 idle_timeout=_default_idle_timeout,
+                 timeout=_default_request_timeout):
+        self.max_clients = max_clients
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.aclient = None
+        self.sclient = None
+        self._saved = []
+
+    def open(self):
+        if self.sclient is None:
+            self.sclient = PooledHTTPClient(self.pool_size, self.idle_timeout,
+                                            self.timeout)
+        if self.aclient is None:
+            self.aclient = _async_http_client(self.max_clients)
+        return self
+
+    def close(self):
+        if self.aclient is not None:
+            self.aclient.close()
+            self.aclient = None
+        if self.sclient is not None:
+            self.sclient.close()
+            self.sclient = None
+
+    def fetch(self, req):
+        if self.sclient is None:
+            self.open()
+        return self.sclient.fetch(req)
 
     def __enter__(self):
-        CTClient._aclient = AsyncHTTPClient(max_clients=100)
-        CTClient._sclient = HTTPClient()
+        self.open()
+        self._saved.append((CTClient._aclient, CTClient._sclient))
+        CTClient._aclient = self.aclient
+        CTClient._sclient = self.sclient
+        return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        CTClient._aclient.close()
-        CTClient._aclient = None
-        CTClient._sclient.close()
-        CTClient._sclient = None
+        CTClient._aclient, CTClient._sclient = self._saved.pop()
+        self.close()
+
+
+def _sync_client(client):
+    if client is not None:
+        if client.sclient is None:
+            client.open()
+        return client.sclient
+    return CTClient._sclient
+
+
+def _async_client(client):
+    if client is not None:
+        if client.aclient is None:
+            client.open()
+        return client.aclient
+    return CTClient._aclient
 
 
 class OnionHost(object):
-    def __init__(self, host, port=7754, Pkey=None):
+    # set (on the class or an instance) to BinaryOnionRequest to send onion
+    # routed requests as binary v2 packets
+    request_class = None
+
+    def __init__(self, host, port=7754, Pkey=None, client=None):
         self.host = host
         self.port = port
         self.Pkey = Pkey
+        self.client = client
+        self._table = None
+
+    def _set_pkey(self, Pkey):
+        # a table for a different key is dropped, the next one is built by
+        # the first _ecdh so hosts which never route onions do not pay for it
+        table = self._table
+        if (table is not None) and (table.point.compress() != Pkey.compress()):
+            self._table = None
+        self.Pkey = Pkey
+
+    def _ecdh(self, k):
+        """returns Pkey * k, using the per-host precomputed table"""
+        table = self._table
+        if (table is None) or (table.point is not self.Pkey):
+            if (table is not None) and (table.point.compress() == self.Pkey.compress()):
+                table.point = self.Pkey
+            else:
+                table = FixedBaseTable(self.Pkey)
+                self._table = table
+        return table.mul(k)
 
     def _baseurl(self):
         return 'http://' + self.host + ':' + str(self.port) + '/'
 
+    def _onion_request(self):
+        if self.request_class is None:
+            return OnionRequest(self.client)
+        return self.request_class(self.client)
+
     def refresh(self):
         req = HTTPRequest(self._baseurl() + _statusPath, method='GET')
-        r = CTClient._sclient.fetch(req)
+        r = _sync_client(self.client).fetch(req)
         if r.code != 200:
             return False
         pub = json.loads(r.body.decode('UTF-8'))['pubkey']
-        self.Pkey = Point.decompress(pub.encode('UTF-8'))
+        self._set_pkey(Point.decompress(pub.encode('UTF-8')))
         return True
 
     def __str__(self):
@@ -150,23 +577,24 @@ class OnionHost(object):
         if onions is None:
             if nak is not None:
                 raise(ValueError, 'Using NAK requires Onions route list is provided')
-            return OnionRequest().get(self._baseurl(), path, callback=callback, headers=headers)
+            return OnionRequest(self.client).get(self._baseurl(), path, callback=callback, headers=headers)
         if nak is None:
             raise ValueError('Onion routing requires NAK is provided')
-        return OnionRequest().get(self, path, nak=nak, callback=callback, headers=headers, onions=onions)
+        return self._onion_request().get(self, path, nak=nak, callback=callback, headers=headers, onions=onions)
 
     def post(self, path, body, nak=None, callback=None, headers=None, onions=None):
         if onions is None:
             if nak is not None:
                 raise(ValueError, 'Using NAK requires Onions route list is provided')
-            return OnionRequest().post(self._baseurl(), path, body, callback=callback, headers=headers)
+            return OnionRequest(self.client).post(self._baseurl(), path, body, callback=callback, headers=headers)
         if nak is None:
             raise ValueError('Onion routing requires NAK is provided')
-        return OnionRequest().post(self, path, body, nak=nak, callback=callback, headers=headers, onions=onions)
+        return self._onion_request().post(self, path, body, nak=nak, callback=callback, headers=headers, onions=onions)
 
 
 class NestedRequest(object):
-    def __init__(self):
+    def __init__(self, client=None):
+        self.client = client
         self.callback = None
         self.callback_next = None
         
@@ -179,10 +607,10 @@ class NestedRequest(object):
         if onions is None:
             if nak is not None:
                 raise(ValueError, 'Using NAK requires Onions route list is provided')
-            return OnionRequest().get(ohost._baseurl(), path, nak=nak, callback=self._callback, headers=headers, onions=onions)
+            return OnionRequest(self.client).get(ohost._baseurl(), path, nak=nak, callback=self._callback, headers=headers, onions=onions)
         if nak is None:
             raise ValueError('Onion routing requires NAK is provided')
-        return OnionRequest().get(ohost, path, nak=nak, callback=self._callback, headers=headers, onions=onions)
+        return OnionRequest(self.client).get(ohost, path, nak=nak, callback=self._callback, headers=headers, onions=onions)
         
     
     def post(self, ohost, path, body, callback, callback_next, headers=None, nak=None, onions=None):
@@ -191,22 +619,21 @@ class NestedRequest(object):
         if onions is None:
             if nak is not None:
                 raise(ValueError, 'Using NAK requires Onions route list is provided')
-            return OnionRequest().post(ohost._baseurl(), path, body, nak=nak, callback=self._callback, headers=headers, onions=onions)
+            return OnionRequest(self.client).post(ohost._baseurl(), path, body, nak=nak, callback=self._callback, headers=headers, onions=onions)
         if nak is None:
             raise ValueError('Onion routing requires NAK is provided')
-        return OnionRequest().post(ohost, path, body, nak=nak, callback=self._callback, headers=headers, onions=onions)
+        return OnionRequest(self.client).post(ohost, path, body, nak=nak, callback=self._callback, headers=headers, onions=onions)
 
 
 class OnionRequest(object):
-    def __init__(self):
-        self.callback = None
+    def __init__(self, client=None):
+        self.client = client
         self.reply_pkey = None
         self.reply_Pkey = None
         self.reply_ohost = None
  
     def _format_get(self, path, headers):
-        self.reply_pkey = random.randint(1,_C['n']-1)
-        self.reply_Pkey = _G * self.reply_pkey
+        self.reply_pkey, self.reply_Pkey = session_key_pool().get()
         r = {}
         r['local'] = True
         r['url'] = path
@@ -216,8 +643,7 @@ class OnionRequest(object):
         return r
     
     def _format_post(self, path, body, headers):
-        self.reply_pkey = random.randint(1,_C['n']-1)
-        self.reply_Pkey = _G * self.reply_pkey
+        self.reply_pkey, self.reply_Pkey = session_key_pool().get()
         r = {}
         r['local'] = True
         r['url'] = path
@@ -230,12 +656,11 @@ class OnionRequest(object):
     def _wrap(self, onion, req):
         if not req['local']:
             req['body'] = base64.b64encode(req['body']).decode()
-        session_pkey = random.randint(1,_C['n']-1)
-        session_Pkey = _G * session_pkey
+        session_pkey, session_Pkey = session_key_pool().get()
         if onion.Pkey is None:
             if not onion.refresh():
                 return None
-        ECDH = onion.Pkey * session_pkey
+        ECDH = onion._ecdh(session_pkey)
         keybin = hashlib.sha256(ECDH.compress()).digest()
         iv = random.randint(0,(1 << 128)-1)
         ivbin = unhexlify('%032x' % iv)
@@ -257,7 +682,7 @@ class OnionRequest(object):
         sig = (int(hexlify(d_bd[0:32]),16), int(hexlify(d_bd[32:64]),16))
         if not _ecdsa.verify(ohost.Pkey, sig, d_bd[64:]):
             return None
-        d_ecdh = ohost.Pkey * self.reply_pkey
+        d_ecdh = ohost._ecdh(self.reply_pkey)
         d_keybin = hashlib.sha256(d_ecdh.compress()).digest()
         d_ivcount = int(hexlify(d_bd[64:80]),16)
         d_counter = Counter.new(128,initial_value=d_ivcount)
@@ -269,47 +694,80 @@ class OnionRequest(object):
         sig = nak.sign(request)
         return unhexlify('%064x' % sig[0]) + unhexlify('%064x' % sig[1])
 
-    def _callback(self, resp):
-        self.callback(resp.body)
+    def _reply(self, ohost, body):
+        return self._decrypt_reply(ohost, body)
+
+    async def _fetch_callback(self, callback, ohost, path, body, rtype, nak, onions, headers):
+        # the reply is verified and decrypted off the loop by fetch_async,
+        # callback is then called on the loop with the reply (or None)
+        r = await self.fetch_async(ohost, path, body, rtype, nak, onions, headers)
+        callback(r)
+        return r
+
+    async def _direct_callback(self, callback, aclient, req):
+        # as _fetch_callback for a request which is not onion routed
+        r = await aclient.fetch(req, raise_error=False)
+        body = None
+        if r.code == 200:
+            body = r.body
+        callback(body)
+        return body
+
+    def _onion_http_request(self, ohost, path, body=None, rtype='GET', nak=None, onions=None, headers=None):
+        if rtype.lower() == 'get':
+            inner = self._format_get(path, headers)
+        else:
+            inner = self._format_post(path, body, headers)
+        outer = self._wrap(ohost, inner)
+        if outer is None:
+            print('wrap failed for host' + str(ohost))
+            return None
+        for o in reversed(onions):
+            inner = outer
+            outer = self._wrap(o,inner)
+            if outer is None:
+                print('wrap failed for host' + str(ohost))
+                return None
+        naksig = self._nakit(nak, outer['body'])
+        body = nak.pubkeybin() + naksig + outer['body']
+        body = base64.b64encode(body).decode()
+        url = 'http://' + outer['host'] + ':' + str(outer['port']) + '/onion/' + outer['pubkey']
+        # request headers travel inside the onion, not on the outer request
+        return HTTPRequest(url, method='POST', body=body)
 
-    def _decrypt_callback(self, resp):
-        if self.callback is None:
-            raise ValueError('_decrypt_callback called with no chain callback')
-        d_resp = self._decrypt_reply(self.reply_ohost, resp.body)
-        self.callback(d_resp)
+    async def fetch_async(self, ohost, path, body=None, rtype='GET', nak=None, onions=None, headers=None):
+        """coroutine for an onion routed request, returns the reply or None.
+        The reply is verified and decrypted in reply_executor()"""
+        if nak is None:
+            raise ValueError('Onion routing requires network access key')
+        if onions is None:
+            onions = []
+        req = self._onion_http_request(ohost, path, body, rtype, nak, onions, headers)
+        if req is None:
+            return None
+        r = await _async_client(self.client).fetch(req, raise_error=False)
+        if r.code != 200:
+            return None
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(reply_executor(), self._reply, ohost, r.body)
 
     def _issue(self, ohost, path, body=None, rtype='GET', nak=None, callback=None, onions=None, headers=None):
         if isinstance(ohost, OnionHost):
             if nak is None:
                 raise ValueError('Onion routing requires network access key')
-            if rtype.lower() == 'get':
-                inner = self._format_get(path, headers)
-            else:
-                inner = self._format_post(path, body, headers)
-            outer = self._wrap(ohost, inner)
-            if outer is None:
-                print('wrap failed for host' + str(ohost))
+            if onions is None:
+                onions = []
+            if callback is not None:
+                # returns the future, which resolves to the reply as well
+                return asyncio.ensure_future(self._fetch_callback(
+                    callback, ohost, path, body, rtype, nak, onions, headers))
+            req = self._onion_http_request(ohost, path, body, rtype, nak, onions, headers)
+            if req is None:
                 return None
-            for o in reversed(onions):
-                inner = outer
-                outer = self._wrap(o,inner)
-                if outer is None:
-                    print('wrap failed for host' + str(ohost))
-                    return None
-            naksig = self._nakit(nak, outer['body'])
-            body = nak.pubkeybin() + naksig + outer['body']
-            body = base64.b64encode(body).decode()
-            url = 'http://' + outer['host'] + ':' + str(outer['port']) + '/onion/' + outer['pubkey']
-            req = HTTPRequest(url, method='POST', body=body, headers=headers)
-            if callback is None:
-                r = CTClient._sclient.fetch(req)
-                if r.code != 200:
-                    return None
-                return self._decrypt_reply(ohost,r.body)
-            else:
-                self.callback = callback
-                self.reply_ohost = ohost
-                return CTClient._aclient.fetch(req, self._decrypt_callback)
+            r = _sync_client(self.client).fetch(req)
+            if r.code != 200:
+                return None
+            return self._reply(ohost, r.body)
         
         else:
             if onions is not None:
@@ -320,27 +778,33 @@ class OnionRequest(object):
                 # print('sending GET to ' + url)
                 req = HTTPRequest(url, method='GET', headers=headers)
                 if callback is None:
-                    r = CTClient._sclient.fetch(req)
+                    r = _sync_client(self.client).fetch(req)
                     if r.code != 200:
                         return None
                     # print('return 200')
                     return r.body
                 else:
-                    self.callback = callback
-                    # print('url = ' + url + ', callback = ' + str(callback))
-                    return CTClient._aclient.fetch(req, callback=self._callback)
+                    # returns the future, which resolves to the reply as well
+                    return asyncio.ensure_future(self._direct_callback(
+                        callback, _async_client(self.client), req))
             else:
                 # print('sending POST to ' + url)
-                req = HTTPRequest(url, method='POST', body=body, headers=headers)
                 if callback is None:
-                    r = CTClient._sclient.fetch(req)
+                    if isinstance(body, MultipartProducer):
+                        req = HTTPRequest(url, method='POST', body_producer=body, headers=headers)
+                    else:
+                        req = HTTPRequest(url, method='POST', body=body, headers=headers)
+                    r = _sync_client(self.client).fetch(req)
                     if r.code != 200:
                         return None
                     # print('return 200')
                     return r.body
                 else:
-                    self.callback = callback
-                    return CTClient._aclient.fetch(req, self._callback)
+                    aclient = _async_client(self.client)
+                    body, body_producer = _async_body(aclient, body)
+                    req = HTTPRequest(url, method='POST', body=body,
+                                      body_producer=body_producer, headers=headers)
+                    return asyncio.ensure_future(self._direct_callback(callback, aclient, req))
         
     
     def get(self, ohost, path, nak=None, callback=None, onions=None, headers=None):
@@ -350,40 +814,234 @@ class OnionRequest(object):
         return self._issue(ohost, path, body=body, rtype='POST', nak=nak, callback=callback, onions=onions, headers=headers)
 
 
+class BinaryOnionRequest (OnionRequest):
+    """OnionRequest using the binary v2 onion packet format (see
+    OnionHeader). Each hop adds whole 192 byte blocks instead of a base64 and
+    JSON layer and the reply is returned as bytes. Direct (non-onion)
+    requests are issued as by OnionRequest"""
+    def _wrap_v2(self, onion, hdr, payload, nak):
+        session_pkey, session_Pkey = session_key_pool().get()
+        if onion.Pkey is None:
+            if not onion.refresh():
+                return None
+        return hdr.wrap(onion._ecdh(session_pkey), session_Pkey, payload, nak)
+
+    def encode(self, ohost, path, body=None, rtype='GET', nak=None, onions=None, ctype=None):
+        """returns (entry host, packet) for a request to ohost routed
+        through onions (first hop first), or None"""
+        if body is None:
+            body = b''
+        if isinstance(body, str):
+            body = body.encode()
+        self.reply_pkey, self.reply_Pkey = session_key_pool().get()
+        hdr = OnionHeader()
+        nblocks = (len(body) + _v2_blocksize - 1) // _v2_blocksize
+        if hdr._generate_local(path, nblocks, nak, self.reply_Pkey, method=rtype, bodylen=len(body), ctype=ctype) is None:
+            return None
+        packet = self._wrap_v2(ohost, hdr, body, nak)
+        nexthop = ohost
+        for o in reversed(onions):
+            if packet is None:
+                return None
+            hdr = OnionHeader()
+            hdr._generate_remote(nexthop.host, nexthop.port, len(packet) // _v2_blocksize, nak)
+            packet = self._wrap_v2(o, hdr, packet, nak)
+            nexthop = o
+        if packet is None:
+            return None
+        return (nexthop, packet)
+
+    def decode(self, ohost, reply):
+        """returns the decrypted reply body from ohost, or None"""
+        if reply is None:
+            return None
+        return OnionHeader.open_reply(ohost.Pkey, ohost._ecdh(self.reply_pkey), reply)
+
+    def _reply(self, ohost, body):
+        return self.decode(ohost, body)
+
+    def _onion_http_request(self, ohost, path, body=None, rtype='GET', nak=None, onions=None, headers=None):
+        ctype = None
+        if headers is not None:
+            ctype = headers.get('Content-Type')
+        if isinstance(body, MultipartProducer):
+            ctype = body.content_type
+            body = b''.join(bytes(c) for c in body)
+        encoded = self.encode(ohost, path, body, rtype, nak, onions, ctype)
+        if encoded is None:
+            print('wrap failed for host' + str(ohost))
+            return None
+        entry, packet = encoded
+        return HTTPRequest(entry._baseurl() + _onion_v2, method='POST', body=packet,
+                           headers={'Content-Type': 'application/octet-stream'})
+
+
+_reply_executor = None
+_reply_executor_lock = Lock()
+
+
+def reply_executor():
+    """executor used to verify and decrypt async onion replies"""
+    global _reply_executor
+    _reply_executor_lock.acquire()
+    if _reply_executor is None:
+        _reply_executor = ThreadPoolExecutor(max_workers=_default_reply_workers)
+    executor = _reply_executor
+    _reply_executor_lock.release()
+    return executor
+
+
+def set_reply_executor(executor):
+    """replaces the reply executor (e.g. with a larger pool or a process
+    pool), returns the previous one"""
+    global _reply_executor
+    _reply_executor_lock.acquire()
+    prev = _reply_executor
+    _reply_executor = executor
+    _reply_executor_lock.release()
+    return prev
+
+
+class HeaderSnapshot (tuple):
+    """Immutable view of a store's headers, newest first. Syncs publish a
+    new snapshot instead of modifying the current one, so a snapshot can be
+    iterated without locking. version increases with each snapshot and ids
+    is the set of message ids (I) it contains"""
+    def __new__(cls, hdrs=(), version=0, ids=None):
+        snapshot = super(HeaderSnapshot, cls).__new__(cls, hdrs)
+        snapshot.version = version
+        if ids is None:
+            ids = frozenset(h.Iraw() for h in snapshot)
+        snapshot.ids = ids
+        return snapshot
+
+
+def _transient_code(code):
+    # worth retrying: server errors, timeouts and rate limiting. Other 4xx
+    # replies (e.g. a malformed message) fail the same way every time
+    return (code >= 500) or (code in (408, 429))
+
+
+def _require_sync(store):
+    # MsgStorePool, SyncScheduler and PeerManager call the blocking
+    # MsgStore methods, an AsyncMsgStore is passed as its .store
+    if not isinstance(store, MsgStore):
+        raise TypeError(type(store).__name__ + ' is not a MsgStore')
+
+
 class MsgStore (OnionHost):
-    """Client library for message store server"""
-    def __init__(self, host, port):
-        super(MsgStore, self).__init__(host, port)
-        self.headers = []
+    """Client library for message store server. self.headers is a
+    HeaderSnapshot, replaced (not modified) by every sync"""
+
+    def __init__(self, host, port, cache=None, bodies=None, msgcache=None,
+                 client=None):
+        super(MsgStore, self).__init__(host, port, client=client)
+        self._headers = HeaderSnapshot()
         self.cache_dirty = True
         self.last_sync = time.time()
         self.servertime = 0
+        self.cache = cache
+        self.bodies = bodies
+        self.msgcache = msgcache
         self._get_queue = []
         self._post_queue = []
         self._insert_lock = Lock()
         self._gq_lock = Lock()
+        self._pq_ready = Condition(self._gq_lock)
+        self._pq_inflight = 0
+        self._pq_workers = 0
+        self._pq_blocked = False
+        self._sub_thread = None
+        self._sub_stop = Event()
+        self._sub_live = False
+        self._sub_cursor = None
         self.reply_log = []
+        if cache is not None:
+            self._load_cache()
+
+    @property
+    def headers(self):
+        return self._headers
+
+    @headers.setter
+    def headers(self, hdrs):
+        self._insert_lock.acquire()
+        self._headers = HeaderSnapshot(sorted(hdrs, reverse=True),
+                                       self._headers.version + 1)
+        self._insert_lock.release()
+
+    def _swap_headers(self, added=(), expire=None):
+        """publishes a new snapshot with the headers in added which are not
+        already known and without those which expired before expire. The
+        lock is taken once for the whole batch. Returns the headers added"""
+        if (len(added) == 0) and (expire is not None):
+            # snapshots are immutable, check for anything to expire unlocked
+            if all(h.expire >= expire for h in self._headers):
+                return []
+        self._insert_lock.acquire()
+        current = self._headers
+        keep = current
+        if expire is not None:
+            keep = [h for h in current if h.expire >= expire]
+            if len(keep) == len(current):
+                keep = current
+        new = []
+        newids = set()
+        for h in added:
+            k = h.Iraw()
+            if (k not in current.ids) and (k not in newids):
+                newids.add(k)
+                new.append(h)
+        if (len(new) == 0) and (keep is current):
+            self._insert_lock.release()
+            return new
+        ids = None
+        if keep is current:
+            ids = current.ids | newids
+        if len(new) > 0:
+            # keep is already sorted, one linear merge with the batch
+            new.sort(reverse=True)
+            keep = list(heapq.merge(keep, new, reverse=True))
+        self._headers = HeaderSnapshot(keep, current.version + 1, ids)
+        self._insert_lock.release()
+        return new
+
+    def _hostport(self):
+        return self.host + ':' + str(self.port)
 
-    def _sync_headers(self, onions=None):
+    def _load_cache(self):
+        hostport = self._hostport()
+        servertime = self.cache.servertime(hostport)
+        hdrs = []
+        for rstr in self.cache.load(hostport):
+            rhdr = RawMessageHeader()
+            if rhdr._deserialize_header(rstr.encode()):
+                hdrs.append(rhdr)
+        hdrs.sort(reverse=True)
+        self._insert_lock.acquire()
+        self._headers = HeaderSnapshot(hdrs, self._headers.version + 1)
+        self.servertime = servertime
+        self._insert_lock.release()
+
+    def _sync_headers(self, onions=None, stream=False, reconcile=False,
+                      windows=1):
         if self.Pkey is None:
             self.refresh()
-        now = time.time()
-        if not self.cache_dirty:
-            delay = now - self.last_sync
-            if (now - self.last_sync) < _cache_expire_time:
-                return True
+        if not self._sync_due():
+            return True
         r = self.get(_server_time)
         if r is None:
             return False
         servertime = json.loads(r.decode())['time']
-        for h in self.headers:
-            if servertime > h.expire:
-                self._insert_lock.acquire()
-                # print('expiring ' + h.I.compress().decode())
-                self.headers.remove(h)
-                self._insert_lock.release()
+        self._expire_headers(servertime)
         self.last_sync = time.time()
-        r = self.get(_headers_since + str(self.servertime))
+        if reconcile:
+            return self._reconcile_headers(servertime)
+        if (windows > 1) and (self.servertime == 0):
+            return self._bootstrap_headers(servertime, windows)
+        if stream:
+            return self._stream_headers(servertime)
+        r = self.get(_headers_since + str(self.servertime), headers=dict(_accept_encoding))
         if r is None:
             return False
         self.servertime = servertime
@@ -391,85 +1049,505 @@ class MsgStore (OnionHost):
         #remote = sorted(json.loads(r.decode())['header_list'],
         #                key=lambda k: int(k[6:14],16), reverse=True)
         remote = json.loads(r.decode())['header_list']
+        self._merge_headers(servertime, remote)
+        return True
+
+    def _sync_due(self):
+        """True if _sync_headers would contact the server, False if it
+        would answer from the headers already held"""
+        if (self.Pkey is None) or self.cache_dirty:
+            return True
+        if self._sub_live:
+            # the subscription keeps self.headers current
+            return False
+        return (time.time() - self.last_sync) >= _cache_expire_time
+
+    def _expire_headers(self, servertime):
+        self._swap_headers(expire=servertime)
+        if self.cache is not None:
+            self.cache.expire(self._hostport(), servertime)
+        if self.bodies is not None:
+            self.bodies.compact(servertime)
+        if self.msgcache is not None:
+            self.msgcache.expire(servertime)
+
+    def _known_headers(self):
+        return set(self.headers.ids)
+
+    def _cache_batch(self):
+        # raw header strings for the HeaderCache, none are kept without one
+        if self.cache is None:
+            return None
+        return []
+
+    def _merge_header(self, rstr, known, cached, added):
+        # collects new headers in added, published by _swap_headers
+        rhdr = RawMessageHeader()
+        if not rhdr._deserialize_header(rstr.encode()):
+            return
+        if cached is not None:
+            cached.append((rhdr.Iraw().decode(), rhdr.expire, rstr))
+        if rhdr.Iraw() in known:
+            return
+        known.add(rhdr.Iraw())
+        added.append(rhdr)
+
+    def _merge_headers(self, servertime, remote):
+        """returns the headers which were not already known"""
+        known = self._known_headers()
+        cached = self._cache_batch()
+        added = []
         for rstr in reversed(remote):
-            rhdr = RawMessageHeader()
-            if rhdr._deserialize_header(rstr.encode()):
-                self._insert_lock.acquire()
-                if rhdr not in self.headers:
-                    self.headers.insert(0, rhdr)
-                self._insert_lock.release()
-        self._insert_lock.acquire()
-        self.headers.sort(reverse=True)
-        self._insert_lock.release()
+            self._merge_header(rstr, known, cached, added)
+        return self._finish_merge(servertime, cached, added)
+
+    def _finish_merge(self, servertime, cached, added):
+        added = self._swap_headers(added)
+        if self.cache is not None:
+            self.cache.update(self._hostport(), servertime, cached)
+        return added
+
+    def _chunk_merger(self, parser, added):
+        # streaming callback publishing the headers completed so far. Each
+        # snapshot copies the whole list, so one is published only for a
+        # batch of _stream_publish_min headers and a quarter of those held,
+        # or after _stream_publish_interval seconds, which keeps a sync
+        # linear. _finish_merge publishes the rest
+        last = [time.time()]
+        def feed(chunk):
+            parser.feed(chunk)
+            if len(added) == 0:
+                return
+            now = time.time()
+            if ((len(added) >= max(_stream_publish_min, len(self._headers) >> 2)) or
+                    ((now - last[0]) >= _stream_publish_interval)):
+                self._swap_headers(added)
+                del added[:]
+                last[0] = now
+        return feed
+
+    def _stream_headers(self, servertime):
+        """fetches headers?since= incrementally, headers are published (in
+        self.headers) as each chunk of the response is parsed"""
+        known = self._known_headers()
+        cached = self._cache_batch()
+        added = []
+        parser = HeaderStreamParser(lambda rstr: self._merge_header(rstr, known, cached, added))
+        req = HTTPRequest(self._baseurl() + _headers_since + str(self.servertime),
+                          method='GET', headers=dict(_accept_encoding),
+                          streaming_callback=self._chunk_merger(parser, added))
+        r = _sync_client(self.client).fetch(req)
+        if (r.code != 200) or (not parser.done):
+            return False
+        self.servertime = servertime
+        self.cache_dirty = False
+        self._finish_merge(servertime, cached, added)
         return True
     
-    def get_headers(self):
-        self._sync_headers()
+    def _reconcile_headers(self, servertime):
+        """sends a Bloom filter of the ids already held and receives only
+        the headers missing from it, independent of self.servertime"""
+        known = self._known_headers()
+        bloom = BloomFilter.for_capacity(len(known))
+        for k in known:
+            bloom.add(k)
+        cached = self._cache_batch()
+        added = []
+        parser = HeaderStreamParser(lambda rstr: self._merge_header(rstr, known, cached, added))
+        headers = dict(_accept_encoding)
+        headers['Content-Type'] = 'application/octet-stream'
+        req = HTTPRequest(self._baseurl() + _headers_reconcile, method='POST',
+                          body=bloom.serialize(), headers=headers,
+                          streaming_callback=self._chunk_merger(parser, added))
+        r = _sync_client(self.client).fetch(req)
+        if (r.code != 200) or (not parser.done):
+            return False
+        self.servertime = servertime
+        self.cache_dirty = False
+        self._finish_merge(servertime, cached, added)
+        return True
+
+    def subscribe(self, callback=None, timeout=_subscribe_timeout):
+        """keeps a long-poll request open on headers/subscribe from a
+        background thread so new headers are merged as soon as the server
+        stores them, instead of every _cache_expire_time seconds. callback
+        (if given) is called from that thread with the list of new headers
+        (e.g. to check is_for). After a failed poll the thread reconnects
+        with backoff and catches up from self.servertime"""
+        if self._sub_thread is not None:
+            return False
+        # a fresh event per thread, an unsubscribed thread may still be
+        # waiting on its last poll
+        self._sub_stop = Event()
+        self._sub_thread = Thread(target=self._subscribe_loop,
+                                  args=(callback, timeout, self._sub_stop))
+        self._sub_thread.daemon = True
+        self._sub_thread.start()
+        return True
+
+    def unsubscribe(self):
+        """stops the subscription, the thread exits once the outstanding
+        poll returns"""
+        if self._sub_thread is None:
+            return
+        self._sub_stop.set()
+        self._sub_live = False
+        self._sub_thread = None
+
+    def _subscribe_loop(self, callback, timeout, stop):
+        delay = _subscribe_retry_delay
+        while not stop.is_set():
+            added = self._poll_headers(timeout)
+            if stop.is_set():
+                break
+            if added is None:
+                self._sub_live = False
+                self._sub_cursor = None
+                stop.wait(delay)
+                delay = min(delay * 2, _subscribe_max_delay)
+                continue
+            delay = _subscribe_retry_delay
+            self._sub_live = True
+            if (callback is not None) and (len(added) > 0):
+                callback(added)
+
+    def _poll_headers(self, timeout):
+        """one long-poll, returns the new headers or None on error"""
+        url = self._baseurl() + _headers_subscribe + str(self.servertime)
+        url += '&timeout=' + str(timeout)
+        if self._sub_cursor is not None:
+            url += '&cursor=' + str(self._sub_cursor)
+        req = HTTPRequest(url, method='GET', headers=dict(_accept_encoding),
+                          request_timeout=timeout + _subscribe_grace)
+        try:
+            r = _sync_client(self.client).fetch(req)
+        except (http.client.HTTPException, OSError):
+            return None
+        if r.code != 200:
+            return None
+        j = json.loads(r.body.decode())
+        servertime = j['time']
+        self._expire_headers(servertime)
+        added = self._merge_headers(servertime, j['header_list'])
+        self.servertime = servertime
+        self._sub_cursor = j['cursor']
+        self.last_sync = time.time()
+        self.cache_dirty = False
+        return added
+
+    def _window_headers(self, since, until):
+        path = _headers_since + str(since)
+        if until is not None:
+            path += _headers_until + str(until)
+        r = self.get(path, headers=dict(_accept_encoding))
+        if r is None:
+            return None
+        return json.loads(r.decode())['header_list']
+
+    def _bootstrap_headers(self, servertime, windows):
+        """cold start: splits the last _default_ttl seconds before servertime
+        into windows time ranges (the first also covers anything older, the
+        last anything newer), fetches them concurrently and merges them
+        oldest first, as a single since=0 response would be"""
+        step = max(_default_ttl // windows, 1)
+        start = servertime - _default_ttl
+        bounds = [0] + [start + (i * step) for i in range(1, windows)] + [None]
+        ranges = list(zip(bounds[:-1], bounds[1:]))
+        pool = ThreadPoolExecutor(max_workers=windows)
+        try:
+            results = list(pool.map(lambda r: self._window_headers(*r), ranges))
+        finally:
+            pool.shutdown()
+        if None in results:
+            return False
+        remote = []
+        for hlist in results:
+            remote.extend(hlist)
+        self.servertime = servertime
+        self.cache_dirty = False
+        self._merge_headers(servertime, remote)
+        return True
+
+    def get_headers(self, stream=False, reconcile=False, windows=1):
+        """windows > 1 fetches the initial (since=0) sync as that many
+        concurrent time range requests"""
+        self._sync_headers(stream=stream, reconcile=reconcile, windows=windows)
         return self.headers
     
     def get_peers(self):
         if self.Pkey is None:
             self.refresh()
-        r = self.get(_peer_list)
+        r = self.get(_peer_list, headers=dict(_accept_encoding))
         if r is None:
             return None
         return json.loads(r.decode())
 
+    def _store_body(self, m, raw):
+        if m is None:
+            return
+        if self.msgcache is not None:
+            self.msgcache.put(m)
+        if self.bodies is not None:
+            self.bodies.append(m.Iraw(), m.expire, raw)
+
+    def _cached_message(self, msgid):
+        if self.msgcache is not None:
+            m = self.msgcache.get(msgid)
+            if m is not None:
+                return m
+        if self.bodies is None:
+            return None
+        raw = self.bodies.get(msgid)
+        if raw is None:
+            return None
+        m = Message.deserialize(raw)
+        if (m is not None) and (self.msgcache is not None):
+            self.msgcache.put(m)
+        return m
+
     def _cb_get_message(self, resp, callback_next):
         self.reply_log.append((resp, callback_next))
         if resp is None:
             return callback_next(None)
         m = Message.deserialize(resp)
+        self._store_body(m, resp)
         return callback_next(m)
 
     def get_message(self, hdr, callback=None, nak=None, onions=None):
         self._sync_headers()
         if hdr not in self.headers:
             return None
+        m = self._cached_message(hdr.Iraw())
+        if m is not None:
+            if callback is None:
+                return m
+            return callback(m)
         if callback is None:
             r = self.get(_download_message + hdr.Iraw().decode(), nak=nak, onions=onions)
             if r is None:
                 return None
-            return Message.deserialize(r)
+            m = Message.deserialize(r)
+            self._store_body(m, r)
+            return m
         else:
             # print('submitting NestedRequest for ' + self._baseurl() + _download_message + hdr.Iraw().decode() + ' with callback ' + str(callback))
-            return NestedRequest().get(self, _download_message + hdr.Iraw().decode(), callback=self._cb_get_message, callback_next=callback, nak=nak, onions=onions)
+            return NestedRequest(self.client).get(self, _download_message + hdr.Iraw().decode(), callback=self._cb_get_message, callback_next=callback, nak=nak, onions=onions)
             #r = self.get(_download_message + hdr.Iraw().decode())
             #return self._cb_get_message(r, callback)
     
+    def get_messages(self, hdrs, concurrency=_default_get_concurrency,
+                     retries=_default_get_retries):
+        """generator downloading the messages for hdrs with up to concurrency
+        parallel requests. Headers are synchronized once. Yields (hdr, message,
+        error) tuples in arrival order, see AsyncMsgStore.get_messages"""
+        from ciphrtxt.asyncnetwork import AsyncMsgStore
+        from tornado.httpclient import AsyncHTTPClient
+        self._sync_headers()
+        astore = AsyncMsgStore(store=self, concurrency=concurrency)
+        results = queue.Queue()
+        done = object()
+        stop = Event()
+
+        async def drain():
+            astore.aclient = AsyncHTTPClient(force_instance=True,
+                                             max_clients=concurrency)
+            agen = astore.get_messages(hdrs, concurrency, retries, sync=False)
+            try:
+                async for r in agen:
+                    results.put(r)
+                    if stop.is_set():
+                        break
+            finally:
+                await agen.aclose()
+                astore.aclient.close()
+                results.put(done)
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(drain())
+            finally:
+                loop.close()
+
+        t = Thread(target=run)
+        t.daemon = True
+        t.start()
+        try:
+            while True:
+                r = results.get()
+                if r is done:
+                    break
+                yield r
+        finally:
+            stop.set()
+
     def get_message_by_id(self, msgid, callback=None, nak=None, onions=None):
         if isinstance(msgid, bytes):
             msgid = msgid.decode()
+        m = self._cached_message(msgid)
+        if m is not None:
+            if callback is None:
+                return m
+            return callback(m)
         if callback is None:
             r = self.get(_download_message + msgid, nak=None, onions=None)
             if r is None:
                 return None
-            return Message.deserialize(r)
+            m = Message.deserialize(r)
+            self._store_body(m, r)
+            return m
         else:
             # print('submitting NestedRequest for ' + self._baseurl() + _download_message + hdr.Iraw().decode() + ' with callback ' + str(callback))
-            return NestedRequest().get(self, _download_message + msgid, callback=self._cb_get_message, callback_next=callback, nak=nak, onions=onions)
+            return NestedRequest(self.client).get(self, _download_message + msgid, callback=self._cb_get_message, callback_next=callback, nak=nak, onions=onions)
             #r = self.get(_download_message + hdr.Iraw().decode())
             #return self._cb_get_message(r, callback)
     
     def post_message(self, msg, callback=None, nak=None, onions=None):
         if msg in self.headers:
             return
+        if callback is None:
+            return self._post_status(msg, nak, onions)[1]
         raw = msg.serialize()
         nhdr = RawMessageHeader.deserialize(raw)
         fields = []
-        files = [('message', 'message', raw.decode())]
-        content_type, body = encode_multipart_formdata(fields, files)
-        headers = {"Content-Type": content_type, 'content-length': str(len(body))}
+        if onions is None:
+            body = MultipartProducer(fields, [('message', 'message', self._body_source(nhdr, raw))])
+            headers = body.headers()
+        else:
+            files = [('message', 'message', raw.decode())]
+            content_type, body = encode_multipart_formdata(fields, files)
+            headers = {"Content-Type": content_type, 'content-length': str(len(body))}
         r = self.post(_upload_message, body, headers=headers, callback=callback, nak=nak, onions=onions)
         if r is None:
             return None
-        self._insert_lock.acquire()
-        if nhdr not in self.headers:
-            self.headers.insert(0,nhdr)
-        self._insert_lock.release()
-        self.cache_dirty = True
+        self._insert_posted(nhdr, msg, raw)
         return r
 
+    def _post_status(self, msg, nak=None, onions=None):
+        """uploads msg, returns (status, reply) where reply is None on
+        failure. status is the HTTP status of a direct upload, routed
+        uploads only report 200 or 0 (no usable reply)"""
+        raw = msg.serialize()
+        nhdr = RawMessageHeader.deserialize(raw)
+        if onions is None:
+            body = MultipartProducer([], [('message', 'message', self._body_source(nhdr, raw))])
+            req = HTTPRequest(self._baseurl() + _upload_message, method='POST',
+                              body_producer=body, headers=body.headers())
+            resp = _sync_client(self.client).fetch(req)
+            if resp.code != 200:
+                return resp.code, None
+            r = resp.body
+        else:
+            files = [('message', 'message', raw.decode())]
+            content_type, body = encode_multipart_formdata([], files)
+            headers = {"Content-Type": content_type, 'content-length': str(len(body))}
+            r = self.post(_upload_message, body, headers=headers, nak=nak, onions=onions)
+            if r is None:
+                return 0, None
+        self._insert_posted(nhdr, msg, raw)
+        return 200, r
+
+    def _body_source(self, nhdr, raw):
+        # stream from the mapped segment when the body is already on disk
+        if self.bodies is not None:
+            stored = self.bodies.get(nhdr.Iraw())
+            if stored is not None:
+                return stored
+        return raw
+
+    def queue_message(self, msg, nak=None, onions=None, block=True):
+        """queues msg for upload and returns a Future resolved with the server
+        reply. Up to _high_water uploads run in parallel. Once _high_water
+        messages are waiting, producers block (or get None if block is False)
+        until the queue drains to _low_water"""
+        self._gq_lock.acquire()
+        try:
+            if len(self._post_queue) >= _high_water:
+                self._pq_blocked = True
+            while self._pq_blocked:
+                if not block:
+                    return None
+                self._pq_ready.wait()
+            f = Future()
+            self._post_queue.append((msg, nak, onions, f))
+            if self._pq_workers < min(_high_water, len(self._post_queue) + self._pq_inflight):
+                self._pq_workers += 1
+                t = Thread(target=self._post_worker)
+                t.daemon = True
+                t.start()
+            return f
+        finally:
+            self._gq_lock.release()
+
+    def _post_worker(self):
+        while True:
+            self._gq_lock.acquire()
+            if len(self._post_queue) == 0:
+                self._pq_workers -= 1
+                self._pq_ready.notify_all()
+                self._gq_lock.release()
+                return
+            msg, nak, onions, f = self._post_queue.pop(0)
+            self._pq_inflight += 1
+            if self._pq_blocked and (len(self._post_queue) <= _low_water):
+                self._pq_blocked = False
+                self._pq_ready.notify_all()
+            self._gq_lock.release()
+            if f.set_running_or_notify_cancel():
+                self._post_with_retry(msg, nak, onions, f)
+            self._gq_lock.acquire()
+            self._pq_inflight -= 1
+            self._pq_ready.notify_all()
+            self._gq_lock.release()
+
+    def _post_with_retry(self, msg, nak, onions, f):
+        err = None
+        for attempt in range(0, _post_retries + 1):
+            if attempt > 0:
+                time.sleep(_post_retry_delay * (1 << (attempt - 1)))
+            if msg in self.headers:
+                f.set_result(None)
+                return
+            try:
+                status, r = self._post_status(msg, nak, onions)
+            except Exception as e:
+                err = e
+                continue
+            if r is not None:
+                f.set_result(r)
+                return
+            if (status != 0) and not _transient_code(status):
+                f.set_exception(IOError('upload to ' + self._hostport() +
+                                        ' rejected (' + str(status) + ')'))
+                return
+        if err is None:
+            err = IOError('upload to ' + self._hostport() + ' failed')
+        f.set_exception(err)
+
+    def flush_queue(self, timeout=None):
+        """waits until all queued uploads complete, returns False on timeout"""
+        if timeout is not None:
+            deadline = time.time() + timeout
+        self._gq_lock.acquire()
+        try:
+            while (len(self._post_queue) + self._pq_inflight) > 0:
+                if timeout is None:
+                    self._pq_ready.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._pq_ready.wait(remaining)
+            return True
+        finally:
+            self._gq_lock.release()
+
+    def _insert_posted(self, nhdr, msg, raw):
+        self._swap_headers([nhdr])
+        self._store_body(msg, raw)
+        self.cache_dirty = True
+
 
 class Network (object):
     pass
@@ -0,0 +1,286 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
+
+from ciphrtxt.network import MsgStore, _server_time, _require_sync
+
+from Crypto.Random import random
+
+_ewma_alpha = 0.3
+# latency sample recorded for a failed request
+_failure_penalty = 10.0 # seconds
+# peers with a failure score above this are not used
+_max_failure = 0.5
+_default_probe_interval = 30.0 # seconds
+_default_probe_workers = 8
+_default_route_hops = 2
+
+
+def _ewma(prev, sample):
+    if prev is None:
+        return sample
+    return ((1.0 - _ewma_alpha) * prev) + (_ewma_alpha * sample)
+
+
+def _network(host):
+    """coarse network identity used for route diversity, the /16 prefix of
+    an IPv4 address or the last two labels of a host name"""
+    parts = host.split('.')
+    if len(parts) == 4 and all(p.isdigit() for p in parts):
+        return '.'.join(parts[:2])
+    return '.'.join(parts[-2:])
+
+
+def _parse_peer(p):
+    # peers are listed as "host:port" strings or {"host":, "port":} objects
+    if isinstance(p, dict):
+        host = p.get('host')
+        port = p.get('port', 7754)
+    else:
+        host, sep, port = str(p).rpartition(':')
+        if not sep:
+            host, port = port, 7754
+    if not host:
+        return None
+    try:
+        return (host, int(port))
+    except ValueError:
+        return None
+
+
+class PeerStats (object):
+    """EWMA latency and failure rate of a store, shared by PeerManager
+    (probes) and MsgStorePool (syncs and fetches). Callers serialize
+    access to record()"""
+    def __init__(self, store):
+        self.store = store
+        self.latency = None
+        self.failure = 0.0
+        self.probes = 0
+        self.failures = 0
+        self.last_probe = 0
+        self.skew = 0
+
+    def record(self, elapsed, ok):
+        self.probes += 1
+        self.last_probe = time.time()
+        if ok:
+            self.latency = _ewma(self.latency, elapsed)
+            self.failure = _ewma(self.failure, 0.0)
+        else:
+            self.failures += 1
+            self.latency = _ewma(self.latency, _failure_penalty)
+            self.failure = _ewma(self.failure, 1.0)
+
+    def score(self):
+        latency = self.latency
+        if latency is None:
+            latency = _failure_penalty
+        return latency + (self.failure * _failure_penalty)
+
+    def alive(self):
+        return (self.latency is not None) and (self.failure <= _max_failure)
+
+
+class PeerManager (object):
+    """Tracks message store peers. Peers are probed (status and time
+    endpoints) in the background and scored by EWMA latency and EWMA
+    failure rate. best_store() picks the fastest live store for reads and
+    build_route() picks onion relays from the fastest live peers, spread
+    over distinct networks where possible"""
+    def __init__(self, seeds=None, client=None,
+                 interval=_default_probe_interval,
+                 workers=_default_probe_workers):
+        self.client = client
+        self.interval = interval
+        self.peers = {}
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._thread = None
+        self._stop = Event()
+        if seeds is not None:
+            for s in seeds:
+                if isinstance(s, MsgStore):
+                    self.add_store(s)
+                else:
+                    self.add_peer(*s)
+
+    def add_store(self, store):
+        _require_sync(store)
+        key = store._hostport()
+        self._lock.acquire()
+        if key not in self.peers:
+            self.peers[key] = PeerStats(store)
+        stats = self.peers[key]
+        self._lock.release()
+        return stats.store
+
+    def add_peer(self, host, port=7754):
+        key = host + ':' + str(port)
+        self._lock.acquire()
+        stats = self.peers.get(key)
+        self._lock.release()
+        if stats is not None:
+            return stats.store
+        return self.add_store(MsgStore(host, port, client=self.client))
+
+    def _record(self, stats, elapsed, ok):
+        self._lock.acquire()
+        stats.record(elapsed, ok)
+        self._lock.release()
+
+    def probe(self, stats):
+        """probes status (refreshing the host key) and time"""
+        store = stats.store
+        t0 = time.time()
+        try:
+            ok = store.refresh()
+            if ok:
+                r = store.get(_server_time)
+                ok = r is not None
+                if ok:
+                    stats.skew = json.loads(r.decode())['time'] - time.time()
+        except Exception:
+            ok = False
+        # two requests per probe
+        self._record(stats, (time.time() - t0) / 2.0, ok)
+        return ok
+
+    def probe_all(self):
+        """probes every peer concurrently, returns the number which answered"""
+        self._lock.acquire()
+        peers = list(self.peers.values())
+        self._lock.release()
+        return list(self._executor.map(self.probe, peers)).count(True)
+
+    def discover(self):
+        """adds the peers listed by live stores, returns the number added"""
+        added = 0
+        for stats in self.ranked():
+            try:
+                listed = stats.store.get_peers()
+            except Exception:
+                listed = None
+            if listed is None:
+                continue
+            for p in listed:
+                hp = _parse_peer(p)
+                if hp is None:
+                    continue
+                key = hp[0] + ':' + str(hp[1])
+                if key not in self.peers:
+                    self.add_peer(*hp)
+                    added += 1
+        return added
+
+    def ranked(self):
+        """live peers, best score first"""
+        self._lock.acquire()
+        live = [p for p in self.peers.values() if p.alive()]
+        self._lock.release()
+        live.sort(key=lambda p: p.score())
+        return live
+
+    def best_store(self, exclude=None):
+        """fastest live store, or None"""
+        for stats in self.ranked():
+            if (exclude is None) or (stats.store not in exclude):
+                return stats.store
+        return None
+
+    def build_route(self, target, hops=_default_route_hops):
+        """returns a list of hops relays (first hop first) for an onion
+        request to target, or None if there are not enough live relays.
+        Relays are chosen among the fastest peers, never repeat a host:port
+        or use the target, and are drawn from distinct networks (not the
+        target's) when enough are available"""
+        exclude = target._hostport()
+        candidates = [p for p in self.ranked()
+                      if p.store._hostport() != exclude and p.store.Pkey is not None]
+        if len(candidates) < hops:
+            return None
+        # shuffle among the fastest candidates so routes vary
+        nfast = max(2 * hops, 4)
+        fast = candidates[:nfast]
+        random.shuffle(fast)
+        candidates = fast + candidates[nfast:]
+        route = []
+        networks = set([_network(target.host)])
+        for p in candidates:
+            net = _network(p.store.host)
+            if net in networks:
+                continue
+            networks.add(net)
+            route.append(p.store)
+            if len(route) == hops:
+                return route
+        # not enough distinct networks, fill with the fastest remaining
+        for p in candidates:
+            if p.store not in route:
+                route.append(p.store)
+                if len(route) == hops:
+                    break
+        return route
+
+    def metrics(self):
+        self._lock.acquire()
+        m = {}
+        for key, p in self.peers.items():
+            m[key] = {'latency': p.latency, 'failure': p.failure,
+                      'probes': p.probes, 'failures': p.failures,
+                      'skew': p.skew, 'alive': p.alive()}
+        self._lock.release()
+        return m
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.probe_all()
+            self.discover()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        self._executor.shutdown()
@@ -0,0 +1,268 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Lock, Thread
+
+from ciphrtxt.network import HeaderSnapshot, _require_sync
+from ciphrtxt.peers import _ewma
+_default_sync_workers = 4
+_default_min_interval = 1.0 # seconds
+_default_max_interval = 120.0 # seconds
+# new headers we aim to pick up per sync, the interval follows
+# target / arrival rate
+_default_target_arrivals = 1.0
+# a store which fails every sync is synced this many times less often
+_failure_slowdown = 4.0
+
+
+class StoreSchedule (object):
+    """sync state of one store. snapshot is the store's HeaderSnapshot as
+    of its last sync"""
+    def __init__(self, store, interval):
+        self.store = store
+        self.interval = interval
+        self.next_sync = 0
+        self.last_sync = None
+        self.rate = None
+        self.failure = 0.0
+        self.errors = 0
+        self.syncs = 0
+        self.failures = 0
+        self.running = False
+        self.snapshot = HeaderSnapshot()
+
+
+class SyncScheduler (object):
+    """Synchronizes the headers of many MsgStores in the background, at
+    most workers at a time. Each store is synced again after an interval
+    derived from its EWMA arrival rate (new headers per second) so that
+    about target new headers are picked up per sync, bounded by
+    min_interval and max_interval. Failures back off exponentially and
+    stores which fail often are synced less often. After each sync the
+    store's headers are published as an immutable snapshot, readers call
+    snapshot() and never wait on network I/O. callback (if given) is
+    called from a worker with (store, new headers) after each sync"""
+    def __init__(self, stores=None, workers=_default_sync_workers,
+                 min_interval=_default_min_interval,
+                 max_interval=_default_max_interval,
+                 target=_default_target_arrivals, callback=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target = target
+        self.callback = callback
+        self.schedules = {}
+        self._merged = ()
+        self._merged_version = -1
+        self._version = 0
+        self._lock = Lock()
+        self._wake = Condition(self._lock)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._thread = None
+        self._stopping = False
+        if stores is not None:
+            for s in stores:
+                self.add_store(s)
+
+    def add_store(self, store):
+        _require_sync(store)
+        key = store._hostport()
+        self._lock.acquire()
+        if key not in self.schedules:
+            self.schedules[key] = StoreSchedule(store, self.min_interval)
+            self._wake.notify()
+        sched = self.schedules[key]
+        self._lock.release()
+        return sched
+
+    def remove_store(self, store):
+        self._lock.acquire()
+        sched = self.schedules.pop(store._hostport(), None)
+        if sched is not None:
+            self._version += 1
+        self._lock.release()
+        return sched is not None
+
+    def _interval(self, sched):
+        if sched.errors > 0:
+            interval = self.min_interval * (2 ** sched.errors)
+        elif (sched.rate is None) or (sched.rate <= 0.0):
+            # nothing arriving, back off gradually
+            interval = sched.interval * 2
+        else:
+            interval = self.target / sched.rate
+        interval *= 1.0 + (_failure_slowdown - 1.0) * sched.failure
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def _publish(self, sched):
+        snapshot = sched.store.headers
+        known = sched.snapshot.ids
+        added = [h for h in snapshot if h.Iraw() not in known]
+        sched.snapshot = snapshot
+        return added
+
+    def sync(self, sched):
+        """syncs one store now and reschedules it, returns success"""
+        store = sched.store
+        t0 = time.time()
+        if store._sub_live:
+            # a subscription already keeps the headers current
+            ok = True
+        else:
+            try:
+                store.cache_dirty = True
+                ok = store._sync_headers()
+            except Exception:
+                ok = False
+        added = []
+        if ok:
+            added = self._publish(sched)
+        now = time.time()
+        self._lock.acquire()
+        sched.syncs += 1
+        if ok:
+            if sched.last_sync is not None:
+                # the first sync fetches the backlog, not new arrivals
+                rate = len(added) / max(now - sched.last_sync, 1e-3)
+                sched.rate = _ewma(sched.rate, rate)
+            sched.last_sync = now
+            sched.errors = 0
+            fail = 0.0
+        else:
+            sched.failures += 1
+            sched.errors += 1
+            fail = 1.0
+        sched.failure = _ewma(sched.failure, fail)
+        sched.interval = self._interval(sched)
+        sched.next_sync = t0 + sched.interval
+        sched.running = False
+        if ok:
+            self._version += 1
+        self._wake.notify()
+        self._lock.release()
+        if ok and (self.callback is not None) and (len(added) > 0):
+            self.callback(store, added)
+        return ok
+
+    def _due(self, now):
+        # called with the lock held, marks the returned schedules running
+        due = [s for s in self.schedules.values()
+               if (not s.running) and (s.next_sync <= now)]
+        due.sort(key=lambda s: s.next_sync)
+        for s in due:
+            s.running = True
+        return due
+
+    def sync_due(self):
+        """syncs every store which is due and waits for them, returns the
+        number which synced successfully"""
+        self._lock.acquire()
+        due = self._due(time.time())
+        self._lock.release()
+        return list(self._executor.map(self.sync, due)).count(True)
+
+    def snapshot(self, store=None):
+        """the headers of store as of its last sync or, without store, the
+        deduplicated union of all stores (newest first)"""
+        self._lock.acquire()
+        if store is not None:
+            sched = self.schedules.get(store._hostport())
+            self._lock.release()
+            if sched is None:
+                return ()
+            return sched.snapshot
+        if self._merged_version == self._version:
+            merged = self._merged
+            self._lock.release()
+            return merged
+        version = self._version
+        snapshots = [s.snapshot for s in self.schedules.values()]
+        self._lock.release()
+        unique = {}
+        for snap in snapshots:
+            for h in snap:
+                unique.setdefault(h.Iraw(), h)
+        merged = tuple(sorted(unique.values(), reverse=True))
+        self._lock.acquire()
+        if version >= self._merged_version:
+            self._merged = merged
+            self._merged_version = version
+        self._lock.release()
+        return merged
+
+    def metrics(self):
+        self._lock.acquire()
+        m = {}
+        for key, s in self.schedules.items():
+            m[key] = {'interval': s.interval, 'rate': s.rate,
+                      'failure': s.failure, 'syncs': s.syncs,
+                      'failures': s.failures, 'headers': len(s.snapshot),
+                      'next_sync': s.next_sync}
+        self._lock.release()
+        return m
+
+    def _run(self):
+        self._lock.acquire()
+        while not self._stopping:
+            now = time.time()
+            due = self._due(now)
+            if len(due) > 0:
+                self._lock.release()
+                for s in due:
+                    self._executor.submit(self.sync, s)
+                self._lock.acquire()
+                continue
+            idle = [s.next_sync for s in self.schedules.values() if not s.running]
+            delay = self.max_interval
+            if len(idle) > 0:
+                delay = max(min(idle) - now, 0.0)
+            # woken early by add_store, a finished sync or stop
+            self._wake.wait(delay)
+        self._lock.release()
+
+    def start(self):
+        if self._thread is None:
+            self._stopping = False
+            self._thread = Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._lock.acquire()
+            self._stopping = True
+            self._wake.notify()
+            self._lock.release()
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        self._executor.shutdown()
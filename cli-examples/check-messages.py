@@ -29,6 +29,7 @@
 from ciphrtxt.message import Message
 from ciphrtxt.keys import PrivateKey
 from ciphrtxt.network import MsgStore, CTClient
+from ciphrtxt.headercache import HeaderCache
 from argparse import ArgumentParser
 import time
 import dateutil.parser as duparser
@@ -38,6 +39,7 @@ parser = ArgumentParser(description='check server for messages, output list of m
 parser.add_argument('recipient', help='recipient private key')
 parser.add_argument('--host', default='ciphrtxt.com', help='hostname or IP address of server')
 parser.add_argument('--port', default=7754, help='specify server port (default = 7754)')
+parser.add_argument('--cache', default=None, help='persist synchronized headers to (sqlite) file')
 #parser.add_argument('--since', default=None, help='only look for messages posted after date/time (default = forever)')
 clargs = parser.parse_args()
 
@@ -55,8 +57,12 @@ if k is None:
     print('Error: Invalid recipient private key', file=sys.stderr)
     exit()
 
+cache = None
+if clargs.cache is not None:
+    cache = HeaderCache(clargs.cache)
+
 with CTClient() as c:
-    ms = MsgStore(str(clargs.host), int(clargs.port))
+    ms = MsgStore(str(clargs.host), int(clargs.port), cache=cache)
     reachable = ms.refresh()
     if not reachable:
         print('Error: host unreachable', file=sys.stderr)
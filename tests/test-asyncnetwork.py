@@ -0,0 +1,164 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from ciphrtxt.asyncnetwork import AsyncMsgStore
+from ciphrtxt.network import MsgStore, CTClient
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.federation import MsgStorePool
+from ciphrtxt.scheduler import SyncScheduler
+from ciphrtxt.peers import PeerManager
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message, RawMessageHeader
+import asyncio
+import time
+import tornado.ioloop
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpriv = PrivateKey()
+Bpriv.randomize(4)
+Bpub = PublicKey.deserialize(Bpriv.serialize_pubkey())
+
+mtxt = 'the quick brown fox jumped over the lazy dog'
+
+print('encoding messages')
+msgs = []
+for i in range(0, 8):
+    msgs.append(Message.encode(mtxt + (' %d' % i), Bpub, Apriv, nbits=8))
+
+peers = [{'host': 'violet.ciphrtxt.com', 'port': 7754},
+         {'host': 'indigo.ciphrtxt.com', 'port': 7754}]
+
+server = LocalMsgStore(peers=peers).start()
+for msg in msgs[:6]:
+    assert server.add_message(msg.serialize()) is not None
+print('local server at ' + server.baseurl())
+
+async def run_test1():
+    m = AsyncMsgStore(server.host, server.port, concurrency=4, timeout=5.0)
+    assert await m.refresh()
+    assert m.Pkey == server.Pkey
+    print('AsyncMsgStore opened as ' + str(m))
+    hdrs = await m.get_headers()
+    assert len(hdrs) == 6
+    # newest first
+    for i in range(1, len(hdrs)):
+        assert hdrs[i-1] >= hdrs[i]
+    p = await m.get_peers()
+    assert p == peers
+    # concurrent downloads, bounded by the store semaphore
+    rmsgs = await asyncio.gather(*[m.get_message(h) for h in hdrs])
+    for h, rm in zip(hdrs, rmsgs):
+        assert rm is not None
+        assert rm.Iraw() == h.Iraw()
+        assert rm.decode(Bpriv)
+    byid = await m.get_message_by_id(hdrs[0].Iraw())
+    assert byid == rmsgs[0]
+    # post and confirm the new message is visible to a fresh client
+    for msg in msgs[6:]:
+        r = await m.post_message(msg)
+        assert r is not None
+        print('message posted, server metadata ' + r.decode())
+    m2 = AsyncMsgStore(server.host, server.port)
+    hdrs2 = await m2.get_headers()
+    assert len(hdrs2) == 8
+    for msg in msgs:
+        assert RawMessageHeader.deserialize(msg.serialize()) in hdrs2
+    rm = await m2.get_message_by_id(msgs[7].Iraw())
+    assert rm.serialize() == msgs[7].serialize()
+    # unknown messages and unreachable servers return None
+    assert await m2.get_message_by_id('02' + ('0' * 64)) is None
+    dead = AsyncMsgStore('127.0.0.1', 1, timeout=1.0)
+    t0 = time.time()
+    assert not await dead.sync_headers()
+    assert await dead.get_peers() is None
+    assert (time.time() - t0) < 5.0
+
+extra = Message.encode(mtxt + ' extra', Bpub, Apriv, nbits=8)
+
+async def run_test2():
+    # bulk download, results arrive as they complete
+    m = AsyncMsgStore(server.host, server.port)
+    hdrs = list(await m.get_headers())
+    missing = RawMessageHeader.deserialize(extra.serialize())
+    got = []
+    errors = []
+    async for (h, rm, err) in m.get_messages(hdrs + [missing], concurrency=3):
+        if err is not None:
+            errors.append(h)
+            continue
+        assert rm.Iraw() == h.Iraw()
+        got.append(h)
+    assert len(got) == len(hdrs)
+    assert errors == [missing]
+    # unreachable server reports an error per message after retries
+    dead = AsyncMsgStore('127.0.0.1', 1, timeout=1.0)
+    dead.headers = hdrs[:2]
+    async for (h, rm, err) in dead.get_messages(hdrs[:2], retries=1, sync=False):
+        assert rm is None
+        assert err is not None
+
+tornado.ioloop.IOLoop.current().run_sync(run_test1)
+
+tornado.ioloop.IOLoop.current().run_sync(run_test2)
+
+# synchronous generator over the async client
+ms = MsgStore(server.host, server.port, client=CTClient())
+hdrs = ms.get_headers()
+n = 0
+for (h, rm, err) in ms.get_messages(hdrs, concurrency=4):
+    assert err is None
+    assert rm.Iraw() == h.Iraw()
+    n += 1
+assert n == len(hdrs)
+# consumer may stop early
+for (h, rm, err) in ms.get_messages(hdrs, concurrency=2):
+    break
+
+# the synchronous consumers refuse the async wrapper, but take its store
+am = AsyncMsgStore(server.host, server.port, client=ms.client)
+assert not isinstance(am, MsgStore)
+for consumer in (MsgStorePool(), SyncScheduler(), PeerManager()):
+    try:
+        consumer.add_store(am)
+        assert False
+    except TypeError:
+        pass
+    consumer.add_store(am.store)
+    consumer.close()
+# the wrapped store keeps the blocking MsgStore methods
+assert am.store.refresh() is True
+assert am.Pkey == server.Pkey
+assert len(am.store.get_headers()) == len(hdrs)
+assert am.headers is am.store.headers
+# an async view of an existing store shares its state
+av = AsyncMsgStore(store=ms)
+assert av.headers is ms.headers and av.Pkey == ms.Pkey
+
+server.stop()
+print('async network tests passed')
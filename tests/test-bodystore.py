@@ -0,0 +1,79 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from ciphrtxt.bodystore import MessageBodyStore
+import os
+import tempfile
+import time
+
+tmpdir = tempfile.mkdtemp()
+
+now = int(time.time())
+
+# small segments to force rolling
+s = MessageBodyStore(tmpdir, segment_size=1024)
+bodies = {}
+for i in range(0, 40):
+    key = '02%064x' % i
+    raw = (b'M' + (b'%03d' % i) * 64)
+    expire = now + 100 if (i % 4) == 0 else now - 10 if (i < 20) else now + 200
+    assert s.append(key, expire, raw)
+    bodies[key] = (expire, raw)
+assert not s.append('02%064x' % 0, now + 100, b'duplicate')
+nseg = len([f for f in os.listdir(tmpdir) if f.endswith('.seg')])
+print('stored ' + str(len(s)) + ' messages in ' + str(nseg) + ' segments')
+assert nseg > 1
+
+for (k, (e, raw)) in bodies.items():
+    v = s.get(k)
+    assert isinstance(v, memoryview)
+    assert v == raw
+assert s.get(b'03' + b'0' * 64) is None
+s.close()
+
+# reopen and compact
+s = MessageBodyStore(tmpdir, segment_size=1024)
+assert len(s) == len(bodies)
+reclaimed = s.compact(now)
+print('compaction reclaimed ' + str(reclaimed) + ' bytes')
+assert reclaimed > 0
+for (k, (e, raw)) in bodies.items():
+    if e < now:
+        assert k not in s
+        assert s.get(k) is None
+    else:
+        assert s.get(k.encode()) == raw
+assert s.compact(now) == 0
+s.close()
+
+s = MessageBodyStore(tmpdir, segment_size=1024)
+for (k, (e, raw)) in bodies.items():
+    if e >= now:
+        assert s.get(k) == raw
+s.close()
+print('body store tests passed')
@@ -0,0 +1,79 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from ciphrtxt.network import CTClient, MsgStore
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message
+import http.client
+import json
+import time
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+
+# arrivals spread over the past week
+now = int(time.time())
+server = LocalMsgStore().start()
+for i in range(0, 40):
+    msg = Message.encode('message %d' % i, Bpub, Apriv, nbits=8)
+    server.add_message(msg.serialize(), now=now - (i * 4 * 3600))
+
+def window(since, until=None):
+    path = '/api/v2/headers?since=' + str(since)
+    if until is not None:
+        path += '&until=' + str(until)
+    conn = http.client.HTTPConnection(server.host, server.port)
+    conn.request('GET', path)
+    hlist = json.loads(conn.getresponse().read().decode())['header_list']
+    conn.close()
+    return hlist
+
+# until is exclusive, adjacent windows partition the headers
+split = now - (10 * 4 * 3600)
+assert len(window(0)) == 40
+assert len(window(0, split)) == 29
+assert len(window(split)) == 11
+assert sorted(window(0, split) + window(split)) == sorted(window(0))
+assert len(window(now + 1, now + 2)) == 0
+
+with CTClient() as c:
+    whole = MsgStore(server.host, server.port).get_headers()
+    for windows in (2, 8, 64):
+        m = MsgStore(server.host, server.port)
+        hdrs = m.get_headers(windows=windows)
+        assert [h.Iraw() for h in hdrs] == [h.Iraw() for h in whole]
+        assert m.servertime > 0
+    # only the cold start is partitioned
+    server.add_message(Message.encode('late', Bpub, Apriv, nbits=8).serialize())
+    m.cache_dirty = True
+    assert len(m.get_headers(windows=8)) == 41
+
+server.stop()
+print('bootstrap tests passed')
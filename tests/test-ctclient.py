@@ -0,0 +1,205 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from ciphrtxt.network import CTClient, MsgStore, PooledHTTPClient
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message
+from tornado.httpclient import HTTPRequest
+from threading import Thread
+import http.client
+import socket
+import socketserver
+import time
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+
+server = LocalMsgStore().start()
+for i in range(0, 4):
+    msg = Message.encode('message %d' % i, Bpub, Apriv, nbits=8)
+    server.add_message(msg.serialize())
+hostport = server.host + ':' + str(server.port)
+
+# explicit per-instance client, connections are reused between requests
+c = CTClient(pool_size=2, idle_timeout=30).open()
+m = MsgStore(server.host, server.port, client=c)
+assert m.refresh()
+pool = c.sclient.pools[hostport]
+assert len(pool._idle) == 1
+conn = pool._idle[0][0]
+hdrs = m.get_headers()
+assert len(hdrs) == 4
+for h in hdrs:
+    assert m.get_message(h) is not None
+assert len(pool._idle) == 1
+assert pool._idle[0][0] is conn
+print('synchronous requests reused one connection')
+
+# stale pooled connections (closed by the server) are replaced transparently
+conn.close()
+assert m.get_peers() == []
+
+# a kept-alive connection which the server drops while idle is detected
+# on reuse and the request is retried on a fresh connection
+accepted = []
+class DroppingHandler (socketserver.BaseRequestHandler):
+    def handle(self):
+        accepted.append(self.client_address)
+        data = b''
+        while b'\r\n\r\n' not in data:
+            chunk = self.request.recv(4096)
+            if len(chunk) == 0:
+                return
+            data += chunk
+        body = b'{"time": 1}'
+        # no Connection: close, the client keeps the connection
+        self.request.sendall(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: ' + str(len(body)).encode() +
+                             b'\r\n\r\n' + body)
+        # returning closes the socket
+
+dropper = socketserver.ThreadingTCPServer(('127.0.0.1', 0), DroppingHandler)
+dropper.daemon_threads = True
+Thread(target=dropper.serve_forever, daemon=True).start()
+url = 'http://127.0.0.1:' + str(dropper.server_address[1]) + '/api/v2/time/'
+pc = PooledHTTPClient(pool_size=2, idle_timeout=30)
+r = pc.fetch(HTTPRequest(url))
+assert r.code == 200 and r.body == b'{"time": 1}'
+dpool = list(pc.pools.values())[0]
+assert len(dpool._idle) == 1
+time.sleep(0.2)
+r = pc.fetch(HTTPRequest(url))
+assert r.code == 200 and r.body == b'{"time": 1}'
+assert len(accepted) == 2
+pc.close()
+dropper.shutdown()
+dropper.server_close()
+
+# a connection dropped after the request was read is only retried for an
+# idempotent request, a POST body is never delivered twice. Timeouts are
+# never retried
+received = []
+class AnswerOnceHandler (socketserver.BaseRequestHandler):
+    delay = 0
+    def _read_request(self):
+        data = b''
+        while b'\r\n\r\n' not in data:
+            chunk = self.request.recv(4096)
+            if len(chunk) == 0:
+                return False
+            data += chunk
+        head, sep, body = data.partition(b'\r\n\r\n')
+        length = 0
+        for line in head.split(b'\r\n')[1:]:
+            k, sep, v = line.partition(b':')
+            if k.strip().lower() == b'content-length':
+                length = int(v)
+        while len(body) < length:
+            body += self.request.recv(4096)
+        received.append(head.split(b' ')[0] + b' ' + body)
+        return True
+
+    def handle(self):
+        if not self._read_request():
+            return
+        time.sleep(self.delay)
+        self.request.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+        # reads the next request on this connection, then drops it unanswered
+        self._read_request()
+
+answerer = socketserver.ThreadingTCPServer(('127.0.0.1', 0), AnswerOnceHandler)
+answerer.daemon_threads = True
+Thread(target=answerer.serve_forever, daemon=True).start()
+url = 'http://127.0.0.1:' + str(answerer.server_address[1]) + '/'
+pc = PooledHTTPClient(pool_size=2, idle_timeout=30, timeout=0.5)
+assert pc.fetch(HTTPRequest(url)).code == 200
+try:
+    pc.fetch(HTTPRequest(url, method='POST', body=b'upload-1'))
+    assert False
+except (http.client.HTTPException, OSError):
+    pass
+assert received == [b'GET ', b'POST upload-1']
+# the same drop is retried for a GET
+del received[:]
+assert pc.fetch(HTTPRequest(url)).code == 200
+assert pc.fetch(HTTPRequest(url)).code == 200
+assert received == [b'GET ', b'GET ', b'GET ']
+pc.close()
+# a reply slower than the timeout fails once, without a second attempt
+del received[:]
+AnswerOnceHandler.delay = 1.5
+pc = PooledHTTPClient(pool_size=2, idle_timeout=30, timeout=0.5)
+t0 = time.time()
+try:
+    pc.fetch(HTTPRequest(url, method='POST', body=b'upload-2'))
+    assert False
+except socket.timeout:
+    pass
+assert (time.time() - t0) < 1.0
+assert received == [b'POST upload-2']
+pc.close()
+answerer.shutdown()
+answerer.server_close()
+
+# idle connections past idle_timeout are not reused
+c2 = CTClient(pool_size=2, idle_timeout=0).open()
+m2 = MsgStore(server.host, server.port, client=c2)
+assert m2.refresh()
+conn2 = c2.sclient.pools[hostport]._idle[0][0]
+assert m2.refresh()
+assert c2.sclient.pools[hostport]._idle[0][0] is not conn2
+
+# separate clients in separate threads have separate pools
+results = []
+def worker():
+    tc = CTClient().open()
+    tm = MsgStore(server.host, server.port, client=tc)
+    results.append(len(tm.get_headers()))
+    results.append(tc.sclient)
+    tc.close()
+threads = [Thread(target=worker) for i in range(0, 4)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+assert results[0::2] == [4, 4, 4, 4]
+assert len(set(id(p) for p in results[1::2])) == 4
+
+# context manager still sets the default client
+with CTClient() as dc:
+    assert isinstance(dc, CTClient)
+    m3 = MsgStore(server.host, server.port)
+    assert m3.refresh()
+    assert hostport in dc.sclient.pools
+
+c.close()
+c2.close()
+server.stop()
+print('client pool tests passed')
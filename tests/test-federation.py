@@ -0,0 +1,183 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from ciphrtxt.federation import MsgStorePool, CircuitBreaker
+from ciphrtxt.network import MsgStore, CTClient
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.msgcache import MessageCache
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message
+import time
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+
+msgs = []
+for i in range(0, 9):
+    msgs.append(Message.encode('message %d' % i, Bpub, Apriv, nbits=8))
+
+violet = LocalMsgStore().start()
+indigo = LocalMsgStore().start()
+# 0-5 on violet, 3-8 on indigo, 3-5 on both
+for msg in msgs[:6]:
+    violet.add_message(msg.serialize())
+for msg in msgs[3:]:
+    indigo.add_message(msg.serialize())
+
+with CTClient() as c:
+    sv = MsgStore(violet.host, violet.port)
+    si = MsgStore(indigo.host, indigo.port)
+    dead = MsgStore('127.0.0.1', 1)
+    pool = MsgStorePool([sv, si, dead])
+    hdrs = pool.get_headers()
+    print('merged ' + str(len(hdrs)) + ' headers from ' + str(len(pool.stores)) + ' stores')
+    assert len(hdrs) == 9
+    for i in range(1, len(hdrs)):
+        assert hdrs[i-1] >= hdrs[i]
+    for h in hdrs:
+        holders = pool.holders_of(h)
+        assert dead not in holders
+        ids = set(m.Iraw() for m in msgs[3:6])
+        if h.Iraw() in ids:
+            assert len(holders) == 2
+        else:
+            assert len(holders) == 1
+    assert pool.peers[dead._hostport()].latency > pool.peers[sv._hostport()].latency
+    assert pool.peers[dead._hostport()].failures == 1
+    for h in hdrs:
+        m = pool.get_message(h)
+        assert m is not None
+        assert m.Iraw() == h.Iraw()
+    # fastest holder wins, a failing holder falls back to the next one
+    shared = [h for h in hdrs if len(pool.holders_of(h)) == 2][0]
+    pool.peers[sv._hostport()].latency = 0.001
+    pool.peers[si._hostport()].latency = 0.5
+    assert pool.holders_of(shared)[0] is sv
+    violet.stop()
+    assert pool.get_message(shared) is not None
+    assert pool.holders_of(shared)[0] is si
+    pool.close()
+
+indigo.stop()
+
+# circuit breaker
+b = CircuitBreaker(threshold=3, reset=10)
+for i in range(0, 3):
+    assert b.allow(now=100)
+    b.failure(now=100)
+assert b.state == CircuitBreaker.OPEN
+assert not b.allow(now=105)
+# half open after reset, one trial only
+assert b.allow(now=111)
+assert not b.allow(now=111)
+b.failure(now=111)
+assert b.state == CircuitBreaker.OPEN
+assert b.allow(now=122)
+b.success()
+assert b.state == CircuitBreaker.CLOSED
+assert b.trips == 2 and b.rejected == 2
+
+# hedged fetch, a slow holder is overtaken by the second one
+class SlowStore (MsgStore):
+    delay = 0
+    def get_message_by_id(self, msgid):
+        time.sleep(self.delay)
+        return super(SlowStore, self).get_message_by_id(msgid)
+
+violet = LocalMsgStore().start()
+indigo = LocalMsgStore().start()
+for msg in msgs:
+    violet.add_message(msg.serialize())
+    indigo.add_message(msg.serialize())
+
+with CTClient() as c:
+    slow = SlowStore(violet.host, violet.port)
+    fast = SlowStore(indigo.host, indigo.port)
+    pool = MsgStorePool([slow, fast], hedge_min_delay=0.02)
+    hdrs = pool.get_headers()
+    assert len(hdrs) == 9
+    for h in hdrs[:4]:
+        assert pool.get_message(h) is not None
+    assert pool.hedges == 0
+    pool.peers[slow._hostport()].latency = 0.0
+    pool.peers[fast._hostport()].latency = 1.0
+    slow.delay = 1.0
+    t0 = time.time()
+    assert pool.get_message(hdrs[5]) is not None
+    assert (time.time() - t0) < 0.5
+    assert pool.hedges == 1 and pool.hedge_wins == 1
+    # without hedging the slow holder is waited for
+    pool.hedge = False
+    pool.peers[slow._hostport()].latency = 0.0
+    t0 = time.time()
+    assert pool.get_message(hdrs[6]) is not None
+    assert (time.time() - t0) >= 1.0
+    slow.delay = 0
+
+    # a failing host trips its breaker and is skipped
+    pool.hedge = True
+    violet.stop()
+    for h in hdrs:
+        pool.peers[slow._hostport()].latency = 0.0
+        pool.peers[slow._hostport()].failure = 0.0
+        assert pool.get_message(h) is not None
+    assert pool.breaker(slow).state == CircuitBreaker.OPEN
+    m = pool.metrics()
+    assert m['hosts'][slow._hostport()]['trips'] == 1
+    assert m['hosts'][slow._hostport()]['rejected'] > 0
+    pool.close()
+
+indigo.stop()
+
+# local answers (cached messages, headers synced within
+# _cache_expire_time) are not timed, only requests which reach the store
+blue = LocalMsgStore().start()
+for msg in msgs:
+    blue.add_message(msg.serialize())
+
+with CTClient() as c:
+    sb = MsgStore(blue.host, blue.port, msgcache=MessageCache())
+    pool = MsgStorePool([sb])
+    hdrs = pool.get_headers()
+    assert pool.get_message(hdrs[0]) is not None
+    latency = pool.peers[sb._hostport()].latency
+    samples = len(pool._samples)
+    for i in range(0, 5):
+        assert pool.get_message(hdrs[0]) is not None
+        assert pool.sync() == 1
+    assert pool.peers[sb._hostport()].latency == latency
+    assert len(pool._samples) == samples
+    # adding a store replaces (and shuts down) the sync executor
+    executor = pool._executor
+    pool.add_store(MsgStore(blue.host, blue.port + 1))
+    assert executor._shutdown and pool._executor is None
+    pool.close()
+
+blue.stop()
+print('federation tests passed')
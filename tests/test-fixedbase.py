@@ -0,0 +1,84 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from ciphrtxt.fixedbase import FixedBaseTable
+from ciphrtxt.network import CTClient, OnionHost
+from ciphrtxt.localserver import LocalMsgStore
+from ecpy.curves import curve_secp256k1
+from ecpy.point import Point, Generator
+from Crypto.Random import random
+
+_C = curve_secp256k1
+Point.set_curve(_C)
+Generator.set_curve(_C)
+_G = Generator.init(_C['G'][0], _C['G'][1])
+
+P = _G * random.randint(1, _C['n']-1)
+for window in (1, 4, 5):
+    t = FixedBaseTable(P, window=window)
+    for k in (1, 2, 15, 16, 17, (1 << 255) + 1, _C['n']-1):
+        assert t.mul(k) == P * k
+    for i in range(0, 20):
+        k = random.randint(1, _C['n']-1)
+        assert t.mul(k) == P * k
+print('fixed base multiplication matches')
+
+# table follows the host key
+server = LocalMsgStore().start()
+c = CTClient().open()
+oh = OnionHost(server.host, server.port, client=c)
+assert oh.refresh()
+# built lazily, hosts which never route onions do not pay for a table
+assert oh._table is None
+k = random.randint(1, _C['n']-1)
+assert oh._ecdh(k) == server.Pkey * k
+table = oh._table
+assert table is not None
+assert oh._ecdh(k + 1) == server.Pkey * (k + 1)
+assert oh._table is table
+# same key, table is kept
+assert oh.refresh()
+assert oh._table is table
+assert oh._ecdh(k) == server.Pkey * k
+assert oh._table is table
+server.stop()
+
+# server restarts with a new key, the table is dropped and rebuilt on use
+server2 = LocalMsgStore(port=server.port).start()
+assert oh.refresh()
+assert oh._table is None
+assert oh._ecdh(k) == server2.Pkey * k
+assert oh._table is not table
+server2.stop()
+c.close()
+
+# key given to the constructor (or assigned) builds a table on first use
+oh2 = OnionHost('127.0.0.1', 7754, Pkey=P)
+assert oh2._ecdh(k) == P * k
+oh2.Pkey = server2.Pkey
+assert oh2._ecdh(k) == server2.Pkey * k
+print('fixed base tests passed')
@@ -0,0 +1,73 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from ciphrtxt.headercache import HeaderCache
+import os
+import tempfile
+import time
+
+tmpdir = tempfile.mkdtemp()
+path = os.path.join(tmpdir, 'headers.db')
+
+now = int(time.time())
+hostA = 'violet.ciphrtxt.com:7754'
+hostB = 'indigo.ciphrtxt.com:7754'
+
+c = HeaderCache(path)
+assert c.servertime(hostA) == 0
+assert c.load(hostA) == []
+
+c.update(hostA, now, [('02aa', now + 100, 'header-aa'),
+                      ('03bb', now + 200, 'header-bb'),
+                      ('02cc', now - 10, 'header-cc')])
+c.update(hostB, now - 50, [('02aa', now + 100, 'header-aa')])
+c.close()
+
+# reopen, state must survive process restart
+c = HeaderCache(path)
+assert c.servertime(hostA) == now
+assert c.servertime(hostB) == now - 50
+hdrs = c.load(hostA, now)
+print('cached headers for ' + hostA + ' : ' + str(hdrs))
+assert sorted(hdrs) == ['header-aa', 'header-bb']
+assert c.load(hostB, now) == ['header-aa']
+
+# replacing a header is idempotent
+c.update(hostA, now + 1, [('02aa', now + 100, 'header-aa')])
+assert len(c.load(hostA, now)) == 2
+assert c.servertime(hostA) == now + 1
+
+c.expire(hostA, now + 150)
+assert c.load(hostA, now) == ['header-bb']
+
+c.forget(hostA)
+assert c.servertime(hostA) == 0
+assert c.load(hostA, now) == []
+assert c.load(hostB, now) == ['header-aa']
+c.close()
+print('header cache tests passed')
@@ -0,0 +1,120 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from ciphrtxt.network import HeaderStreamParser, MsgStore, CTClient
+from ciphrtxt.asyncnetwork import AsyncMsgStore
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message
+import http.client
+import json
+import tornado.ioloop
+
+# parser, every possible chunking of a small document
+hlist = ['TQIAAGrW+/abc=', 'M0100:0000:abcd', 'with \"quote\" and \\\\ slash', '']
+doc = json.dumps({'other': ['x', ']'], 'header_list': hlist}).encode()
+for size in range(1, len(doc) + 1):
+    got = []
+    p = HeaderStreamParser(got.append)
+    for i in range(0, len(doc), size):
+        p.feed(doc[i:i + size])
+    assert p.done
+    assert got == hlist, str(size) + ' ' + str(got)
+got = []
+p = HeaderStreamParser(got.append)
+p.feed(b'{"header_list": ["abc", "de')
+assert got == ['abc']
+assert not p.done
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+
+server = LocalMsgStore().start()
+for i in range(0, 20):
+    msg = Message.encode('message %d' % i, Bpub, Apriv, nbits=8)
+    server.add_message(msg.serialize())
+
+with CTClient() as c:
+    ms = MsgStore(server.host, server.port)
+    whole = ms.get_headers()
+    mstream = MsgStore(server.host, server.port)
+    streamed = mstream.get_headers(stream=True)
+    assert len(streamed) == 20
+    assert [h.Iraw() for h in streamed] == [h.Iraw() for h in whole]
+    # resync with nothing new
+    mstream.cache_dirty = True
+    assert len(mstream.get_headers(stream=True)) == 20
+    # without a HeaderCache no raw header strings are kept while streaming
+    batches = []
+    class RecordingStore (MsgStore):
+        def _merge_header(self, rstr, known, cached, added):
+            batches.append(cached)
+            return super(RecordingStore, self)._merge_header(rstr, known, cached, added)
+    mrec = RecordingStore(server.host, server.port)
+    assert len(mrec.get_headers(stream=True)) == 20
+    assert len(batches) == 20 and all(b is None for b in batches)
+
+async def run_test1():
+    am = AsyncMsgStore(server.host, server.port)
+    hdrs = await am.get_headers(stream=True)
+    assert [h.Iraw() for h in hdrs] == [h.Iraw() for h in whole]
+
+tornado.ioloop.IOLoop.current().run_sync(run_test1)
+
+server.stop()
+
+# compressed responses, decoded incrementally by the pooled client
+zserver = LocalMsgStore(compress=True, peers=['127.0.0.1:7754']).start()
+for (t, e, h) in server.headers:
+    zserver.headers.append((t, e, h))
+conn = http.client.HTTPConnection(zserver.host, zserver.port)
+conn.request('GET', '/api/v2/headers?since=0', headers={'Accept-Encoding': 'gzip'})
+resp = conn.getresponse()
+zbody = resp.read()
+assert resp.getheader('Content-Encoding') == 'gzip'
+assert len(zbody) < len(json.dumps({'header_list': zserver.headers_since(0)}))
+conn.close()
+
+with CTClient() as c:
+    for stream in (False, True):
+        mz = MsgStore(zserver.host, zserver.port)
+        hdrs = mz.get_headers(stream=stream)
+        assert [h.Iraw() for h in hdrs] == [h.Iraw() for h in whole]
+    assert mz.get_peers() == ['127.0.0.1:7754']
+
+async def run_test2():
+    am = AsyncMsgStore(zserver.host, zserver.port)
+    hdrs = await am.get_headers(stream=True)
+    assert [h.Iraw() for h in hdrs] == [h.Iraw() for h in whole]
+    assert await am.get_peers() == ['127.0.0.1:7754']
+
+tornado.ioloop.IOLoop.current().run_sync(run_test2)
+
+zserver.stop()
+print('header stream tests passed')
@@ -0,0 +1,88 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from ciphrtxt.keypool import SessionKeyPool, session_key_pool, set_session_key_pool
+from ciphrtxt.keypool import generate_session_key
+from ecpy.curves import curve_secp256k1
+from ecpy.point import Point, Generator
+import time
+
+_C = curve_secp256k1
+Point.set_curve(_C)
+Generator.set_curve(_C)
+_G = Generator.init(_C['G'][0], _C['G'][1])
+
+k, kG = generate_session_key()
+assert kG == _G * k
+
+# synchronous fill, pairs are valid and never handed out twice
+p = SessionKeyPool(depth=16, threads=0)
+p.fill()
+assert len(p) == 16
+seen = set()
+for i in range(0, 16):
+    k, kG = p.get()
+    assert kG == _G * k
+    assert k not in seen
+    seen.add(k)
+assert len(p) == 0
+assert p.hits == 16
+# empty pool generates inline
+k, kG = p.get()
+assert kG == _G * k
+assert p.misses == 1
+p.stop()
+
+# refill threads top the pool back up
+p = SessionKeyPool(depth=8, threads=2).start()
+for i in range(0, 100):
+    if len(p) == 8:
+        break
+    time.sleep(0.05)
+assert len(p) == 8
+for i in range(0, 6):
+    p.get()
+for i in range(0, 100):
+    if len(p) == 8:
+        break
+    time.sleep(0.05)
+assert len(p) == 8
+p.stop()
+print('key pool hits %d misses %d' % (p.hits, p.misses))
+
+# onion requests draw from the module default
+prev = set_session_key_pool(SessionKeyPool(depth=4, threads=0))
+assert session_key_pool() is not prev
+session_key_pool().fill()
+from ciphrtxt.network import OnionRequest
+r = OnionRequest()
+r._format_get('api/v2/time/', None)
+assert r.reply_Pkey == _G * r.reply_pkey
+assert session_key_pool().hits == 1
+session_key_pool().stop()
+set_session_key_pool(prev)
+print('key pool tests passed')
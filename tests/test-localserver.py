@@ -0,0 +1,88 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from ciphrtxt.network import CTClient, MsgStore
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message
+from threading import Thread
+import time
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+big = Message.encode('x' * 100000, Bpub, Apriv, nbits=8)
+
+c = CTClient().open()
+
+# no injection
+with LocalMsgStore() as server:
+    m = MsgStore(server.host, server.port, client=c)
+    t0 = time.time()
+    assert m.refresh()
+    assert (time.time() - t0) < 0.1
+
+# every request is delayed by latency, concurrent requests overlap
+with LocalMsgStore(latency=0.2) as server:
+    m = MsgStore(server.host, server.port, client=c)
+    t0 = time.time()
+    assert m.refresh()
+    t = time.time() - t0
+    assert t >= 0.2 and t < 0.4
+    results = []
+    def worker():
+        tm = MsgStore(server.host, server.port, client=CTClient().open())
+        results.append(tm.refresh())
+    threads = [Thread(target=worker) for i in range(0, 8)]
+    t0 = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [True] * 8
+    assert (time.time() - t0) < 1.0
+print('latency injection ok')
+
+# responses are delayed by their transfer time
+with LocalMsgStore(bandwidth=1000000) as server:
+    server.add_message(big.serialize())
+    m = MsgStore(server.host, server.port, client=c)
+    hdrs = m.get_headers()
+    t0 = time.time()
+    assert m.get_message(hdrs[0]) is not None
+    t = time.time() - t0
+    expect = len(big.serialize()) / 1000000.0
+    assert t >= expect and t < expect + 0.2
+    # uploads count against the bandwidth too
+    t0 = time.time()
+    msg = Message.encode('y' * 100000, Bpub, Apriv, nbits=8)
+    assert m.post_message(msg) is not None
+    assert (time.time() - t0) >= expect
+print('bandwidth injection ok')
+
+c.close()
+print('local server tests passed')
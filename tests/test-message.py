@@ -245,3 +245,104 @@ for i in range(0,test_msgs):
             assert not mdie.decode(pkey[j])
             assert not mdct.decode(pkey[j])
             assert not mad.is_from(Pkey[j])
+
+# serialize_into writes the same bytes as serialize, into bytearray or
+# memoryview targets at any offset, before (uncached) and after (cached)
+# the serialization is cached
+for ver in versions:
+    m = Message.encode(mtxt * 3, bobP, alice, version=ver)
+    assert m._serialized is None
+    size = m.serialized_size()
+    buf = bytearray(size + 16)
+    assert m.serialize_into(buf, 7) == size
+    raw = m.serialize()
+    assert m._serialized is not None
+    assert size == len(raw)
+    assert bytes(buf[7:7 + size]) == raw
+    assert bytes(buf[:7]) == bytes(7) and bytes(buf[7 + size:]) == bytes(9)
+    assert m.serialized_size() == size
+    for target in (bytearray(size), memoryview(bytearray(size + 3))):
+        assert m.serialize_into(target) == size
+        assert bytes(target[:size]) == raw
+    mv = memoryview(bytearray(size + 5))
+    assert m.serialize_into(mv, 5) == size
+    assert bytes(mv[5:]) == raw
+    # deserialized from a buffer, the wire bytes are reused
+    md = Message.deserialize(memoryview(bytearray(raw)))
+    assert md.serialized_size() == size
+    out = bytearray(size + 1)
+    assert md.serialize_into(out, 1) == size
+    assert bytes(out[1:]) == raw
+    assert md.serialize() == raw
+    assert md.serialize_header() == m.serialize_header()
+    if ver == '0200':
+        assert md._short_header_v2() == m._short_header_v2()
+        assert md._sig_block_v2() == m._sig_block_v2()
+        # uncached v2 path writes header, signature block and ciphertext
+        mu = Message.encode(mtxt, bobP, alice, version=ver)
+        assert mu._serialized is None
+        out = memoryview(bytearray(mu.serialized_size() + 2))
+        n = mu.serialize_into(out, 2)
+        assert n == mu.serialized_size()
+        assert bytes(out[2:]) == mu.serialize()
+
+# deserialized messages are lazy: points are decompressed on first access
+# and the address mask is tested on the compressed I
+for ver in versions:
+    m = Message.encode(mtxt, bobP, alice, version=ver)
+    raw = m.serialize()
+    md = Message.deserialize(raw)
+    assert md._I is None and md._J is None and md._K is None
+    assert md.Iraw() == m.Iraw() and md._I is None
+    assert md.I == m.I and md._I is not None
+    assert md._J is None
+    assert md.K == m.K and md.J == m.J
+    other = None
+    for j in range(0, 100):
+        k = PrivateKey()
+        k.randomize(4)
+        if not Message.deserialize(raw)._addr_match(k):
+            other = k
+            break
+    assert other is not None
+    md = Message.deserialize(raw)
+    assert not md.is_for(other)
+    assert md._I is None and md._J is None
+    assert md._addr_match(bob)
+    assert md.decode(bob)
+    assert md.ptxt == mtxt
+
+    # equality of received messages compares the wire bytes
+    assert Message.deserialize(raw) == Message.deserialize(raw)
+    assert Message.deserialize(raw) == m
+    assert m == Message.deserialize(raw)
+    # assigning a field drops the cached wire bytes
+    mt = Message.deserialize(raw)
+    assert mt.serialize() == raw
+    assert mt._serialized is not None
+    mt.expire += 1
+    assert mt._serialized is None
+    assert mt.serialize() != raw
+    assert mt != Message.deserialize(raw)
+    mt = Message.deserialize(raw)
+    mt.ctxt = mt.ctxt[:-1]
+    assert mt._serialized is None
+    assert mt.serialize() != raw
+
+m1 = Message.deserialize(Message.encode(mtxt, bobP, alice, version='0100').serialize())
+m2 = Message.deserialize(Message.encode(mtxt, bobP, alice, version='0200').serialize())
+assert m1 != m2 and m2 != m1
+assert m1 == Message.deserialize(m1.serialize())
+assert m2 == Message.deserialize(m2.serialize())
+
+# a corrupt v2 body is rejected on receipt, a bad body which slips through
+# fails decode() instead of raising
+raw = m2.serialize()
+body = len(raw) - 8
+for bad in (b'!', b'='):
+    corrupt = raw[:body] + bad + raw[body + 1:]
+    assert Message.deserialize(corrupt) is None
+mb = Message.deserialize(raw)
+mb._ctxt_b64 = memoryview(b'abcde')
+assert mb.ctxt is None
+assert not mb.decode(bob)
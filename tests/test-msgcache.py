@@ -0,0 +1,114 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from ciphrtxt.msgcache import MessageCache, LRUEviction, ExpireEviction
+from threading import Thread
+import time
+
+# stand-in for Message, the cache only relies on Iraw(), expire and
+# ciphertext_size()
+class FakeMessage (object):
+    def __init__(self, i, expire, size):
+        self._Iraw = ('02%064x' % i).encode()
+        self.expire = expire
+        self.ctxt = b'\x00' * size
+
+    def Iraw(self):
+        return self._Iraw
+
+    def ciphertext_size(self):
+        return len(self.ctxt)
+
+now = int(time.time())
+
+# LRU, bounded by bytes
+c = MessageCache(maxbytes=1000, policy=LRUEviction())
+msgs = [FakeMessage(i, now + 1000, 192) for i in range(0, 10)]
+for m in msgs[:5]:
+    assert c.put(m)
+assert c.bytes == 960
+assert c.get(msgs[0].Iraw()) is msgs[0]
+c.put(msgs[5])
+# msgs[1] is least recently used
+assert c.get(msgs[1].Iraw()) is None
+assert c.get(msgs[0].Iraw()) is msgs[0]
+assert c.bytes <= 1000
+assert not c.put(FakeMessage(99, now + 1000, 2000))
+print('lru metrics = ' + str(c.metrics()))
+assert c.metrics()['evictions'] == 1
+assert c.metrics()['hits'] == 2
+assert c.metrics()['misses'] == 1
+
+# expire aware
+c = MessageCache(maxbytes=1000, policy=ExpireEviction())
+for i in range(0, 5):
+    c.put(FakeMessage(i, now + 100 * (5 - i), 192))
+c.put(FakeMessage(5, now + 1000, 192))
+# message 4 expires soonest
+assert FakeMessage(4, 0, 0).Iraw() not in c
+assert FakeMessage(0, 0, 0).Iraw() in c
+c.put(FakeMessage(10, now - 1, 192))
+assert c.get(FakeMessage(10, 0, 0).Iraw()) is None
+assert c.metrics()['expirations'] == 1
+c.discard(FakeMessage(0, 0, 0).Iraw())
+assert len(c) == 3
+print('expire metrics = ' + str(c.metrics()))
+
+# re-putting and discarding keys does not grow the heap without bound
+policy = ExpireEviction()
+c = MessageCache(maxbytes=192 * 10, policy=policy)
+for i in range(0, 5000):
+    c.put(FakeMessage(i % 3, now + 1000 + i, 192))
+    if (i % 7) == 0:
+        c.discard(FakeMessage(i % 3, 0, 0).Iraw())
+assert len(policy._heap) <= 2 * max(len(c), 16)
+for i in range(0, 20):
+    c.put(FakeMessage(100 + i, now + 100 + i, 192))
+assert len(c) == 10
+assert FakeMessage(100, 0, 0).Iraw() not in c
+assert FakeMessage(119, 0, 0).Iraw() in c
+assert len(policy._heap) <= 2 * max(len(c), 16)
+
+# shared between threads
+c = MessageCache(maxbytes=192 * 50)
+def worker(base):
+    for i in range(0, 500):
+        m = FakeMessage(base + (i % 20), now + 1000, 192)
+        if c.get(m.Iraw()) is None:
+            c.put(m)
+threads = [Thread(target=worker, args=(t * 40,)) for t in range(0, 4)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+mt = c.metrics()
+print('threaded metrics = ' + str(mt))
+assert mt['bytes'] == 192 * mt['entries']
+assert mt['bytes'] <= 192 * 50
+assert mt['hits'] + mt['misses'] == 2000
+print('message cache tests passed')
@@ -0,0 +1,107 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from ciphrtxt.network import CTClient, MsgStore, MultipartProducer
+from ciphrtxt.network import encode_multipart_formdata
+from ciphrtxt.asyncnetwork import AsyncMsgStore
+from ciphrtxt.bodystore import MessageBodyStore
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message
+import asyncio
+import shutil
+import tempfile
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+
+# streamed body is identical to the joined one
+raw = Message.encode('x' * 200000, Bpub, Apriv, nbits=8).serialize()
+content_type, body = encode_multipart_formdata([('a', 'b')], [('message', 'message', raw.decode())])
+p = MultipartProducer([('a', 'b')], [('message', 'message', raw)])
+streamed = b''.join(bytes(c) for c in p)
+assert p.content_type == content_type
+assert p.length == len(streamed)
+assert streamed.replace(b"b'message'", b'message') == body.encode().replace(b"b'message'", b'message')
+assert max(len(c) for c in p) <= MultipartProducer._chunk_size
+print('multipart body is %d bytes in %d chunks' % (p.length, len(list(p))))
+
+server = LocalMsgStore().start()
+c = CTClient().open()
+
+# synchronous upload through the pooled client
+m = MsgStore(server.host, server.port, client=c)
+assert m.refresh()
+msg = Message.encode('streamed upload', Bpub, Apriv, nbits=8)
+assert m.post_message(msg) is not None
+assert server.messages[msg.Iraw().decode()] == msg.serialize()
+
+# upload sourced from a body store segment
+tmpdir = tempfile.mkdtemp()
+bodies = MessageBodyStore(tmpdir)
+m2 = MsgStore(server.host, server.port, bodies=bodies, client=c)
+assert m2.refresh()
+msg2 = Message.encode('x' * 100000, Bpub, Apriv, nbits=8)
+raw2 = msg2.serialize()
+bodies.append(msg2.Iraw(), msg2.expire, raw2)
+assert isinstance(m2._body_source(msg2, raw2), memoryview)
+assert m2.post_message(msg2) is not None
+assert server.messages[msg2.Iraw().decode()] == raw2
+bodies.close()
+shutil.rmtree(tmpdir)
+
+# asynchronous upload through tornado body_producer
+async def run_async():
+    am = AsyncMsgStore(server.host, server.port)
+    assert await am.refresh()
+    msg3 = Message.encode('async streamed upload', Bpub, Apriv, nbits=8)
+    assert await am.post_message(msg3) is not None
+    assert server.messages[msg3.Iraw().decode()] == msg3.serialize()
+asyncio.run(run_async())
+
+# callback interface of a direct (not onion routed) request, the upload is
+# streamed from the producer and the callback gets the reply body
+async def run_callbacks():
+    ac = CTClient().open()
+    mc = MsgStore(server.host, server.port, client=ac)
+    replies = []
+    r = await mc.get('api/v2/time/', callback=replies.append)
+    assert r is not None and replies == [r]
+    msg4 = Message.encode('streamed upload with callback', Bpub, Apriv, nbits=8)
+    r = await mc.post_message(msg4, callback=replies.append)
+    assert r is not None and replies[1] == r
+    assert server.messages[msg4.Iraw().decode()] == msg4.serialize()
+    # an error reply calls back with None
+    r = await mc.get('api/v2/messages/' + ('0' * 66), callback=replies.append)
+    assert r is None and replies[2] is None
+    ac.close()
+asyncio.run(run_callbacks())
+
+c.close()
+server.stop()
+print('multipart tests passed')
@@ -0,0 +1,159 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from ciphrtxt.network import CTClient, MsgStore, BinaryOnionRequest, OnionRequest
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.message import Message, OnionHeader, _v2_blocksize
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.nak import NAK
+from ecpy.curves import curve_secp256k1
+from ecpy.point import Point, Generator
+from Crypto.Random import random
+import asyncio
+import json
+from binascii import hexlify
+
+_C = curve_secp256k1
+Point.set_curve(_C)
+Generator.set_curve(_C)
+_G = Generator.init(_C['G'][0], _C['G'][1])
+
+nak = NAK()
+nak.randomize()
+
+# header round trip, headers are padded to whole blocks
+reply = _G * random.randint(1, _C['n']-1)
+h = OnionHeader()
+assert h._generate_local('api/v2/time/', 2, nak, reply, method='GET', extra_blocks=1, bodylen=300) is not None
+assert (len(h.header) + 116) % _v2_blocksize == 0
+h2 = OnionHeader.deserialize(h.header)
+assert h2.local and h2.method == 'get' and h2.path == b'api/v2/time/'
+assert h2.blocksin == 3 and h2.blocksout == 2 and h2.bodylen == 300
+assert hexlify(h2.replykey) == reply.compress()
+r = OnionHeader()
+assert r._generate_remote('127.0.0.1', 7754, 4, nak) is not None
+r2 = OnionHeader.deserialize(r.header)
+assert (not r2.local) and r2.host == b'127.0.0.1' and r2.port == 7754
+assert OnionHeader.deserialize(b'\x01Xzz') is None
+
+# wrap / unwrap with a relay key
+relay_k = random.randint(1, _C['n']-1)
+relay_P = _G * relay_k
+k = random.randint(1, _C['n']-1)
+body = b'x' * 300
+packet = h.wrap(relay_P * k, _G * k, body, nak)
+assert len(packet) % _v2_blocksize == 0
+got = OnionHeader.unwrap(relay_k, packet)
+assert got is not None
+assert bytes(got[1]) == body
+# wrong key or tampered header is rejected
+assert OnionHeader.unwrap(relay_k + 1, packet) is None
+bad = bytearray(packet)
+bad[120] ^= 1
+assert OnionHeader.unwrap(relay_k, bytes(bad)) is None
+# sealed replies
+ek = random.randint(1, _C['n']-1)
+sealed = OnionHeader.seal_reply(relay_k, _G * ek, b'reply body')
+assert OnionHeader.open_reply(relay_P, relay_P * ek, sealed) == b'reply body'
+assert OnionHeader.open_reply(_G * ek, relay_P * ek, sealed) is None
+print('onion packet format ok')
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+
+relays = [LocalMsgStore().start() for i in range(0, 3)]
+target = LocalMsgStore().start()
+c = CTClient().open()
+onions = [MsgStore(rs.host, rs.port, client=c) for rs in relays]
+ms = MsgStore(target.host, target.port, client=c)
+ms.request_class = BinaryOnionRequest
+assert ms.refresh()
+
+for n in range(0, 4):
+    r = ms.get('api/v2/time/', nak=nak, onions=onions[:n])
+    assert r is not None
+    assert 'time' in json.loads(r.decode())
+
+    req = BinaryOnionRequest(c)
+    entry, packet = req.encode(ms, 'api/v2/time/', nak=nak, onions=onions[:n])
+    assert len(packet) % _v2_blocksize == 0
+    print('%d hops, %d byte packet' % (n + 1, len(packet)))
+
+# post a message through two relays
+msg = Message.encode('onion routed message', Bpub, Apriv, nbits=8)
+assert ms.post_message(msg, nak=nak, onions=onions[:2]) is not None
+assert msg.Iraw().decode() in target.messages
+
+# an onion request without relays is sent straight to the target
+r = BinaryOnionRequest(c).get(ms, 'api/v2/peers/', nak=nak, onions=[])
+assert json.loads(r.decode()) == []
+
+# JSON onion format through the same relays
+mj = MsgStore(target.host, target.port, client=c)
+assert mj.refresh()
+for n in range(0, 3):
+    r = mj.get('api/v2/time/', nak=nak, onions=onions[:n])
+    assert r is not None
+    assert 'time' in json.loads(r)
+msg = Message.encode('json onion routed message', Bpub, Apriv, nbits=8)
+assert mj.post_message(msg, nak=nak, onions=onions[:1]) is not None
+assert msg.Iraw().decode() in target.messages
+
+# coroutine interface, replies are decrypted in the reply executor
+async def run_async():
+    ac = CTClient().open()
+    futures = [BinaryOnionRequest(ac).fetch_async(ms, 'api/v2/time/', nak=nak, onions=onions[:n % 3])
+               for n in range(0, 12)]
+    futures += [OnionRequest(ac).fetch_async(mj, 'api/v2/time/', nak=nak, onions=onions[:n % 3])
+                for n in range(0, 6)]
+    for r in await asyncio.gather(*futures):
+        assert 'time' in json.loads(r)
+    ac.close()
+asyncio.run(run_async())
+
+# callback interface, also decrypted off the loop, callback gets the reply
+async def run_callbacks():
+    ac = CTClient().open()
+    replies = []
+    futures = [BinaryOnionRequest(ac).get(ms, 'api/v2/time/', nak=nak, onions=onions[:n],
+                                          callback=replies.append) for n in range(0, 3)]
+    futures += [OnionRequest(ac).get(mj, 'api/v2/time/', nak=nak, onions=onions[:n],
+                                     callback=replies.append) for n in range(0, 3)]
+    results = await asyncio.gather(*futures)
+    assert len(replies) == 6
+    for r in results:
+        assert r in replies
+        assert 'time' in json.loads(r)
+    ac.close()
+asyncio.run(run_callbacks())
+
+c.close()
+for rs in relays:
+    rs.stop()
+target.stop()
+print('onion tests passed')
@@ -0,0 +1,95 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from ciphrtxt.peers import PeerManager, _network, _parse_peer
+from ciphrtxt.network import CTClient, BinaryOnionRequest
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.nak import NAK
+import json
+import time
+
+assert _network('10.1.2.3') == '10.1'
+assert _network('violet.ciphrtxt.com') == 'ciphrtxt.com'
+assert _parse_peer('violet.ciphrtxt.com:7754') == ('violet.ciphrtxt.com', 7754)
+assert _parse_peer({'host': '10.0.0.1', 'port': 7755}) == ('10.0.0.1', 7755)
+assert _parse_peer('10.0.0.1') == ('10.0.0.1', 7754)
+
+servers = [LocalMsgStore().start() for i in range(0, 4)]
+# the first server lists the others, which are discovered from it
+servers[0].peers = ['127.0.0.1:' + str(s.port) for s in servers[1:]]
+dead = LocalMsgStore().start()
+dead.stop()
+
+c = CTClient().open()
+pm = PeerManager(seeds=[('127.0.0.1', servers[0].port), ('127.0.0.1', dead.port)], client=c)
+assert pm.probe_all() == 1
+assert pm.discover() == 3
+assert pm.probe_all() == 4
+assert len(pm.peers) == 5
+m = pm.metrics()
+assert not m['127.0.0.1:' + str(dead.port)]['alive']
+assert m['127.0.0.1:' + str(servers[0].port)]['alive']
+assert len(pm.ranked()) == 4
+
+# fastest store for reads
+best = pm.best_store()
+assert best is pm.ranked()[0].store
+assert best.port != dead.port
+pm.peers[best._hostport()].latency = 5.0
+assert pm.best_store() is not best
+
+# routes use live relays, never the target or a repeated relay
+target = pm.best_store()
+for i in range(0, 10):
+    route = pm.build_route(target, hops=2)
+    assert len(route) == 2
+    assert target not in route
+    assert route[0] is not route[1]
+    assert all(r.port != dead.port for r in route)
+assert pm.build_route(target, hops=4) is None
+
+# route is usable for onion requests
+nak = NAK()
+nak.randomize()
+route = pm.build_route(target, hops=3)
+r = BinaryOnionRequest(c).get(target, 'api/v2/time/', nak=nak, onions=route)
+assert 'time' in json.loads(r.decode())
+
+# background probing
+pm2 = PeerManager(seeds=[('127.0.0.1', servers[0].port)], client=c, interval=0.05).start()
+for i in range(0, 100):
+    if len(pm2.ranked()) == 4:
+        break
+    time.sleep(0.05)
+assert len(pm2.ranked()) == 4
+pm2.close()
+
+pm.close()
+c.close()
+for s in servers:
+    s.stop()
+print('peer manager tests passed')
@@ -0,0 +1,146 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import ciphrtxt.network
+from ciphrtxt.network import CTClient, MsgStore
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message
+from threading import Semaphore, Thread
+import time
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+
+msgs = []
+for i in range(0, 33):
+    msgs.append(Message.encode('queued message %d' % i, Bpub, Apriv, nbits=8))
+
+server = LocalMsgStore().start()
+c = CTClient().open()
+m = MsgStore(server.host, server.port, client=c)
+assert m.refresh()
+
+# enqueue returns immediately, uploads complete in the background
+futures = [m.queue_message(msg) for msg in msgs[:8]]
+assert m.flush_queue(timeout=30)
+for f in futures:
+    assert f.done()
+    assert f.result() is not None
+assert len(server.headers_since(0)) == 8
+assert len(m.get_headers()) == 8
+print('queued 8 messages')
+
+# already posted messages resolve to None without another upload
+f = m.queue_message(msgs[0])
+assert f.result(timeout=30) is None
+
+# shrink the water marks to exercise backpressure
+ciphrtxt.network._high_water = 4
+ciphrtxt.network._low_water = 2
+futures = [m.queue_message(msg) for msg in msgs[8:20]]
+assert len(m._post_queue) <= 4
+assert m.flush_queue(timeout=30)
+assert all(f.result() is not None for f in futures)
+assert len(server.headers_since(0)) >= 20
+
+# producers in other threads block until the queue drains
+results = []
+def producer(msg):
+    results.append(m.queue_message(msg))
+threads = [Thread(target=producer, args=(msg,)) for msg in msgs[20:]]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+assert m.flush_queue(timeout=30)
+assert all(f.result() is not None for f in results)
+
+# uploads held by gate: above the high water mark a producer waits until
+# the queue drains to the low water mark, not merely below the high one
+def wait_until(cond):
+    deadline = time.time() + 10
+    while not cond():
+        assert time.time() < deadline
+        time.sleep(0.01)
+gated = MsgStore(server.host, server.port, client=c)
+gate = Semaphore(0)
+gated_status = gated._post_status
+def gated_post(*args):
+    gate.acquire()
+    return gated_status(*args)
+gated._post_status = gated_post
+futures = [gated.queue_message(msg) for msg in msgs[24:28]]
+wait_until(lambda: gated._pq_inflight == 4)
+futures += [gated.queue_message(msg) for msg in msgs[28:32]]
+assert len(gated._post_queue) == 4
+assert gated.queue_message(msgs[32], block=False) is None
+blocked = Thread(target=lambda: futures.append(gated.queue_message(msgs[32])))
+blocked.start()
+# one upload completes, 3 queued is still above the low water mark
+gate.release()
+wait_until(lambda: len(gated._post_queue) == 3)
+time.sleep(0.2)
+assert blocked.is_alive()
+assert len(gated._post_queue) == 3
+# a second completes, the queue drains to 2 and the producer proceeds
+gate.release()
+blocked.join(10)
+assert not blocked.is_alive()
+for i in range(0, 7):
+    gate.release()
+assert gated.flush_queue(timeout=30)
+assert len(futures) == 9
+assert all(f.result() is not None for f in futures)
+print('backpressure ok')
+
+# a rejected upload (400 for a malformed message) is not retried
+bad = Message.deserialize(msgs[0].serialize())
+object.__setattr__(bad, '_serialized', b'A' * 256)
+rejected = MsgStore(server.host, server.port, client=c)
+attempts = []
+post_status = rejected._post_status
+def counting_post(*args):
+    attempts.append(args)
+    return post_status(*args)
+rejected._post_status = counting_post
+f = rejected.queue_message(bad)
+assert rejected.flush_queue(timeout=30)
+assert isinstance(f.exception(), IOError)
+assert '400' in str(f.exception())
+assert len(attempts) == 1
+
+# failures are retried and then surfaced through the future
+ciphrtxt.network._post_retry_delay = 0.01
+server.stop()
+msg = Message.encode('never delivered', Bpub, Apriv, nbits=8)
+f = m.queue_message(msg)
+assert m.flush_queue(timeout=30)
+assert f.exception() is not None
+c.close()
+print('post queue tests passed')
@@ -0,0 +1,125 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from ciphrtxt.bloom import BloomFilter
+from ciphrtxt.network import CTClient, MsgStore
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message
+import http.client
+import struct
+import time
+
+# no false negatives, false positive rate near the target
+keys = [('%066x' % i).encode() for i in range(0, 2000)]
+b = BloomFilter.for_capacity(1000, 0.01)
+for k in keys[:1000]:
+    b.add(k)
+assert all(k in b for k in keys[:1000])
+fp = len([k for k in keys[1000:] if k in b])
+print('false positives %d / 1000' % fp)
+assert fp < 30
+b2 = BloomFilter.deserialize(b.serialize())
+assert b2.salt == b.salt and b2.nbits == b.nbits and b2.nhashes == b.nhashes
+assert all(k in b2 for k in keys[:1000])
+# malformed filters are rejected before the bits are allocated
+hdr = struct.pack('>BBI', 1, b.nhashes, b.nbits) + b.salt
+bad = [b.serialize()[:-1], b.serialize() + b'\x00', b'junk', hdr[:-1],
+       b'\x02' + b.serialize()[1:],
+       struct.pack('>BBI', 1, 7, 0xffffffff) + b.salt,
+       struct.pack('>BBI', 1, 7, 4) + b.salt + b'\x00',
+       struct.pack('>BBI', 1, 0, 8) + b.salt + b'\x00',
+       struct.pack('>BBI', 1, 200, 8) + b.salt + b'\x00']
+for raw in bad:
+    try:
+        BloomFilter.deserialize(raw)
+        assert False
+    except ValueError:
+        pass
+assert BloomFilter.deserialize(hdr + bytes((b.nbits + 7) >> 3)).nbits == b.nbits
+# every filter has its own salt
+assert BloomFilter.for_capacity(10).salt != BloomFilter.for_capacity(10).salt
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+msgs = [Message.encode('message %d' % i, Bpub, Apriv, nbits=8) for i in range(0, 40)]
+
+server = LocalMsgStore().start()
+for msg in msgs[:30]:
+    server.add_message(msg.serialize())
+
+with CTClient() as c:
+    m = MsgStore(server.host, server.port)
+    assert len(m.get_headers(reconcile=True)) == 30
+    # an empty filter matches nothing, a full one (almost) everything
+    empty = BloomFilter.for_capacity(0)
+    assert len(server.headers_missing(empty)) == 30
+    full = BloomFilter.for_capacity(30)
+    for h in m.headers:
+        full.add(h.Iraw())
+    assert len(server.headers_missing(full)) == 0
+
+    # messages stamped before our servertime (clock skew, or a store we
+    # have not synced with) are missed by since= but found by reconcile
+    for msg in msgs[30:]:
+        server.add_message(msg.serialize(), now=int(time.time()) - 3600)
+    m.cache_dirty = True
+    assert len(m.get_headers()) == 30
+    for i in range(0, 3):
+        m.cache_dirty = True
+        hdrs = m.get_headers(reconcile=True)
+        if len(hdrs) == 40:
+            break
+    assert len(hdrs) == 40
+    for i in range(1, len(hdrs)):
+        assert hdrs[i-1] >= hdrs[i]
+
+    # switching to a second store only transfers what we do not have
+    other = LocalMsgStore().start()
+    for msg in msgs[20:]:
+        other.add_message(msg.serialize())
+    m2 = MsgStore(other.host, other.port)
+    m2.headers = list(hdrs[10:])
+    missing = [msg for msg in msgs[20:] if msg.Iraw() not in set(h.Iraw() for h in hdrs[10:])]
+    # a false positive can hide a header, the next (differently salted)
+    # reconcile finds it
+    for i in range(0, 3):
+        m2.cache_dirty = True
+        if len(m2.get_headers(reconcile=True)) == 30 + len(missing):
+            break
+    assert len(m2.headers) == 30 + len(missing)
+    other.stop()
+
+# a filter header claiming 4G bits is refused by the server
+conn = http.client.HTTPConnection(server.host, server.port)
+conn.request('POST', '/api/v2/headers/reconcile', struct.pack('>BBI', 1, 7, 0xffffffff) + bytes(16))
+assert conn.getresponse().status == 400
+conn.close()
+
+server.stop()
+print('reconcile tests passed')
@@ -0,0 +1,124 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from ciphrtxt.network import CTClient, MsgStore
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.scheduler import SyncScheduler
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message
+from threading import Lock
+import time
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+msgs = [Message.encode('message %d' % i, Bpub, Apriv, nbits=8) for i in range(0, 30)]
+
+class CountingStore (MsgStore):
+    # tracks how many syncs run at once across all instances
+    lock = Lock()
+    inflight = 0
+    peak = 0
+
+    def _sync_headers(self, *args, **kwargs):
+        CountingStore.lock.acquire()
+        CountingStore.inflight += 1
+        CountingStore.peak = max(CountingStore.peak, CountingStore.inflight)
+        CountingStore.lock.release()
+        try:
+            return super(CountingStore, self)._sync_headers(*args, **kwargs)
+        finally:
+            CountingStore.lock.acquire()
+            CountingStore.inflight -= 1
+            CountingStore.lock.release()
+
+busy = LocalMsgStore(latency=0.02).start()
+idle = LocalMsgStore(latency=0.02).start()
+dead = LocalMsgStore().start()
+deadport = dead.port
+dead.stop()
+for msg in msgs[:5]:
+    busy.add_message(msg.serialize())
+    idle.add_message(msg.serialize())
+
+added = []
+def on_sync(store, hdrs):
+    added.append((store._hostport(), len(hdrs)))
+
+with CTClient() as c:
+    sbusy = CountingStore(busy.host, busy.port)
+    sidle = CountingStore(idle.host, idle.port)
+    sdead = CountingStore('127.0.0.1', deadport)
+    sched = SyncScheduler([sbusy, sidle, sdead], workers=2, min_interval=0.05,
+                          max_interval=1.0, callback=on_sync)
+
+    # a synchronous pass publishes the first snapshots
+    assert sched.sync_due() == 2
+    assert len(sched.snapshot(sbusy)) == 5
+    assert len(sched.snapshot(sidle)) == 5
+    assert sched.snapshot(sdead) == ()
+    assert len(sched.snapshot()) == 5
+    assert sched.snapshot() is sched.snapshot()
+
+    sched.start()
+    for msg in msgs[5:]:
+        busy.add_message(msg.serialize())
+        time.sleep(0.1)
+    time.sleep(0.5)
+    # readers do not wait on the network
+    t0 = time.time()
+    snap = sched.snapshot()
+    assert (time.time() - t0) < 0.01
+    sched.stop()
+
+    m = sched.metrics()
+    print(m)
+    mbusy = m[sbusy._hostport()]
+    midle = m[sidle._hostport()]
+    mdead = m[sdead._hostport()]
+    assert mbusy['headers'] == 30
+    assert len(snap) == 30
+    assert mbusy['rate'] > 0
+    assert mbusy['interval'] < midle['interval']
+    assert midle['interval'] == 1.0
+    assert mdead['failures'] == mdead['syncs']
+    assert mdead['interval'] > mbusy['interval']
+    assert mbusy['syncs'] > midle['syncs'] > 0
+    assert CountingStore.peak <= 2
+    assert sum(n for (k, n) in added if k == sbusy._hostport()) == 30
+    for i in range(1, len(snap)):
+        assert snap[i-1] >= snap[i]
+
+    assert sched.remove_store(sidle)
+    assert not sched.remove_store(sidle)
+    assert sched.snapshot(sidle) == ()
+    sched.close()
+
+busy.stop()
+idle.stop()
+print('scheduler tests passed')
@@ -0,0 +1,148 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from ciphrtxt.network import CTClient, MsgStore, HeaderSnapshot, HeaderStreamParser
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message
+from threading import Lock, Thread
+import json
+
+class CountingLock (object):
+    def __init__(self):
+        self.lock = Lock()
+        self.count = 0
+
+    def acquire(self):
+        self.lock.acquire()
+        self.count += 1
+
+    def release(self):
+        self.lock.release()
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+msgs = [Message.encode('message %d' % i, Bpub, Apriv, nbits=8) for i in range(0, 60)]
+
+server = LocalMsgStore().start()
+for msg in msgs[:20]:
+    server.add_message(msg.serialize())
+
+with CTClient() as c:
+    m = MsgStore(server.host, server.port)
+    empty = m.headers
+    assert isinstance(empty, HeaderSnapshot) and len(empty) == 0
+    m._insert_lock = CountingLock()
+    first = m.get_headers()
+    assert isinstance(first, HeaderSnapshot)
+    assert len(first) == 20 and len(first.ids) == 20
+    assert first.version > empty.version
+    # one lock acquisition per batch, not per header
+    assert m._insert_lock.count == 1
+    for i in range(1, len(first)):
+        assert first[i-1] >= first[i]
+
+    # a sync publishes a new snapshot, earlier ones are unchanged
+    for msg in msgs[20:40]:
+        server.add_message(msg.serialize())
+    m.cache_dirty = True
+    second = m.get_headers()
+    assert len(first) == 20 and len(second) == 40
+    assert second.version > first.version
+    assert first.ids < second.ids
+    # nothing new, no new snapshot
+    m.cache_dirty = True
+    assert m.get_headers() is second
+
+    # readers iterate consistent snapshots while another thread syncs
+    errors = []
+    done = []
+    def reader():
+        while not done:
+            snap = m.headers
+            n = 0
+            for h in snap:
+                n += 1
+            if (n != len(snap)) or (n != len(snap.ids)):
+                errors.append(n)
+
+    readers = [Thread(target=reader) for i in range(0, 4)]
+    for t in readers:
+        t.start()
+    for msg in msgs[40:]:
+        server.add_message(msg.serialize())
+        m.cache_dirty = True
+        m.get_headers(stream=(len(m.headers) % 2 == 0))
+    done.append(True)
+    for t in readers:
+        t.join()
+    assert len(errors) == 0
+    assert len(m.headers) == 60
+
+    # expiry publishes a snapshot without the expired headers
+    full = m.headers
+    earliest = min(h.expire for h in full)
+    m._expire_headers(earliest)
+    assert m.headers is full
+    m._expire_headers(earliest + 1)
+    assert all(h.expire > earliest for h in m.headers)
+    assert len(m.headers) < 60 and len(full) == 60
+    assert len(m.headers.ids) == len(m.headers)
+
+    # assigned lists are wrapped in a snapshot
+    m.headers = list(second)
+    assert isinstance(m.headers, HeaderSnapshot)
+    assert m.headers.ids == second.ids
+
+    # an unordered batch is merged into the held headers in order
+    m2 = MsgStore(server.host, server.port)
+    m2.headers = full[0::2]
+    added = m2._swap_headers(list(reversed(full[1::2])) + [full[0]])
+    assert len(added) == 30
+    assert m2.headers.ids == full.ids
+    for i in range(1, len(m2.headers)):
+        assert m2.headers[i-1] >= m2.headers[i]
+
+    # a streamed response is published in batches, not once per chunk
+    ms = MsgStore(server.host, server.port)
+    ms._insert_lock = CountingLock()
+    known = set()
+    added = []
+    parser = HeaderStreamParser(lambda rstr: ms._merge_header(rstr, known, None, added))
+    feed = ms._chunk_merger(parser, added)
+    doc = json.dumps({'header_list': server.headers_since(0)}).encode()
+    for i in range(0, len(doc), 64):
+        feed(doc[i:i + 64])
+    assert parser.done and len(added) == 60
+    assert ms._insert_lock.count == 0
+    ms._finish_merge(0, None, added)
+    assert ms._insert_lock.count == 1 and len(ms.headers) == 60
+
+server.stop()
+print('snapshot tests passed')
@@ -0,0 +1,137 @@
+# Copyright (c) 2016, Joseph deBlaquiere <jadeblaquiere@yahoo.com>
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of ciphrtxt nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from ciphrtxt.network import CTClient, MsgStore
+from ciphrtxt.localserver import LocalMsgStore
+from ciphrtxt.keys import PrivateKey, PublicKey
+from ciphrtxt.message import Message
+from threading import Event, Lock
+import time
+
+Apriv = PrivateKey()
+Apriv.randomize(4)
+Bpub = PublicKey.deserialize(Apriv.serialize_pubkey())
+msgs = [Message.encode('message %d' % i, Bpub, Apriv, nbits=8) for i in range(0, 8)]
+
+received = []
+mine = []
+lock = Lock()
+arrived = Event()
+
+def on_headers(hdrs):
+    lock.acquire()
+    received.extend(hdrs)
+    mine.extend(h for h in hdrs if h.is_for(Apriv))
+    lock.release()
+    arrived.set()
+
+def wait_for(n, timeout=5.0):
+    t0 = time.time()
+    while (time.time() - t0) < timeout:
+        lock.acquire()
+        count = len(received)
+        lock.release()
+        if count >= n:
+            return True
+        arrived.wait(0.05)
+        arrived.clear()
+    return False
+
+server = LocalMsgStore().start()
+server.add_message(msgs[0].serialize())
+
+with CTClient() as c:
+    m = MsgStore(server.host, server.port)
+    assert m.subscribe(on_headers, timeout=2)
+    assert not m.subscribe(on_headers)
+    # catch up on what is already stored
+    assert wait_for(1)
+
+    # new headers are pushed while the poll is held open
+    time.sleep(0.2)
+    t0 = time.time()
+    server.add_message(msgs[1].serialize())
+    assert wait_for(2)
+    print('delivered in %.1f ms' % ((time.time() - t0) * 1000.0))
+    assert (time.time() - t0) < 1.0
+
+    # several within the same second, each delivered once
+    for msg in msgs[2:5]:
+        server.add_message(msg.serialize())
+    assert wait_for(5)
+    time.sleep(0.5)
+    assert len(received) == 5
+    assert len(mine) == 5
+    assert len(set(h.Iraw() for h in received)) == 5
+    assert len(m.headers) == 5
+    # no polling while subscribed
+    assert len(m.get_headers()) == 5
+
+    # restart the store on the same port, the subscription reconnects and
+    # catches up with since (the old cursor means nothing to the new store)
+    port = server.port
+    server.stop()
+    server = LocalMsgStore(port=port).start()
+    for msg in msgs[5:]:
+        server.add_message(msg.serialize())
+    assert wait_for(8)
+    assert len(m.headers) == 8
+
+    m.unsubscribe()
+    m.unsubscribe()
+    server.add_message(Message.encode('late', Bpub, Apriv, nbits=8).serialize())
+    time.sleep(0.5)
+    assert len(received) == 8
+
+# a poll held open longer than the client timeout does not time out
+class CountingStore (MsgStore):
+    polls = []
+    def _poll_headers(self, timeout):
+        added = super(CountingStore, self)._poll_headers(timeout)
+        self.polls.append(added)
+        return added
+c2 = CTClient(timeout=1).open()
+m2 = CountingStore(server.host, server.port, client=c2)
+received2 = []
+assert m2.subscribe(received2.extend, timeout=2)
+time.sleep(3)
+assert m2._sub_live
+assert len(m2.polls) >= 2
+assert None not in m2.polls
+n = len(server.headers_since(0)) + 1
+server.add_message(Message.encode('slow poll', Bpub, Apriv, nbits=8).serialize())
+t0 = time.time()
+while (len(received2) < n) and ((time.time() - t0) < 5.0):
+    time.sleep(0.05)
+assert len(received2) == n
+assert (time.time() - t0) < 1.0
+m2.unsubscribe()
+c2.close()
+
+server.stop()
+print('subscribe tests passed')